@@ -17,43 +17,151 @@ database_operations
 database_setup
     Handles the initialization and setup of the SQLite database.
 
+scheduler
+    Orders the crawl frontier by priority so the most valuable pages are crawled first.
+
+compact_schema
+    Compact archival export of a crawl database, with a size and query time benchmark.
+
+circuit_breaker
+    Keeps per-host circuit breakers so failing hosts do not stall the crawl.
+
+crawl_session
+    Records the progress of a crawl so an interrupted crawl can be resumed.
+
+exceptions
+    Defines the exceptions raised by the package.
+
+change_feed
+    Records changes to crawl results and streams them from a cursor.
+
+bounded_crawl
+    Crawls very large websites within a memory budget, through bounded fetch, parse and write stages.
+
+sitemap_stream
+    Streams the URLs of the sitemaps of a website without loading them all.
+
+orchestrator
+    Crawls several websites concurrently in one process, sharing the HTTP pool and the database.
+
+host_limiter
+    Caps the number of concurrent requests per host.
+
+cli
+    The command-line interface, also available as ``python -m bertha``.
+
 utils
-    Provides utility functions, including checking the HTTP status of URLs.
+    Provides utility functions, including checking the HTTP status of URLs and fetching pages with size limits.
+
+link_extraction
+    Extracts the internal links of a page from its HTML body.
+
+reports
+    Report queries for dashboards: indexible, redirected, failing and stale pages, and cached page counts.
+
+archive
+    Optional compressed, deduplicated archive of page bodies, replayable without network.
+
+retry_policy
+    Retries transient database and network errors with exponential backoff, and counts the retries.
+
+dns_cache
+    Caches DNS lookups and resolves the hosts of upcoming URLs ahead of their requests.
+
+link_graph
+    Builds the internal link graph of a website for inlink counts, click depth, orphan pages and PageRank.
 """
 
+import sys
+import types
+
 __version__ = "0.2.1"
 
-# Import key functions at the package level for easier access
-from bertha.database_setup import initialize_database
-from bertha.database_operations import (
-    insert_if_not_exists,
-    update_sitemaps_for_url,
-    update_crawl_info,
-    get_urls_to_crawl
-)
-from bertha.crawl_pages import crawl_pages
-from bertha.utils import check_http_status, get_content_type
-from bertha.database_operations import get_urls_to_crawl
-from bertha.main import (
-    crawl_website,
-    recrawl_website,
-    recrawl_url,
-    indexible_pages
-)
-
-
-__all__ = [
-    "initialize_database",
-    "insert_if_not_exists",
-    "update_sitemaps_for_url",
-    "update_crawl_info",
-    "get_urls_to_crawl",
-    "crawl_pages",
-    "check_http_status",
-    "crawl_website",
-    "recrawl_website",
-    "recrawl_url",
-    "get_content_type",
-    "normalize_url",
-    "indexible_pages"
-]
+# Key functions are available at the package level. They are imported on first access
+# (PEP 562), so `import bertha` stays cheap for short-lived jobs and the CLI.
+_LAZY_ATTRIBUTES = {
+    "initialize_database": "bertha.database_setup",
+    "insert_if_not_exists": "bertha.database_operations",
+    "update_sitemaps_for_url": "bertha.database_operations",
+    "update_crawl_info": "bertha.database_operations",
+    "get_urls_to_crawl": "bertha.database_operations",
+    "iter_urls_to_crawl": "bertha.database_operations",
+    "iter_website_data": "bertha.database_operations",
+    "crawl_pages": "bertha.crawl_pages",
+    "verify_redirects": "bertha.crawl_pages",
+    "check_http_status": "bertha.utils",
+    "get_content_type": "bertha.utils",
+    "fetch_page": "bertha.utils",
+    "normalize_url": "bertha.utils",
+    "extract_internal_links": "bertha.link_extraction",
+    "next_crawl_batch": "bertha.scheduler",
+    "refresh_crawl_priorities": "bertha.scheduler",
+    "migrate_to_compact": "bertha.compact_schema",
+    "benchmark_schemas": "bertha.compact_schema",
+    "HostCircuitBreakers": "bertha.circuit_breaker",
+    "CircuitBreaker": "bertha.circuit_breaker",
+    "find_resumable_session": "bertha.crawl_session",
+    "get_crawl_session": "bertha.crawl_session",
+    "BerthaError": "bertha.exceptions",
+    "DatabaseInitializationError": "bertha.exceptions",
+    "MainUrlInsertionError": "bertha.exceptions",
+    "SitemapRetrievalError": "bertha.exceptions",
+    "CrawlFrontierError": "bertha.exceptions",
+    "CrawlSessionError": "bertha.exceptions",
+    "crawl_website": "bertha.main",
+    "recrawl_website": "bertha.main",
+    "recrawl_url": "bertha.main",
+    "indexible_pages": "bertha.main",
+    "run_crawl_session": "bertha.main",
+    "crawl_website_bounded": "bertha.bounded_crawl",
+    "iter_sitemap_urls": "bertha.sitemap_stream",
+    "crawl_sites": "bertha.orchestrator",
+    "load_sites": "bertha.orchestrator",
+    "HostLimiter": "bertha.host_limiter",
+    "changes_since": "bertha.change_feed",
+    "latest_change_cursor": "bertha.change_feed",
+    "prune_changes": "bertha.change_feed",
+    "iter_indexible_pages": "bertha.reports",
+    "iter_status_pages": "bertha.reports",
+    "iter_stale_pages": "bertha.reports",
+    "site_counts": "bertha.reports",
+    "PageArchive": "bertha.archive",
+    "reextract_links": "bertha.archive",
+    "RetryPolicy": "bertha.retry_policy",
+    "retry_counters": "bertha.retry_policy",
+    "DnsCache": "bertha.dns_cache",
+    "dns_cache_adapter": "bertha.dns_cache",
+    "prefetch_hosts": "bertha.dns_cache",
+    "LinkGraph": "bertha.link_graph",
+    "analyze_link_graph": "bertha.link_graph",
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module 'bertha' has no attribute '{name}'")
+
+    import importlib
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value  # Later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # Importing bertha.crawl_pages binds the submodule on the package. Keep the
+        # function of the same name there instead, as the eager imports used to.
+        if isinstance(value, types.ModuleType) and _LAZY_ATTRIBUTES.get(name) == value.__name__:
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
+
+
+__all__ = list(_LAZY_ATTRIBUTES)
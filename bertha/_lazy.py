@@ -0,0 +1,28 @@
+# bertha/_lazy.py
+
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """
+    Returns a module that is only executed when one of its attributes is first used.
+
+    Used for heavy third-party dependencies, so that importing bertha, or running a
+    CLI command that never makes a request, does not pay for them.
+
+    :param name: The name of the module, e.g. 'requests'.
+    :return: The module, loaded or pending.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,379 @@
+# bertha/archive.py
+
+"""
+Archive of the page bodies fetched by the crawler.
+
+Without an archive, bodies are dropped once their links are extracted, and any later
+analysis needs the whole site fetched again. The archive is opt-in: pass a
+``PageArchive`` to ``crawl_website``, ``crawl_sites`` or ``crawl_pages`` (or use
+``--archive DIR`` on the command line) and every HTML body read is kept.
+
+- Bodies are content-addressed by their SHA-256 digest. A body already in the archive,
+  e.g. an unchanged page crawled again or the same page under several URLs, is stored
+  once.
+- Bodies are compressed with zstd when the ``zstandard`` package is installed and with
+  gzip otherwise. The codec is recorded per body, so archives written with either can
+  be read as long as the codec is available.
+- Compressed bodies are appended to segment files of up to ``segment_size`` bytes in
+  the archive directory. ``tb_archive_blobs`` holds the segment, offset and length of
+  every body, and ``tb_archive_pages`` the digest of the latest body of every URL.
+- Segments are read through memory maps, and ``iter_pages`` reads in segment order,
+  so replaying a site is a sequential read of the segment files.
+
+Only the bodies ``fetch_page`` read are archived: HTML, up to ``max_body_size`` bytes.
+A process must be the only writer of an archive directory; threads can share a
+``PageArchive``.
+
+Usage::
+
+    with PageArchive('archive', 'db_websites.db') as archive:
+        crawl_website('https://www.example.com', archive=archive)
+        for url, links in reextract_links(archive, 'https://www.example.com/', workers=4):
+            print(url, len(links))
+"""
+
+import gzip
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from bertha.database_operations import write_lock, store_internal_links
+from bertha.link_extraction import extract_internal_links
+from bertha.reports import prefix_range
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is used without it
+    zstandard = None
+
+DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024
+CODECS = ('zstd', 'gzip')
+
+
+def default_codec():
+    """
+    Returns the codec new archives use: zstd if the zstandard package is installed, else gzip.
+
+    :return: 'zstd' or 'gzip'.
+    """
+    return 'zstd' if zstandard is not None else 'gzip'
+
+
+def compress(data, codec):
+    """
+    Compresses a body.
+
+    :param data: The body, as bytes.
+    :param codec: 'zstd' or 'gzip'.
+    :return: The compressed bytes.
+    """
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == 'gzip':
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def decompress(data, codec):
+    """
+    Decompresses a body stored with a codec.
+
+    :param data: The compressed bytes.
+    :param codec: 'zstd' or 'gzip'.
+    :return: The body, as bytes.
+    """
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError("The archive holds zstd bodies; install the zstandard package to read them")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def initialize_archive(db_name='db_websites.db'):
+    """
+    Creates the index tables of the archive.
+
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    """
+    conn = sqlite3.connect(db_name, timeout=30)
+    try:
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS tb_archive_blobs (
+                digest TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                raw_length INTEGER NOT NULL
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS tb_archive_pages (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                content_type TEXT,
+                dt_archived TEXT
+            ) WITHOUT ROWID;
+
+            -- iter_pages reads the bodies in segment order through these
+            CREATE INDEX IF NOT EXISTS idx_archive_blobs_position ON tb_archive_blobs (segment, offset);
+            CREATE INDEX IF NOT EXISTS idx_archive_pages_digest ON tb_archive_pages (digest, url);
+        ''')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class PageArchive:
+    """
+    A content-addressed, compressed store of page bodies.
+
+    :param directory: The directory of the segment files. It is created if needed.
+    :param db_name: The database holding the archive index (default is 'db_websites.db').
+    :param codec: 'zstd' or 'gzip' for the bodies stored from now on. Defaults to default_codec().
+    :param segment_size: The size in bytes after which a new segment file is started.
+    """
+
+    def __init__(self, directory, db_name='db_websites.db', codec=None, segment_size=DEFAULT_SEGMENT_SIZE):
+        codec = codec or default_codec()
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec: {codec}")
+        if codec == 'zstd' and zstandard is None:
+            raise ImportError("The zstd codec needs the zstandard package")
+
+        self.directory = directory
+        self.db_name = db_name
+        self.codec = codec
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._writer = None
+
+        os.makedirs(directory, exist_ok=True)
+        initialize_archive(db_name)
+        with sqlite3.connect(db_name, timeout=30) as conn:
+            self._segment = conn.execute('SELECT COALESCE(MAX(segment), 1) FROM tb_archive_blobs').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def segment_path(self, segment):
+        """
+        Returns the path of a segment file.
+
+        :param segment: The segment number.
+        :return: The path.
+        """
+        return os.path.join(self.directory, f'segment-{segment:06d}.bin')
+
+    def _append(self, data):
+        # Bodies written after a crash but never indexed are left as unused bytes
+        if self._writer is None:
+            self._writer = open(self.segment_path(self._segment), 'ab')
+        offset = self._writer.tell()
+        if offset and offset + len(data) > self.segment_size:
+            self._writer.close()
+            self._segment += 1
+            self._writer = open(self.segment_path(self._segment), 'ab')
+            offset = self._writer.tell()
+        self._writer.write(data)
+        self._writer.flush()
+        return self._segment, offset
+
+    def store(self, url, body, content_type=None):
+        """
+        Archives the body of a page, unless an identical body is already archived.
+
+        :param url: The URL of the page.
+        :param body: The body, as bytes.
+        :param content_type: The Content-Type header of the page, if any.
+        :return: The SHA-256 hex digest of the body.
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        dt_archived = datetime.now().strftime('%Y%m%d%H%M%S')
+
+        # Compress outside the locks, so threads archiving different pages do not wait for each other
+        data = None
+        with sqlite3.connect(self.db_name, timeout=30) as conn:
+            if conn.execute('SELECT 1 FROM tb_archive_blobs WHERE digest = ?', (digest,)).fetchone() is None:
+                data = compress(body, self.codec)
+
+        with self._lock, write_lock(self.db_name), sqlite3.connect(self.db_name, timeout=30) as conn:
+            cursor = conn.cursor()
+            if data is not None:
+                cursor.execute('SELECT 1 FROM tb_archive_blobs WHERE digest = ?', (digest,))
+                if cursor.fetchone() is None:
+                    segment, offset = self._append(data)
+                    cursor.execute('''
+                        INSERT INTO tb_archive_blobs (digest, codec, segment, offset, length, raw_length)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (digest, self.codec, segment, offset, len(data), len(body)))
+            cursor.execute('''
+                INSERT OR REPLACE INTO tb_archive_pages (url, digest, content_type, dt_archived)
+                VALUES (?, ?, ?, ?)
+            ''', (url, digest, content_type, dt_archived))
+            conn.commit()
+        return digest
+
+    def _read(self, segment, offset, length):
+        with self._lock:
+            segment_map = self._maps.get(segment)
+            if segment_map is None or offset + length > len(segment_map):
+                # Map the segment again when it grew since it was mapped
+                if segment_map is not None:
+                    segment_map.close()
+                with open(self.segment_path(segment), 'rb') as segment_file:
+                    segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[segment] = segment_map
+            return segment_map[offset:offset + length]
+
+    def get(self, digest):
+        """
+        Returns an archived body by its digest.
+
+        :param digest: The SHA-256 hex digest of the body.
+        :return: The body, as bytes, or None if it is not archived.
+        """
+        with sqlite3.connect(self.db_name, timeout=30) as conn:
+            row = conn.execute(
+                'SELECT codec, segment, offset, length FROM tb_archive_blobs WHERE digest = ?', (digest,)
+            ).fetchone()
+        if row is None:
+            return None
+        codec, segment, offset, length = row
+        return decompress(self._read(segment, offset, length), codec)
+
+    def read(self, url):
+        """
+        Returns the latest archived body of a URL.
+
+        :param url: The URL of the page.
+        :return: A (body, content_type) tuple, or None if the URL is not archived.
+        """
+        with sqlite3.connect(self.db_name, timeout=30) as conn:
+            row = conn.execute('''
+                SELECT b.codec, b.segment, b.offset, b.length, p.content_type
+                FROM tb_archive_pages p
+                JOIN tb_archive_blobs b ON b.digest = p.digest
+                WHERE p.url = ?
+            ''', (url,)).fetchone()
+        if row is None:
+            return None
+        codec, segment, offset, length, content_type = row
+        return decompress(self._read(segment, offset, length), codec), content_type
+
+    def iter_pages(self, url_prefix=None, batch_size=1000):
+        """
+        Streams the archived pages, in the order their bodies are stored in the segments.
+
+        :param url_prefix: Only return the URLs starting with this prefix, if given.
+        :param batch_size: The number of index rows read from the database at a time.
+        :return: A generator of (url, body, content_type) tuples.
+        """
+        query = '''
+            SELECT b.segment, b.offset, p.url, b.codec, b.length, p.content_type
+            FROM tb_archive_blobs b
+            CROSS JOIN tb_archive_pages p ON p.digest = b.digest
+            WHERE (b.segment, b.offset) >= (?, ?) AND (b.segment, b.offset, p.url) > (?, ?, ?)
+        '''
+        params = ()
+        if url_prefix:
+            lower, upper = prefix_range(url_prefix)
+            query += ' AND p.url >= ?' + (' AND p.url < ?' if upper is not None else '')
+            params = (lower,) if upper is None else (lower, upper)
+        query += ' ORDER BY b.segment, b.offset, p.url LIMIT ?'
+
+        last_key = (0, -1, '')
+        conn = sqlite3.connect(self.db_name, timeout=30)
+        try:
+            while True:
+                # Each batch continues along idx_archive_blobs_position from the last row read
+                rows = conn.execute(query, last_key[:2] + last_key + params + (batch_size,)).fetchall()
+                if not rows:
+                    return
+                for segment, offset, url, codec, length, content_type in rows:
+                    yield url, decompress(self._read(segment, offset, length), codec), content_type
+                last_key = rows[-1][:3]
+        finally:
+            conn.close()
+
+    def stats(self):
+        """
+        Returns the size of the archive.
+
+        :return: A dictionary with the number of pages and distinct bodies, and the bytes of
+                 the bodies before (raw_bytes) and after (stored_bytes) compression.
+        """
+        with sqlite3.connect(self.db_name, timeout=30) as conn:
+            pages = conn.execute('SELECT COUNT(*) FROM tb_archive_pages').fetchone()[0]
+            blobs, raw_bytes, stored_bytes = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(raw_length), 0), COALESCE(SUM(length), 0) FROM tb_archive_blobs'
+            ).fetchone()
+        return {"pages": pages, "blobs": blobs, "raw_bytes": raw_bytes, "stored_bytes": stored_bytes}
+
+    def close(self):
+        """
+        Closes the segment being written and the memory maps of the segments read.
+        """
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            for segment_map in self._maps.values():
+                segment_map.close()
+            self._maps.clear()
+
+
+def _extract_page_links(page):
+    url, body, content_type = page
+    return extract_internal_links(body, url, content_type)
+
+
+def reextract_links(archive, url_prefix=None, workers=1, chunk_size=256, store=True):
+    """
+    Extracts the internal links of archived pages again, without any request.
+
+    Reading the archive is much faster than parsing HTML, so with ``workers`` above 1 the
+    pages are parsed by a pool of processes, ``chunk_size`` pages per task. Only
+    ``workers * chunk_size`` bodies are held in memory at a time.
+
+    With ``store``, the links of each page are written to the archive's database as a crawl
+    writes them before the page is yielded: new links are inserted and the page is added to
+    the referrers of each link. New links are not checked with a HEAD request; the next crawl
+    records what they are when it fetches them.
+
+    :param archive: A PageArchive.
+    :param url_prefix: Only replay the URLs starting with this prefix, if given.
+    :param workers: The number of processes parsing pages.
+    :param chunk_size: The number of pages sent to a process at a time.
+    :param store: Whether to store the links in the database.
+    :return: A generator of (url, links) tuples, as extract_internal_links returns them.
+    """
+    for url, links in _extracted_links(archive.iter_pages(url_prefix), workers, chunk_size):
+        if store:
+            store_internal_links(url, links, archive.db_name, check_page=False)
+        yield url, links
+
+
+def _extracted_links(pages, workers, chunk_size):
+    if workers <= 1:
+        for page in pages:
+            yield page[0], _extract_page_links(page)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            chunk = list(islice(pages, workers * chunk_size))
+            if not chunk:
+                return
+            links = executor.map(_extract_page_links, chunk, chunksize=chunk_size)
+            yield from zip((page[0] for page in chunk), links)
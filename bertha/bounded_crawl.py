@@ -0,0 +1,539 @@
+# bertha/bounded_crawl.py
+
+"""
+Memory-bounded crawling of very large websites.
+
+``crawl_website`` keeps things in memory that grow with the size of the site: the
+URLs of every sitemap, and the data of every page it returns at the end.
+``crawl_website_bounded`` crawls within a memory budget instead:
+
+- sitemaps are streamed (``sitemap_stream.iter_sitemap_urls``) and the frontier is
+  read from the database in batches of the URLs with the highest crawl priority
+  (``scheduler.next_crawl_batch``), as ``crawl_all_pages`` reads it,
+- pages go through three stages connected by bounded queues: fetch threads, a
+  parse thread extracting the links (and dropping the body), and the writer
+  storing the results. A full queue blocks the stage feeding it, so at most the
+  bodies that fit in the budget are held at any time,
+- parsed pages waiting for the writer, which is the slowest stage as it stores
+  every link, go to a ``SpillQueue``: past ``write_queue_size`` items they are
+  written to a temporary file instead of being kept in memory,
+- new URLs are not fed back to the fetchers directly but inserted in the database,
+  where the next batch finds them, until no URL is due,
+- when the resident memory of the process goes over the budget, no new URL is
+  fetched until the pages in flight are written.
+
+The queue sizes are derived from the budget by ``plan_pipeline``, and the peak
+resident memory is reported at the end. Nothing is loaded in proportion to the
+number of pages, so a site of millions of pages is crawled in a fixed budget.
+The crawl runs in a crawl session (see ``crawl_session``) checkpointed after every
+page written, so an interrupted crawl continues where it stopped when started again.
+"""
+
+import gc
+import json
+import os
+import queue
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from bertha.utils import fetch_page, shared_http_session, MAX_BODY_SIZE
+from bertha.link_extraction import extract_internal_links
+from bertha.database_setup import initialize_database
+from bertha.database_operations import (
+    update_all_urls_indexibility,
+    update_crawl_info,
+    insert_main_url,
+    park_url,
+)
+from bertha.crawl_pages import _archive_page, _store_page, _store_sitemap_url, _crawl_result_url
+from bertha.crawl_session import (
+    start_crawl_session,
+    find_resumable_session,
+    resume_crawl_session,
+    get_crawl_session,
+    set_session_phase,
+    start_session_batch,
+    checkpoint_batch_position,
+    finish_crawl_session,
+)
+from bertha.circuit_breaker import HostCircuitBreakers
+from bertha.exceptions import CrawlFrontierError
+from bertha.scheduler import refresh_crawl_priorities, next_crawl_batch
+from bertha.sitemap_stream import iter_sitemap_urls
+from bertha.retry_policy import DATABASE, CRAWL
+
+DEFAULT_MEMORY_BUDGET_MB = 512
+DEFAULT_FETCH_WORKERS = 4
+# Share of the budget, after what the process already uses, for page bodies in flight
+BODY_SHARE = 0.5
+# Share of the budget for parsed pages waiting for the writer, and the memory of one
+RECORD_SHARE = 0.125
+RECORD_SIZE_ESTIMATE = 64 * 1024
+# Memory used by the interpreter and the libraries when it cannot be measured
+BASELINE_RSS = 64 * 1024 * 1024
+
+_DONE = object()
+
+
+def current_rss():
+    """
+    Returns the resident memory of the process.
+
+    :return: The resident set size in bytes, or None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    """
+    Returns the highest resident memory of the process so far.
+
+    :return: The peak resident set size in bytes, or None where the resource module is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class SpillQueue:
+    """
+    A first-in first-out queue that never blocks its producers, keeping at most
+    max_items items in memory and the rest in a temporary file.
+
+    Items must be JSON-serializable and not None; items read back from the file
+    are their JSON round trip, e.g. tuples become lists.
+
+    :param max_items: The number of items kept in memory before spilling to disk.
+    :param directory: The directory of the temporary file. The system default if None.
+    """
+
+    def __init__(self, max_items, directory=None):
+        self.max_items = max(1, max_items)
+        self.directory = directory
+        self.spilled = 0
+        self._items = deque()
+        self._file = None
+        self._read_offset = 0
+        self._on_disk = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._items) + self._on_disk
+
+    def put(self, item):
+        """
+        Adds an item, to the file if max_items are in memory or items are already on disk.
+
+        :param item: The item.
+        :raises ValueError: If the queue is closed.
+        """
+        with self._condition:
+            if self._closed:
+                raise ValueError("put() on a closed SpillQueue")
+            if self._on_disk or len(self._items) >= self.max_items:
+                # Items on disk are older than any added now, so the order is kept
+                if self._file is None:
+                    self._file = tempfile.TemporaryFile(prefix='bertha-spill-', dir=self.directory)
+                self._file.seek(0, os.SEEK_END)
+                self._file.write(json.dumps(item).encode('utf-8') + b'\n')
+                self._on_disk += 1
+                self.spilled += 1
+            else:
+                self._items.append(item)
+            self._condition.notify()
+
+    def get(self):
+        """
+        Removes and returns the oldest item, waiting for one if the queue is empty.
+
+        :return: The item, or None once the queue is closed and empty.
+        """
+        with self._condition:
+            while not self._items and not self._on_disk:
+                if self._closed:
+                    return None
+                self._condition.wait()
+            if self._items:
+                return self._items.popleft()
+
+            self._file.seek(self._read_offset)
+            line = self._file.readline()
+            self._read_offset = self._file.tell()
+            self._on_disk -= 1
+            if not self._on_disk:
+                # Everything on disk was read; reuse the file from the start
+                self._file.seek(0)
+                self._file.truncate()
+                self._read_offset = 0
+            return json.loads(line)
+
+    def close(self):
+        """
+        Marks that no more items will be added; get returns None once the rest are read.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def discard(self):
+        """
+        Closes the queue and deletes its temporary file, dropping the items left.
+        """
+        with self._condition:
+            self._closed = True
+            self._items.clear()
+            self._on_disk = 0
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._condition.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.discard()
+
+
+def plan_pipeline(memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, max_body_size=MAX_BODY_SIZE,
+                  fetch_workers=DEFAULT_FETCH_WORKERS, baseline=None):
+    """
+    Sizes the stages of a bounded crawl so the memory they hold fits in a budget.
+
+    A body being read can take twice max_body_size, as it is copied once it is complete.
+
+    :param memory_budget_mb: The memory budget of the process, in MiB.
+    :param max_body_size: The maximum number of bytes of a page body read.
+    :param fetch_workers: The number of fetch threads wanted.
+    :param baseline: The memory the process uses besides the crawl, in bytes. The current
+                     resident memory if None.
+    :return: A dictionary with the memory_budget (bytes), fetch_workers, fetch_queue_size,
+             parse_queue_size and write_queue_size.
+    """
+    budget = int(memory_budget_mb * 1024 * 1024)
+    if baseline is None:
+        baseline = current_rss() or BASELINE_RSS
+    available = max(budget - baseline, 0)
+
+    body_slots = max(2, int(available * BODY_SHARE // (2 * max_body_size)))
+    fetch_workers = max(1, min(fetch_workers, body_slots - 1))
+    return {
+        "memory_budget": budget,
+        "fetch_workers": fetch_workers,
+        "fetch_queue_size": 2 * fetch_workers,
+        "parse_queue_size": max(1, body_slots - fetch_workers),
+        "write_queue_size": max(16, int(available * RECORD_SHARE // RECORD_SIZE_ESTIMATE)),
+    }
+
+
+def _put(target, item, stop):
+    """Puts an item in a bounded queue, waiting for room unless the crawl is stopping."""
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(source, stop):
+    """Takes an item from a queue, or returns _DONE if the crawl is stopping."""
+    while not stop.is_set():
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def _crawl_batch(batch, position, session_id, db_name, plan, spill_dir, max_body_size, breakers, host_limiter,
+                 archive, retry_policy, stats):
+    """
+    Crawls the URLs of a batch from position on, through the fetch, parse and write stages.
+
+    Pages are written in the order their fetches finish, so the checkpoint is the end of the
+    longest run of written URLs from the start of the batch.
+    """
+    workers = plan["fetch_workers"]
+    fetch_queue = queue.Queue(plan["fetch_queue_size"])
+    parse_queue = queue.Queue(plan["parse_queue_size"])
+    stop = threading.Event()
+    errors = []
+    batch_stats = {"written": 0, "failed": 0, "parked": 0}
+
+    def guarded(stage):
+        def run():
+            try:
+                stage()
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+        return run
+
+    def wait_for_memory():
+        rss = current_rss()
+        if rss is None or rss <= plan["memory_budget"]:
+            return
+        stats["throttled"] += 1
+        gc.collect()
+        # Let the pages in flight be written; what is still resident after that cannot be freed by waiting
+        while not stop.is_set() and (fetch_queue.qsize() or parse_queue.qsize()) \
+                and (current_rss() or 0) > plan["memory_budget"]:
+            time.sleep(0.05)
+
+    def produce():
+        try:
+            for index in range(position, len(batch)):
+                wait_for_memory()
+                if not _put(fetch_queue, (index, batch[index]), stop):
+                    return
+        finally:
+            for _ in range(workers):
+                _put(fetch_queue, _DONE, stop)
+
+    def fetch():
+        try:
+            while True:
+                item = _get(fetch_queue, stop)
+                if item is _DONE:
+                    return
+                index, url = item
+                if not breakers.allow_request(url):
+                    # The host is failing; the writer only checkpoints the URL
+                    park_url(url, breakers.retry_after(url) or breakers.get(url).cooldown, db_name)
+                    page = None
+                elif host_limiter is not None:
+                    with host_limiter.slot(url):
+                        page = fetch_page(url, max_body_size=max_body_size)
+                else:
+                    page = fetch_page(url, max_body_size=max_body_size)
+                if page is not None:
+                    breakers.record_result(url, page["status_code"])
+                if not _put(parse_queue, (index, url, page), stop):
+                    return
+        finally:
+            _put(parse_queue, _DONE, stop)
+
+    def parse():
+        try:
+            finished = 0
+            while finished < workers:
+                item = _get(parse_queue, stop)
+                if item is _DONE:
+                    finished += 1
+                    continue
+                index, url, page = item
+                if page is not None:
+                    _archive_page(url, page, archive)
+                    result_url = _crawl_result_url(url, page)
+                    if page["body"] and result_url is not None and page["status_code"] < 400:
+                        page["links"] = extract_internal_links(page["body"], result_url, page["content_type"])
+                    # Only the links are kept for the writer
+                    page["body"] = None
+                spill.put({"index": index, "url": url, "page": page})
+        finally:
+            spill.close()
+
+    def write(record):
+        url = record["url"]
+        if record["page"] is None:
+            batch_stats["parked"] += 1
+            return 0, 0
+        try:
+            _store_page(url, record["page"], db_name, retry_policy)
+            batch_stats["written"] += 1
+            return 1, 0
+        except Exception as e:
+            print(f"Failed to store the crawl of {url}: {e}")
+            batch_stats["failed"] += 1
+            # Record the failure so the URL is not selected again in this crawl
+            try:
+                update_crawl_info(url, None, False, db_name)
+            except sqlite3.OperationalError as e:
+                print(f"Recording the failure of {url} failed: {e}")
+            return 0, 1
+
+    done = set()
+    checkpoint = position
+    with SpillQueue(plan["write_queue_size"], spill_dir) as spill:
+        threads = [threading.Thread(target=guarded(produce), name='bertha-frontier', daemon=True)]
+        threads += [threading.Thread(target=guarded(fetch), name=f'bertha-fetch-{i}', daemon=True)
+                    for i in range(workers)]
+        threads.append(threading.Thread(target=guarded(parse), name='bertha-parse', daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            crawled = failed = 0
+            while not stop.is_set():
+                record = spill.get()
+                if record is None:
+                    break
+                written, not_written = write(record)
+                crawled += written
+                failed += not_written
+                done.add(record["index"])
+                if checkpoint in done:
+                    while checkpoint in done:
+                        done.remove(checkpoint)
+                        checkpoint += 1
+                    if session_id is not None:
+                        checkpoint_batch_position(session_id, checkpoint, crawled=crawled, failed=failed,
+                                                  db_name=db_name)
+                    crawled = failed = 0
+        finally:
+            # The stages have finished unless the writer stopped early; either way none may keep waiting
+            stop.set()
+            for thread in threads:
+                thread.join()
+            stats["spilled"] += spill.spilled
+
+    if errors:
+        raise errors[0]
+    return batch_stats
+
+
+def crawl_website_bounded(base_url, gap=30, db_name='db_websites.db', memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                          fetch_workers=DEFAULT_FETCH_WORKERS, retries=5, timeout=30, sitemaps=True, spill_dir=None,
+                          batch_size=1000, max_body_size=MAX_BODY_SIZE, max_batches=None, breakers=None,
+                          host_limiter=None, archive=None, resume=True):
+    """
+    Crawls a website within a memory budget, streaming the sitemaps and the frontier.
+
+    The crawl runs inside a crawl session, like ``crawl_website``: if a previous crawl of the
+    website was interrupted or failed, it is resumed from its last checkpoint unless ``resume``
+    is False.
+
+    :param base_url: The base URL of the website to crawl.
+    :param gap: The number of days to check if the URL's last crawl is outdated.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param memory_budget_mb: The memory budget of the process, in MiB.
+    :param fetch_workers: The maximum number of pages fetched at the same time.
+    :param retries: Number of attempts per operation if it fails with a transient error.
+    :param timeout: The maximum time in seconds to wait between attempts.
+    :param sitemaps: Whether to read the sitemaps of the website first.
+    :param spill_dir: The directory for the pages spilled to disk. The system temporary directory if None.
+    :param batch_size: The number of URLs selected from the frontier at a time.
+    :param max_body_size: The maximum number of bytes of a page body read for link extraction.
+    :param max_batches: The maximum number of batches crawled, or None until nothing is due.
+    :param breakers: A ``HostCircuitBreakers`` registry shared across calls. A new one is used if None.
+    :param host_limiter: A ``HostLimiter`` capping concurrent requests per host, if any.
+    :param archive: A ``PageArchive`` keeping the bodies read, if any.
+    :param resume: Whether to resume an unfinished crawl session of the website.
+    :return: A dictionary with the number of pages crawled, failed writes, batches, pages
+             spilled to disk, times fetching was throttled for memory, the peak_rss_mb
+             (None if unknown), the elapsed seconds and the id of the crawl session.
+    :raises BerthaError: If the database cannot be initialized or the main URL cannot be stored.
+    """
+    start = time.monotonic()
+    if breakers is None:
+        breakers = HostCircuitBreakers()
+    plan = plan_pipeline(memory_budget_mb, max_body_size, fetch_workers)
+    print(f"Bounded crawl of {base_url} in {memory_budget_mb} MiB: {plan['fetch_workers']} fetch threads, "
+          f"{plan['parse_queue_size']} bodies queued, {plan['write_queue_size']} pages in memory before spilling.")
+
+    initialize_database(db_name)
+    stats = {"pages": 0, "failed": 0, "batches": 0, "spilled": 0, "throttled": 0}
+
+    # Start a crawl session, or pick up the one that did not finish
+    session = find_resumable_session(base_url, db_name) if resume else None
+    if session is not None:
+        session_id = resume_crawl_session(session['id'], db_name)['id']
+        phase = session['phase']
+    else:
+        session_id = start_crawl_session(base_url, db_name)
+        phase = 'sitemaps'
+    stats["session_id"] = session_id
+
+    try:
+        with shared_http_session(pool_maxsize=plan['fetch_workers']):
+            if phase == 'sitemaps':
+                insert_main_url(base_url, retries, timeout, db_name)
+                if sitemaps:
+                    # Sitemaps are streamed, so an interrupted session reads them again; known URLs are skipped
+                    retry_policy = CRAWL.copy(attempts=retries, max_delay=timeout)
+                    for url, sitemap_url in iter_sitemap_urls(base_url):
+                        try:
+                            retry_policy.call(f"Processing {url}", _store_sitemap_url, url, sitemap_url, db_name)
+                        except Exception as e:
+                            print(f"Failed to process {url}: {e}")
+                set_session_phase(session_id, 'crawl', db_name)
+                phase = 'crawl'
+
+            if phase == 'crawl':
+                _crawl_frontier(base_url, gap, session_id, db_name, plan, spill_dir, max_body_size, breakers,
+                                host_limiter, archive, retries, timeout, batch_size, max_batches, stats)
+                set_session_phase(session_id, 'indexibility', db_name)
+                phase = 'indexibility'
+
+            if phase == 'indexibility':
+                print("Updating indexibility for all URLs...")
+                update_all_urls_indexibility(base_url, retries, timeout, db_name)
+    except Exception as e:
+        finish_crawl_session(session_id, state='failed', error=str(e), db_name=db_name)
+        raise
+    finish_crawl_session(session_id, db_name=db_name)
+
+    peak = peak_rss()
+    stats["peak_rss_mb"] = round(peak / (1024 * 1024), 1) if peak is not None else None
+    stats["elapsed"] = time.monotonic() - start
+    print(f"Crawled {stats['pages']} pages of {base_url} in {stats['batches']} batches, {stats['spilled']} spilled to disk. "
+          f"Peak RSS: {stats['peak_rss_mb']} MiB (budget {memory_budget_mb} MiB).")
+    return stats
+
+
+def _crawl_frontier(base_url, gap, session_id, db_name, plan, spill_dir, max_body_size, breakers, host_limiter,
+                    archive, retries, timeout, batch_size, max_batches, stats):
+    """Crawls the frontier in batches of the URLs with the highest crawl priority, until none are due."""
+    frontier_policy = CRAWL.copy(attempts=retries, max_delay=timeout)
+    retry_policy = DATABASE.copy(attempts=retries, max_delay=timeout)
+    refresh_crawl_priorities(base_url, db_name)
+
+    batch, position = None, 0
+    session = get_crawl_session(session_id, db_name)
+    if session['current_batch'] and session['batch_position'] < len(session['current_batch']):
+        batch, position = session['current_batch'], session['batch_position']
+        print(f"Resuming in-flight batch at {position}/{len(batch)}.")
+
+    while max_batches is None or stats["batches"] < max_batches:
+        if batch is None:
+            try:
+                urls = frontier_policy.call("Retrieving URLs to crawl", next_crawl_batch, base_url, gap, batch_size,
+                                            db_name)
+            except Exception as e:
+                raise CrawlFrontierError(f"Failed to retrieve URLs to crawl for {base_url}.") from e
+            start_session_batch(session_id, urls, db_name)
+            if not urls:
+                print("No more URLs to crawl.")
+                break
+            batch, position = urls, 0
+
+        batch_stats = _crawl_batch(batch, position, session_id, db_name, plan, spill_dir, max_body_size, breakers,
+                                   host_limiter, archive, retry_policy, stats)
+        stats["batches"] += 1
+        stats["pages"] += batch_stats["written"]
+        stats["failed"] += batch_stats["failed"]
+        print(f"Batch {stats['batches']}: {batch_stats['written']} pages crawled, {batch_stats['failed']} failed, "
+              f"{batch_stats['parked']} parked.")
+        if batch_stats["failed"] and not batch_stats["written"]:
+            # Nothing could be stored; the next batch would fail the same way
+            break
+        batch, position = None, 0
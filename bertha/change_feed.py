@@ -0,0 +1,121 @@
+# bertha/change_feed.py
+
+"""
+Change feed of crawl results.
+
+Every change the crawler makes to a page is appended to ``tb_changes`` in the same
+transaction as the change itself:
+
+- ``discovered``: a new URL was stored.
+- ``status``: the HTTP status of a URL changed, including its first crawl.
+- ``removed``: a URL that existed started answering 404 or 410.
+- ``indexibility``: the robots index or follow flag of a URL changed. Values are
+  'index,follow' pairs such as '1,0' (see ``robots_flags``); unknown flags are empty.
+- ``redirect``: the final target a URL redirects to changed, or it started or stopped
+  redirecting (the value is empty then).
+
+``changes_since`` streams the changes after a cursor, in order. Consumers keep the
+``change_id`` of the last change they processed and pass it as the cursor of their
+next call, instead of re-reading every page to diff snapshots.
+"""
+
+import sqlite3
+from datetime import datetime
+
+CHANGE_COLUMNS = ('change_id', 'url', 'change_type', 'old_value', 'new_value', 'dt_change')
+
+
+def _to_text(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return str(value)
+
+
+def robots_flags(index, follow):
+    """
+    Encodes the robots index and follow flags of a URL as a change value.
+
+    :param index: The robots_index flag, or None if not known.
+    :param follow: The robots_follow flag, or None if not known.
+    :return: A string such as '1,0'.
+    """
+    return ','.join('' if flag is None else ('1' if flag else '0') for flag in (index, follow))
+
+
+def record_change(cursor, url, change_type, old_value=None, new_value=None):
+    """
+    Appends a change to the feed, inside the caller's transaction.
+
+    :param cursor: A cursor on the connection making the change.
+    :param url: The URL that changed.
+    :param change_type: One of 'discovered', 'status', 'removed', 'indexibility' or 'redirect'.
+    :param old_value: The value before the change.
+    :param new_value: The value after the change.
+    """
+    cursor.execute('''
+        INSERT INTO tb_changes (url, change_type, old_value, new_value, dt_change)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (url, change_type, _to_text(old_value), _to_text(new_value), datetime.now().strftime('%Y%m%d%H%M%S')))
+
+
+def changes_since(cursor=0, base_url=None, change_types=None, batch_size=1000, db_name='db_websites.db'):
+    """
+    Streams the changes recorded after a cursor, oldest first.
+
+    Changes are read in batches of ``batch_size`` by primary key range, so memory use does
+    not depend on how many changes there are, and each batch is an indexed range scan.
+
+    :param cursor: The change_id of the last change already processed (0 for all changes).
+    :param base_url: Only return changes of URLs containing this base URL, if given.
+    :param change_types: Only return changes of these types, if given.
+    :param batch_size: The number of changes read from the database at a time.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: A generator of dictionaries with the change_id, url, change_type, old_value,
+             new_value and dt_change of each change.
+    """
+    query = f'SELECT {", ".join(CHANGE_COLUMNS)} FROM tb_changes WHERE change_id > ?'
+    filters = ()
+    if base_url is not None:
+        query += ' AND url LIKE ?'
+        filters += (f'%{base_url}%',)
+    if change_types:
+        query += f' AND change_type IN ({", ".join("?" for _ in change_types)})'
+        filters += tuple(change_types)
+    query += ' ORDER BY change_id LIMIT ?'
+
+    conn = sqlite3.connect(db_name, timeout=30)
+    try:
+        while True:
+            rows = conn.execute(query, (cursor,) + filters + (batch_size,)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(zip(CHANGE_COLUMNS, row))
+            cursor = rows[-1][0]
+    finally:
+        conn.close()
+
+
+def latest_change_cursor(db_name='db_websites.db'):
+    """
+    Returns the cursor of the most recent change, to follow the feed from now on.
+
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: The change_id of the most recent change, or 0 if there are none.
+    """
+    with sqlite3.connect(db_name, timeout=30) as conn:
+        return conn.execute('SELECT COALESCE(MAX(change_id), 0) FROM tb_changes').fetchone()[0]
+
+
+def prune_changes(cursor, db_name='db_websites.db'):
+    """
+    Deletes the changes up to and including a cursor, once every consumer has processed them.
+
+    :param cursor: The change_id of the last change to delete.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: The number of changes deleted.
+    """
+    with sqlite3.connect(db_name, timeout=30) as conn:
+        return conn.execute('DELETE FROM tb_changes WHERE change_id <= ?', (cursor,)).rowcount
@@ -0,0 +1,173 @@
+# bertha/circuit_breaker.py
+
+"""
+Per-host circuit breakers.
+
+A host that starts timing out or returning server errors would otherwise cost the
+full request timeout for every one of its URLs. Each host gets a circuit breaker
+that tracks the outcome of its recent requests:
+
+- ``closed``: requests go through. When the error rate over the last
+  ``window_size`` requests reaches ``failure_threshold`` the breaker opens.
+- ``open``: requests are refused until ``cooldown`` seconds have passed. The
+  crawler parks the URLs of the host instead of fetching them.
+- ``half_open``: a single probe request is let through. If it succeeds the
+  breaker closes, otherwise it opens again for another cooldown.
+"""
+
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def is_host_failure(status_code):
+    """
+    Tells whether a response means the host itself is failing.
+
+    :param status_code: The HTTP status code, or None if the request failed without a response.
+    :return: True for network errors, rate limiting and server errors.
+    """
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for a single host.
+
+    :param failure_threshold: The error rate, between 0 and 1, that opens the breaker.
+    :param window_size: The number of recent requests the error rate is computed over.
+    :param min_requests: The number of requests needed in the window before the breaker can open.
+    :param cooldown: The number of seconds the breaker stays open before letting a probe through.
+    :param clock: A function returning the current time in seconds (default is time.monotonic).
+    """
+
+    def __init__(self, failure_threshold=0.5, window_size=20, min_requests=5, cooldown=300, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = CLOSED
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.results = deque(maxlen=window_size)
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        """
+        Tells whether a request to the host may be made now.
+
+        :return: True if the request may go through.
+        """
+        with self.lock:
+            if self.state == OPEN:
+                if self.clock() - self.opened_at < self.cooldown:
+                    return False
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+
+            if self.state == HALF_OPEN:
+                if self.probe_in_flight:
+                    return False
+                self.probe_in_flight = True
+
+            return True
+
+    def record_success(self):
+        """Records a request that succeeded."""
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self.results.clear()
+                self.probe_in_flight = False
+            self.results.append(False)
+
+    def record_failure(self):
+        """Records a request that failed."""
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self._open()
+                return
+
+            self.results.append(True)
+            if len(self.results) >= self.min_requests:
+                if sum(self.results) / len(self.results) >= self.failure_threshold:
+                    self._open()
+
+    def retry_after(self):
+        """
+        Returns the number of seconds until the breaker lets a probe through.
+
+        :return: The number of seconds, 0 if requests are allowed now.
+        """
+        with self.lock:
+            if self.state != OPEN:
+                return 0
+            return max(self.cooldown - (self.clock() - self.opened_at), 0)
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self.probe_in_flight = False
+        self.results.clear()
+
+
+class HostCircuitBreakers:
+    """
+    Registry of circuit breakers, one per host, created on first use.
+
+    Keyword arguments are passed to every :class:`CircuitBreaker` it creates.
+    """
+
+    def __init__(self, **breaker_options):
+        self.breaker_options = breaker_options
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        """
+        Returns the circuit breaker of the host of a URL.
+
+        :param url: A URL on the host.
+        :return: The :class:`CircuitBreaker` of the host.
+        """
+        host = urlparse(url).netloc.lower()
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(**self.breaker_options)
+            return self.breakers[host]
+
+    def allow_request(self, url):
+        """Tells whether a request to the host of a URL may be made now."""
+        return self.get(url).allow_request()
+
+    def record_result(self, url, status_code):
+        """
+        Records the outcome of a request to the host of a URL.
+
+        :param url: The requested URL.
+        :param status_code: The HTTP status code, or None if the request failed without a response.
+        """
+        breaker = self.get(url)
+        if is_host_failure(status_code):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def retry_after(self, url):
+        """Returns the number of seconds until the host of a URL may be requested again."""
+        return self.get(url).retry_after()
+
+    def open_hosts(self):
+        """
+        Returns the hosts whose breaker is open.
+
+        :return: A list of host names.
+        """
+        with self.lock:
+            breakers = list(self.breakers.items())
+        return [host for host, breaker in breakers if breaker.state == OPEN]
@@ -0,0 +1,173 @@
+# bertha/cli.py
+
+"""
+Command-line interface.
+
+Usage::
+
+    python -m bertha crawl https://www.example.com --gap 30
+    python -m bertha recrawl https://www.example.com
+    python -m bertha recrawl-url https://www.example.com/specific-page/
+    python -m bertha indexible https://www.example.com
+    python -m bertha crawl-sites --config sites.json --workers 8
+    python -m bertha crawl https://www.example.com --archive archive/
+    python -m bertha crawl https://www.example.com --memory-budget 768
+
+The crawling modules are only imported once a command runs, so ``--help`` and
+argument errors return immediately. The exit status is 0 on success and 1 when
+the crawl fails or the URL is not available.
+"""
+
+import argparse
+import json
+import sys
+
+
+def _add_database_argument(parser):
+    parser.add_argument("--db", dest="db_name", default="db_websites.db",
+                        help="SQLite database file (default: db_websites.db)")
+
+
+def _add_crawl_arguments(parser):
+    _add_database_argument(parser)
+    parser.add_argument("--retries", type=int, default=5, help="attempts per operation (default: 5)")
+    parser.add_argument("--timeout", type=float, default=30, help="maximum seconds between attempts (default: 30)")
+    parser.add_argument("--no-resume", dest="resume", action="store_false",
+                        help="start a new crawl session instead of resuming an unfinished one")
+    parser.add_argument("--json", action="store_true", help="print the data of every page as JSON")
+    parser.add_argument("--archive", metavar="DIR", help="keep the page bodies read in a compressed archive in DIR")
+
+
+def build_parser():
+    """
+    Builds the argument parser of the ``bertha`` command.
+
+    :return: An ``argparse.ArgumentParser``.
+    """
+    from bertha import __version__
+
+    parser = argparse.ArgumentParser(prog="bertha", description="Crawl websites and track the status of their pages.")
+    parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    crawl_parser = subparsers.add_parser("crawl", help="crawl the pages of a website that are due")
+    crawl_parser.add_argument("url", help="base URL of the website")
+    crawl_parser.add_argument("--gap", type=int, default=30, help="days after which a page is due again (default: 30)")
+    crawl_parser.add_argument("--memory-budget", type=float, metavar="MB",
+                              help="crawl in a memory budget of MB MiB, streaming the frontier (prints a summary, not the pages)")
+    crawl_parser.add_argument("--fetch-workers", type=int, default=4,
+                              help="pages fetched at the same time with --memory-budget (default: 4)")
+    _add_crawl_arguments(crawl_parser)
+
+    recrawl_parser = subparsers.add_parser("recrawl", help="crawl every page of a website again")
+    recrawl_parser.add_argument("url", help="base URL of the website")
+    _add_crawl_arguments(recrawl_parser)
+
+    recrawl_url_parser = subparsers.add_parser("recrawl-url", aliases=["recrawl_url"], help="crawl a single URL again")
+    recrawl_url_parser.add_argument("url", help="URL of the page")
+    _add_database_argument(recrawl_url_parser)
+
+    sites_parser = subparsers.add_parser("crawl-sites", help="crawl several websites concurrently in one process")
+    sites_parser.add_argument("urls", nargs="*", help="base URLs of the websites")
+    sites_parser.add_argument("--config", help="JSON or text file listing the websites")
+    sites_parser.add_argument("--gap", type=int, default=30, help="days after which a page is due again (default: 30)")
+    sites_parser.add_argument("--workers", type=int, default=8, help="websites crawled at the same time (default: 8)")
+    sites_parser.add_argument("--max-per-host", type=int, default=1, help="concurrent requests per host (default: 1)")
+    _add_crawl_arguments(sites_parser)
+
+    indexible_parser = subparsers.add_parser("indexible", help="list the indexible pages under a URL prefix")
+    indexible_parser.add_argument("url", help="URL prefix of the pages")
+    _add_database_argument(indexible_parser)
+
+    return parser
+
+
+def _print_website_data(url, website_data, as_json):
+    if as_json:
+        print(json.dumps(website_data))
+    else:
+        print(f"Crawled {url}: {len(website_data)} pages in the database.")
+
+
+def main(argv=None):
+    """
+    Runs the ``bertha`` command.
+
+    :param argv: The command-line arguments, without the program name. sys.argv is used if None.
+    :return: The exit status.
+    """
+    args = build_parser().parse_args(argv)
+
+    from bertha.exceptions import BerthaError
+
+    archive = None
+    if getattr(args, "archive", None):
+        from bertha.archive import PageArchive
+        archive = PageArchive(args.archive, args.db_name)
+
+    try:
+        if args.command == "crawl" and args.memory_budget:
+            from bertha.bounded_crawl import crawl_website_bounded
+            summary = crawl_website_bounded(args.url, args.gap, args.db_name, memory_budget_mb=args.memory_budget,
+                                            fetch_workers=args.fetch_workers, retries=args.retries,
+                                            timeout=args.timeout, resume=args.resume, archive=archive)
+            if args.json:
+                print(json.dumps(summary))
+
+        elif args.command == "crawl":
+            from bertha.main import crawl_website
+            website_data = crawl_website(args.url, args.gap, args.db_name, retries=args.retries,
+                                         timeout=args.timeout, resume=args.resume, archive=archive)
+            _print_website_data(args.url, website_data, args.json)
+
+        elif args.command == "recrawl":
+            from bertha.main import recrawl_website
+            website_data = recrawl_website(args.url, args.db_name, retries=args.retries,
+                                           timeout=args.timeout, resume=args.resume, archive=archive)
+            _print_website_data(args.url, website_data, args.json)
+
+        elif args.command in ("recrawl-url", "recrawl_url"):
+            from bertha.main import recrawl_url
+            url_data = recrawl_url(args.url, args.db_name)
+            if url_data is None:
+                return 1
+            print(json.dumps(url_data))
+
+        elif args.command == "crawl-sites":
+            from bertha.orchestrator import crawl_sites, load_sites
+            sites = [{'url': url} for url in args.urls]
+            if args.config:
+                sites += load_sites(args.config)
+            if not sites:
+                print("bertha crawl-sites: no websites given", file=sys.stderr)
+                return 2
+
+            results = crawl_sites(sites, args.gap, args.db_name, retries=args.retries, timeout=args.timeout,
+                                  resume=args.resume, max_workers=args.workers, max_per_host=args.max_per_host,
+                                  archive=archive)
+            if args.json:
+                print(json.dumps(results))
+            else:
+                for result in results:
+                    outcome = result["status"] if result["error"] is None else f"{result['status']} ({result['error']})"
+                    print(f"{result['url']}: {outcome}, {result['pages']} pages, {result['elapsed']:.1f}s")
+            if any(result["status"] != "completed" for result in results):
+                return 1
+
+        elif args.command == "indexible":
+            from bertha.reports import iter_indexible_pages
+            for url in iter_indexible_pages(args.url, args.db_name):
+                print(url)
+
+    except BerthaError as e:
+        print(f"bertha {args.command} failed: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if archive is not None:
+            archive.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
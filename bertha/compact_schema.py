@@ -0,0 +1,509 @@
+# bertha/compact_schema.py
+
+"""
+Compact archive of a crawl database.
+
+The crawler writes ``tb_pages``, where every row repeats the full URL string, stores
+timestamps as 14-character text and keeps sitemaps as comma-joined URL lists. Only the
+referrers, the largest of these on sites linked from every page, are compact in the live
+database: ``tb_page_links`` stores them as integer id pairs (see ``database_setup``).
+The rest of the layout below is an archival export, for keeping and analysing finished
+crawls; the crawler does not read it:
+
+- ``tb_hosts`` and ``tb_path_prefixes`` intern the scheme and host, and the first
+  path segment, of every URL. ``tb_urls`` stores only ids plus the rest of the path.
+- Timestamps are integer epoch seconds. Booleans are 0/1, which SQLite stores in
+  the record header without any payload.
+- ``tb_links`` and ``tb_url_sitemaps`` are ``WITHOUT ROWID`` tables of integer id
+  pairs, with covering indexes for both directions. Referrers and redirect targets
+  that were never stored as pages get a ``tb_urls`` row with ``is_page = 0``.
+- ``v_pages`` rebuilds every ``tb_pages`` column for the exported pages, so existing
+  queries can be ported by changing the table name.
+
+Usage::
+
+    python -m bertha.compact_schema migrate db_websites.db db_compact.db
+    python -m bertha.compact_schema benchmark db_websites.db db_compact.db https://www.example.com
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from bertha.database_setup import add_missing_columns, referring_pages_sql
+
+COMPACT_SCHEMA_VERSION = 2
+
+# Columns of tb_pages copied to the compact schema; the id is replaced by url_id.
+# Columns missing from older databases are read as NULL.
+_LEGACY_COLUMNS = (
+    'url', 'dt_discovered', 'sitemaps', 'referring_pages', 'successful_page_fetch', 'status_code',
+    'dt_last_crawl', 'robots_index', 'robots_follow', 'depth', 'inlinks', 'crawl_count', 'change_count',
+    'crawl_priority', 'gone_count', 'dt_retry_after', 'redirect_target', 'redirect_chain', 'dt_redirect_verified'
+)
+
+# Columns of tb_urls added in version 2. They are created on new databases and added to
+# existing ones by initialize_compact_database.
+_URL_COLUMNS = {
+    'is_page': 'INTEGER NOT NULL DEFAULT 0',
+    'inlinks': 'INTEGER',
+    'crawl_priority': 'REAL',
+    'redirect_target_id': 'INTEGER',
+    'redirect_chain': 'TEXT',
+    'dt_redirect_verified': 'INTEGER',
+}
+
+
+def initialize_compact_database(db_name='db_compact.db'):
+    """
+    Creates the tables, indexes and views of the compact schema.
+
+    :param db_name: The name of the SQLite database file (default is 'db_compact.db').
+    """
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+    cursor.executescript('''
+        CREATE TABLE IF NOT EXISTS tb_hosts (
+            host_id INTEGER PRIMARY KEY,
+            host TEXT UNIQUE NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS tb_path_prefixes (
+            prefix_id INTEGER PRIMARY KEY,
+            prefix TEXT UNIQUE NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS tb_urls (
+            url_id INTEGER PRIMARY KEY,
+            host_id INTEGER NOT NULL,
+            prefix_id INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            dt_discovered INTEGER,
+            dt_last_crawl INTEGER,
+            status_code INTEGER,
+            successful_page_fetch INTEGER,
+            robots_index INTEGER,
+            robots_follow INTEGER,
+            depth INTEGER,
+            crawl_count INTEGER,
+            change_count INTEGER,
+            gone_count INTEGER,
+            dt_retry_after INTEGER,
+            UNIQUE (host_id, prefix_id, path)
+        );
+
+        CREATE TABLE IF NOT EXISTS tb_sitemaps (
+            sitemap_id INTEGER PRIMARY KEY,
+            sitemap_url TEXT UNIQUE NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS tb_url_sitemaps (
+            url_id INTEGER NOT NULL,
+            sitemap_id INTEGER NOT NULL,
+            PRIMARY KEY (url_id, sitemap_id)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS tb_links (
+            target_id INTEGER NOT NULL,
+            source_id INTEGER NOT NULL,
+            PRIMARY KEY (target_id, source_id)
+        ) WITHOUT ROWID;
+
+        -- Outlinks of a page, answered from the index alone
+        CREATE INDEX IF NOT EXISTS idx_links_source ON tb_links (source_id, target_id);
+    ''')
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    add_missing_columns(cursor, 'tb_urls', _URL_COLUMNS)
+    if version == 1:
+        # Version 1 exported referrers as pages too; only the pages have a discovery time
+        cursor.execute('UPDATE tb_urls SET is_page = 1 WHERE dt_discovered IS NOT NULL')
+    cursor.executescript(f'''
+        PRAGMA user_version = {COMPACT_SCHEMA_VERSION};
+
+        -- Status and indexibility reports per host, answered from the index alone.
+        -- Version 1 indexed the same columns without is_page.
+        DROP INDEX IF EXISTS idx_urls_host_status;
+        CREATE INDEX IF NOT EXISTS idx_urls_host_page_status
+        ON tb_urls (host_id, is_page, status_code, successful_page_fetch, robots_index);
+
+        -- Crawl frontier per host
+        CREATE INDEX IF NOT EXISTS idx_urls_host_last_crawl ON tb_urls (host_id, dt_last_crawl);
+
+        DROP VIEW IF EXISTS v_pages;
+        CREATE VIEW v_pages AS
+        SELECT
+            u.url_id AS id,
+            h.host || p.prefix || u.path AS url,
+            u.dt_discovered,
+            (SELECT group_concat(s.sitemap_url)
+             FROM tb_url_sitemaps us JOIN tb_sitemaps s ON s.sitemap_id = us.sitemap_id
+             WHERE us.url_id = u.url_id) AS sitemaps,
+            (SELECT group_concat(sh.host || sp.prefix || su.path)
+             FROM tb_links l
+             JOIN tb_urls su ON su.url_id = l.source_id
+             JOIN tb_hosts sh ON sh.host_id = su.host_id
+             JOIN tb_path_prefixes sp ON sp.prefix_id = su.prefix_id
+             WHERE l.target_id = u.url_id) AS referring_pages,
+            u.successful_page_fetch,
+            u.status_code,
+            u.dt_last_crawl,
+            u.robots_index,
+            u.robots_follow,
+            u.depth,
+            COALESCE(u.inlinks, (SELECT COUNT(*) FROM tb_links l WHERE l.target_id = u.url_id)) AS inlinks,
+            u.crawl_count,
+            u.change_count,
+            u.crawl_priority,
+            u.gone_count,
+            u.dt_retry_after,
+            (SELECT th.host || tp.prefix || t.path
+             FROM tb_urls t
+             JOIN tb_hosts th ON th.host_id = t.host_id
+             JOIN tb_path_prefixes tp ON tp.prefix_id = t.prefix_id
+             WHERE t.url_id = u.redirect_target_id) AS redirect_target,
+            u.redirect_chain,
+            u.dt_redirect_verified
+        FROM tb_urls u
+        JOIN tb_hosts h ON h.host_id = u.host_id
+        JOIN tb_path_prefixes p ON p.prefix_id = u.prefix_id
+        WHERE u.is_page = 1;
+    ''')
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def split_url(url):
+    """
+    Splits a URL into its scheme and host, its first path segment and the rest.
+
+    The three parts always concatenate back to the original URL.
+
+    :param url: The URL to split.
+    :return: A (host, prefix, path) tuple, e.g. ('https://example.com', '/blog/', 'post/?page=2').
+    """
+    scheme_end = url.find('://')
+    host_end = len(url)
+    if scheme_end != -1:
+        for separator in '/?#':
+            index = url.find(separator, scheme_end + 3)
+            if index != -1:
+                host_end = min(host_end, index)
+    else:
+        host_end = 0
+
+    host, remainder = url[:host_end], url[host_end:]
+    if not remainder.startswith('/'):
+        return host, '', remainder
+
+    segment_end = remainder.find('/', 1)
+    query_start = min((i for i in (remainder.find('?'), remainder.find('#')) if i != -1), default=-1)
+    if segment_end != -1 and (query_start == -1 or segment_end < query_start):
+        prefix = remainder[:segment_end + 1]
+    else:
+        prefix = '/'
+    return host, prefix, remainder[len(prefix):]
+
+
+def to_epoch(timestamp):
+    """
+    Converts a '%Y%m%d%H%M%S' timestamp, as stored in tb_pages, to epoch seconds.
+
+    :param timestamp: The timestamp text, or None.
+    :return: The epoch seconds, or None if the timestamp is missing or malformed.
+    """
+    if not timestamp:
+        return None
+    try:
+        return int(datetime.strptime(str(timestamp), '%Y%m%d%H%M%S').timestamp())
+    except ValueError:
+        return None
+
+
+def _to_flag(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return 1 if value.strip().lower() in ('1', 'true', 'yes') else 0
+    return 1 if value else 0
+
+
+class _Interner:
+    """Maps strings to ids in a dictionary table, caching the ids already seen."""
+
+    def __init__(self, cursor, table, id_column, value_column):
+        self.cursor = cursor
+        self.table = table
+        self.id_column = id_column
+        self.value_column = value_column
+        self.ids = {}
+
+    def get(self, value):
+        if value not in self.ids:
+            self.cursor.execute(f'INSERT OR IGNORE INTO {self.table} ({self.value_column}) VALUES (?)', (value,))
+            self.cursor.execute(f'SELECT {self.id_column} FROM {self.table} WHERE {self.value_column} = ?', (value,))
+            self.ids[value] = self.cursor.fetchone()[0]
+        return self.ids[value]
+
+
+def _url_id(cursor, hosts, prefixes, url):
+    host, prefix, path = split_url(url)
+    host_id, prefix_id = hosts.get(host), prefixes.get(prefix)
+    cursor.execute('INSERT OR IGNORE INTO tb_urls (host_id, prefix_id, path) VALUES (?, ?, ?)', (host_id, prefix_id, path))
+    cursor.execute(
+        'SELECT url_id FROM tb_urls WHERE host_id = ? AND prefix_id = ? AND path = ?',
+        (host_id, prefix_id, path)
+    )
+    return cursor.fetchone()[0]
+
+
+def _referring_pages_column(cursor):
+    """
+    Returns the SQL expression of the referring_pages of a tb_pages row: rebuilt from the link
+    tables of the live database, or the column itself in databases created before them.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tb_page_links'")
+    return referring_pages_sql() if cursor.fetchone() else 'referring_pages'
+
+def _split_list(value):
+    return [item for item in (value or '').split(',') if item]
+
+
+def migrate_to_compact(legacy_db='db_websites.db', compact_db='db_compact.db', batch_size=10000):
+    """
+    Exports the pages of a database in the current layout to a compact database.
+
+    Every column of tb_pages is kept. The legacy database is only read. Rows are streamed
+    in batches, so memory use does not grow with the number of pages. Crawl sessions and
+    the change feed are not copied.
+
+    :param legacy_db: The database in the current layout (default is 'db_websites.db').
+    :param compact_db: The compact database to create or fill (default is 'db_compact.db').
+    :param batch_size: The number of rows read and committed at a time.
+    :return: A dictionary with the number of urls, links and sitemap entries migrated.
+    """
+    initialize_compact_database(compact_db)
+
+    legacy = sqlite3.connect(legacy_db)
+    legacy_cursor = legacy.cursor()
+    legacy_cursor.execute('PRAGMA table_info(tb_pages)')
+    available = {row[1] for row in legacy_cursor.fetchall()}
+    expressions = {'referring_pages': f'{_referring_pages_column(legacy_cursor)} AS referring_pages'}
+    columns = ', '.join(
+        expressions.get(column, column) if column in available else f'NULL AS {column}' for column in _LEGACY_COLUMNS
+    )
+
+    compact = sqlite3.connect(compact_db)
+    cursor = compact.cursor()
+    hosts = _Interner(cursor, 'tb_hosts', 'host_id', 'host')
+    prefixes = _Interner(cursor, 'tb_path_prefixes', 'prefix_id', 'prefix')
+    sitemaps = _Interner(cursor, 'tb_sitemaps', 'sitemap_id', 'sitemap_url')
+    counts = {"urls": 0, "links": 0, "sitemaps": 0}
+
+    try:
+        legacy_cursor.execute(f'SELECT {columns} FROM tb_pages ORDER BY id')
+        while True:
+            rows = legacy_cursor.fetchmany(batch_size)
+            if not rows:
+                break
+
+            for row in rows:
+                page = dict(zip(_LEGACY_COLUMNS, row))
+                url_id = _url_id(cursor, hosts, prefixes, page['url'])
+                redirect_target_id = None
+                if page['redirect_target']:
+                    redirect_target_id = _url_id(cursor, hosts, prefixes, page['redirect_target'])
+                cursor.execute('''
+                    UPDATE tb_urls
+                    SET is_page = 1, dt_discovered = ?, dt_last_crawl = ?, status_code = ?, successful_page_fetch = ?,
+                        robots_index = ?, robots_follow = ?, depth = ?, inlinks = ?, crawl_count = ?, change_count = ?,
+                        crawl_priority = ?, gone_count = ?, dt_retry_after = ?, redirect_target_id = ?,
+                        redirect_chain = ?, dt_redirect_verified = ?
+                    WHERE url_id = ?
+                ''', (
+                    to_epoch(page['dt_discovered']), to_epoch(page['dt_last_crawl']), page['status_code'],
+                    _to_flag(page['successful_page_fetch']), _to_flag(page['robots_index']),
+                    _to_flag(page['robots_follow']), page['depth'], page['inlinks'], page['crawl_count'],
+                    page['change_count'], page['crawl_priority'], page['gone_count'], to_epoch(page['dt_retry_after']),
+                    redirect_target_id, page['redirect_chain'], to_epoch(page['dt_redirect_verified']), url_id
+                ))
+                counts["urls"] += 1
+
+                for sitemap_url in _split_list(page['sitemaps']):
+                    cursor.execute(
+                        'INSERT OR IGNORE INTO tb_url_sitemaps (url_id, sitemap_id) VALUES (?, ?)',
+                        (url_id, sitemaps.get(sitemap_url))
+                    )
+                    counts["sitemaps"] += cursor.rowcount
+
+                for referring_url in _split_list(page['referring_pages']):
+                    source_id = _url_id(cursor, hosts, prefixes, referring_url)
+                    cursor.execute(
+                        'INSERT OR IGNORE INTO tb_links (target_id, source_id) VALUES (?, ?)',
+                        (url_id, source_id)
+                    )
+                    counts["links"] += cursor.rowcount
+
+            compact.commit()
+            print(f"Migrated {counts['urls']} pages to '{compact_db}'.")
+    finally:
+        legacy.close()
+        compact.close()
+
+    # Rebuild the file without the free pages left by the migration
+    conn = sqlite3.connect(compact_db)
+    conn.execute('ANALYZE')
+    conn.execute('VACUUM')
+    conn.close()
+    return counts
+
+
+def find_url_id(url, db_name='db_compact.db'):
+    """
+    Returns the id of a page in a compact database.
+
+    :param url: The URL.
+    :param db_name: The name of the compact SQLite database file (default is 'db_compact.db').
+    :return: The url_id, or None if the URL is not stored as a page.
+    """
+    host, prefix, path = split_url(url)
+    with sqlite3.connect(db_name) as conn:
+        row = conn.execute('''
+            SELECT u.url_id
+            FROM tb_urls u
+            JOIN tb_hosts h ON h.host_id = u.host_id
+            JOIN tb_path_prefixes p ON p.prefix_id = u.prefix_id
+            WHERE h.host = ? AND p.prefix = ? AND u.path = ? AND u.is_page = 1
+        ''', (host, prefix, path)).fetchone()
+    return row[0] if row else None
+
+
+def _time_query(conn, query, params, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(query, params).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_schemas(legacy_db='db_websites.db', compact_db='db_compact.db', base_url=None, repeat=5):
+    """
+    Compares the size of a database and the time of typical queries in both layouts.
+
+    Each query runs ``repeat`` times and the best time is kept.
+
+    :param legacy_db: The database in the current layout (default is 'db_websites.db').
+    :param compact_db: The same data in the compact layout (default is 'db_compact.db').
+    :param base_url: The website the queries are about. The host of the first page is used if None.
+    :param repeat: The number of times each query runs.
+    :return: A dictionary with, for 'legacy' and 'compact', the size_bytes and the seconds per query.
+    """
+    legacy = sqlite3.connect(legacy_db)
+    compact = sqlite3.connect(compact_db)
+    try:
+        if base_url is None:
+            row = legacy.execute('SELECT url FROM tb_pages ORDER BY id LIMIT 1').fetchone()
+            base_url = split_url(row[0])[0] if row else ''
+        host = split_url(base_url)[0]
+        row = legacy.execute('SELECT url FROM tb_pages WHERE url LIKE ? ORDER BY id DESC LIMIT 1', (f'%{base_url}%',)).fetchone()
+        sample_url = row[0] if row else base_url
+        sample_host, sample_prefix, sample_path = split_url(sample_url)
+
+        legacy_queries = {
+            "url_lookup": ('SELECT * FROM tb_pages WHERE url = ?', (sample_url,)),
+            "indexible_pages": (
+                'SELECT url FROM tb_pages WHERE url LIKE ? AND successful_page_fetch = 1 AND robots_index = 1',
+                (f'{base_url}%',)
+            ),
+            "status_counts": (
+                'SELECT status_code, COUNT(*) FROM tb_pages WHERE url LIKE ? GROUP BY status_code',
+                (f'%{base_url}%',)
+            ),
+            "inlinks": (f'SELECT {_referring_pages_column(legacy.cursor())} FROM tb_pages WHERE url = ?', (sample_url,)),
+        }
+        compact_queries = {
+            "url_lookup": ('''
+                SELECT u.* FROM tb_urls u
+                JOIN tb_hosts h ON h.host_id = u.host_id
+                JOIN tb_path_prefixes p ON p.prefix_id = u.prefix_id
+                WHERE h.host = ? AND p.prefix = ? AND u.path = ?
+            ''', (sample_host, sample_prefix, sample_path)),
+            "indexible_pages": ('''
+                SELECT h.host || p.prefix || u.path FROM tb_urls u
+                JOIN tb_hosts h ON h.host_id = u.host_id
+                JOIN tb_path_prefixes p ON p.prefix_id = u.prefix_id
+                WHERE h.host = ? AND u.successful_page_fetch = 1 AND u.robots_index = 1
+            ''', (host,)),
+            "status_counts": ('''
+                SELECT u.status_code, COUNT(*) FROM tb_urls u
+                JOIN tb_hosts h ON h.host_id = u.host_id
+                WHERE h.host = ? AND u.is_page = 1 GROUP BY u.status_code
+            ''', (host,)),
+            "inlinks": ('''
+                SELECT COUNT(*) FROM tb_links l
+                JOIN tb_urls u ON u.url_id = l.target_id
+                JOIN tb_hosts h ON h.host_id = u.host_id
+                JOIN tb_path_prefixes p ON p.prefix_id = u.prefix_id
+                WHERE h.host = ? AND p.prefix = ? AND u.path = ?
+            ''', (sample_host, sample_prefix, sample_path)),
+        }
+
+        results = {}
+        for name, conn, queries, db_name in (
+            ("legacy", legacy, legacy_queries, legacy_db),
+            ("compact", compact, compact_queries, compact_db),
+        ):
+            results[name] = {
+                "size_bytes": os.path.getsize(db_name),
+                "queries": {
+                    query_name: _time_query(conn, query, params, repeat)
+                    for query_name, (query, params) in queries.items()
+                },
+            }
+    finally:
+        legacy.close()
+        compact.close()
+
+    return results
+
+
+def print_benchmark(results):
+    """
+    Prints the result of ``benchmark_schemas`` as a table.
+
+    :param results: The dictionary returned by ``benchmark_schemas``.
+    """
+    legacy, compact = results["legacy"], results["compact"]
+    print(f"{'':<18}{'legacy':>14}{'compact':>14}{'ratio':>8}")
+    print(f"{'size (bytes)':<18}{legacy['size_bytes']:>14}{compact['size_bytes']:>14}"
+          f"{compact['size_bytes'] / max(legacy['size_bytes'], 1):>8.2f}")
+    for name, seconds in legacy["queries"].items():
+        compact_seconds = compact["queries"][name]
+        print(f"{name + ' (ms)':<18}{seconds * 1000:>14.3f}{compact_seconds * 1000:>14.3f}"
+              f"{compact_seconds / max(seconds, 1e-9):>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a bertha database to the compact schema and benchmark it.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="Export a database to the compact schema.")
+    migrate_parser.add_argument("legacy_db")
+    migrate_parser.add_argument("compact_db")
+    migrate_parser.add_argument("--batch-size", type=int, default=10000)
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="Compare database size and query times.")
+    benchmark_parser.add_argument("legacy_db")
+    benchmark_parser.add_argument("compact_db")
+    benchmark_parser.add_argument("base_url", nargs="?")
+    benchmark_parser.add_argument("--repeat", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.command == "migrate":
+        print(migrate_to_compact(args.legacy_db, args.compact_db, args.batch_size))
+    else:
+        print_benchmark(benchmark_schemas(args.legacy_db, args.compact_db, args.base_url, args.repeat))
@@ -1,121 +1,313 @@
 # bertha/crawl_pages.py
 
-import time
-import sys
 import sqlite3
 from datetime import datetime
-from hellen import internal_links_on_page
-from dourado import pages_from_sitemaps
-from bertha.utils import check_http_status, get_content_type
+from urllib.parse import urlparse
+from bertha.utils import fetch_page, is_html_content_type, normalize_url, MAX_BODY_SIZE
+from bertha.link_extraction import extract_internal_links
 from bertha.database_setup import initialize_database
+from bertha.exceptions import SitemapRetrievalError, CrawlFrontierError
+from bertha.crawl_session import (
+    get_crawl_session,
+    store_session_sitemap_urls,
+    get_session_sitemap_urls,
+    checkpoint_sitemap_position,
+    start_session_batch,
+    checkpoint_batch_position,
+)
 
 from bertha.database_operations import (
     insert_if_not_exists,
-    update_referring_pages,
+    store_internal_links,
     update_crawl_info,
     update_sitemaps_for_url,
-    get_urls_to_crawl,
+    get_url_depth,
+    get_redirect_sources,
+    park_url,
+    REDIRECT_VERIFY_DAYS,
 )
+from bertha.circuit_breaker import HostCircuitBreakers
+from bertha.dns_cache import prefetch_hosts
+from bertha.retry_policy import DATABASE, NETWORK, CRAWL
+from bertha.scheduler import refresh_crawl_priorities, next_crawl_batch
+
+def pages_from_sitemaps(website_url):
+    """
+    Returns the (url, sitemap_url) pairs listed in the sitemaps of a website.
+
+    dourado is imported here rather than at module level so that importing bertha stays cheap.
+
+    :param website_url: The base URL of the website.
+    :return: A list of (url, sitemap_url) tuples.
+    """
+    from dourado import pages_from_sitemaps as dourado_pages_from_sitemaps
+    return dourado_pages_from_sitemaps(website_url=website_url)
+
+def _store_crawl_result(url, page, db_name, retry_policy, redirect_chain=None):
+    status_code = page["status_code"]
+    successful = status_code == 200
+
+    if status_code is None or status_code >= 400:
+        # Update the HTTP status and dt_last_crawl in the database if the page is not available
+        retry_policy.call(f"Updating the crawl info of '{url}'", update_crawl_info, url, status_code, successful,
+                          db_name, redirect_chain=redirect_chain)
+        print(f"Updated '{url}' with status {status_code}.")
+        return
+
+    # Page is available; get internal links from the body already fetched, unless they were extracted before
+    internal_links = page.get("links")
+    if internal_links is None and page["body"]:
+        internal_links = extract_internal_links(page["body"], url, page["content_type"])
+    store_internal_links(url, internal_links or [], db_name, retry_policy=retry_policy)
+
+    # Update the HTTP status, dt_last_crawl, and successful_page_fetch in the database for the crawled URL
+    retry_policy.call(f"Updating the crawl info of '{url}'", update_crawl_info, url, status_code, successful,
+                      db_name, redirect_chain=redirect_chain)
+    print(f"Crawled and updated '{url}' with status {status_code}.")
+
+def _followed_redirects(url, page):
+    """Returns the redirects of a response, ignoring those that only added or removed a trailing slash."""
+    if page["redirects"] and normalize_url(page["url"]) == normalize_url(url):
+        # Only a trailing slash was added or removed, which URLs are normalized for anyway
+        return []
+    return page["redirects"]
+
+def _crawl_result_url(url, page):
+    """
+    Returns the URL a response is stored as the crawl of: the URL itself, or its redirect target
+    if that is an HTML page of the same host, or None if the target is not crawled.
+    """
+    if not _followed_redirects(url, page):
+        return url
+    target_url = normalize_url(page["url"])
+    if (page["status_code"] is not None and is_html_content_type(page["content_type"])
+            and urlparse(target_url).netloc.lower() == urlparse(url).netloc.lower()):
+        return target_url
+    return None
+
+def _archive_page(url, page, archive):
+    """Archives the body of a response under the URL it is stored as the crawl of, if it has links to store."""
+    if archive is None or not page["body"] or page["status_code"] is None or page["status_code"] >= 400:
+        return
+    result_url = _crawl_result_url(url, page)
+    if result_url is not None:
+        archive.store(result_url, page["body"], page["content_type"])
+
+def _store_page(url, page, db_name, retry_policy=DATABASE):
+    """
+    Stores the response to a URL, and that of its redirect target, in the database.
+    Each write is retried on its own with retry_policy, so a lock does not repeat the writes before it.
+    """
+    status_code = page["status_code"]
+    dt_last_crawl = datetime.now().strftime('%Y%m%d%H%M%S')
+
+    redirects = _followed_redirects(url, page)
+    if redirects:
+        # Store the chain with the source, and the final response as the crawl of its target
+        retry_policy.call(f"Updating the crawl info of '{url}'", update_crawl_info, url, redirects[0]["status_code"],
+                          False, db_name, redirect_chain=redirects)
+        print(f"'{url}' redirects to '{page['url']}' ({len(redirects)} hops), dt_last_crawl {dt_last_crawl}.")
+        target_url = _crawl_result_url(url, page)
+        if target_url is not None:
+            insert_if_not_exists(target_url, db_name=db_name, depth=get_url_depth(url, db_name), check_page=False,
+                                 retry_policy=retry_policy)
+            _store_crawl_result(target_url, page, db_name, retry_policy)
+    else:
+        # A URL that answered without redirecting no longer redirects
+        _store_crawl_result(url, page, db_name, retry_policy, redirect_chain=[] if status_code is not None else None)
 
-def crawl_pages(urls, db_name='db_websites.db', retries=5):
+def crawl_pages(urls, db_name='db_websites.db', retries=5, breakers=None, max_body_size=MAX_BODY_SIZE,
+                host_limiter=None, initialize=True, archive=None, timeout=30):
     """
     Crawls the provided collection of URLs, checking the status of pages and updating the database.
     
     :param urls: A collection of URLs to crawl.
     :param db_name: The name of the SQLite database file (default is 'db_websites.db').
-    :param retries: The number of times to retry the operation if the database is locked.
+    :param retries: The number of attempts per database write if the database is locked.
+    :param breakers: A ``HostCircuitBreakers`` registry. URLs of hosts whose breaker is open
+                     are parked instead of fetched.
+    :param max_body_size: The maximum number of bytes of a page body read for link extraction.
+    :param host_limiter: A ``HostLimiter`` capping concurrent requests per host, if any.
+    :param initialize: Whether to make sure the database is initialized first.
+    :param archive: A ``PageArchive`` keeping the bodies read, if any.
+    :param timeout: The maximum time in seconds to wait between attempts of a write.
+    :return: The number of URLs fetched, i.e. not parked.
     """
+    retry_policy = DATABASE.copy(attempts=retries, max_delay=timeout)
+    fetched = 0
     # Ensure the database is initialized
-    initialize_database(db_name)
+    if initialize:
+        initialize_database(db_name)
 
     for url in urls:
-        # Attempt to crawl each URL, with retries in case of database locks
-        for attempt in range(retries):
-            try:
-                # Check the HTTP status of the URL
-                status_code = check_http_status(url)
-                dt_last_crawl = datetime.now().strftime('%Y%m%d%H%M%S')
-                successful = status_code == 200
-
-                if status_code is None or status_code >= 400:
-                    # Update the HTTP status and dt_last_crawl in the database if the page is not available
-                    update_crawl_info(url, status_code, successful, db_name)
-                    print(f"Updated '{url}' with status {status_code} and dt_last_crawl {dt_last_crawl}.")
-                else:
-                    # Page is available; get internal links
-                    internal_links = internal_links_on_page(url)
+        if breakers is not None and not breakers.allow_request(url):
+            # The host is failing; leave the URL for when its breaker lets requests through again
+            park_url(url, breakers.retry_after(url) or breakers.get(url).cooldown, db_name)
+            continue
 
-                    # Insert each internal link if it doesn't already exist
-                    for link in internal_links:
-                        insert_if_not_exists(link, db_name=db_name)
-                        # Update referring_pages for each existing link
-                        update_referring_pages(link, url, db_name=db_name)
+        # Fetch the page; the body is only kept for HTML pages, up to max_body_size
+        if host_limiter is not None:
+            with host_limiter.slot(url):
+                page = fetch_page(url, max_body_size=max_body_size)
+        else:
+            page = fetch_page(url, max_body_size=max_body_size)
+        fetched += 1
+        if breakers is not None:
+            breakers.record_result(url, page["status_code"])
 
-                    # Update the HTTP status, dt_last_crawl, and successful_page_fetch in the database for the crawled URL
-                    update_crawl_info(url, status_code, successful, db_name)
-                    print(f"Crawled and updated '{url}' with status {status_code} and dt_last_crawl {dt_last_crawl}.")
+        # Archive the body once, then store the response; only a write that meets a database lock is retried
+        _archive_page(url, page, archive)
+        _store_page(url, page, db_name, retry_policy)
+    return fetched
 
-                break  # Break the retry loop if successful
+def verify_redirects(base_url, db_name='db_websites.db', max_age_days=REDIRECT_VERIFY_DAYS, **options):
+    """
+    Crawls the known redirects of a website again, to check they still lead to the same target.
 
-            except sqlite3.OperationalError as e:
-                if 'locked' in str(e):
-                    print(f"Database is locked, retrying {attempt + 1}/{retries}...")
-                    time.sleep(2)  # Wait before retrying, increase the sleep time if necessary
-                else:
-                    raise
+    The crawl frontier skips known redirects until they are REDIRECT_VERIFY_DAYS old, so this runs
+    the verification pass explicitly, e.g. with max_age_days=0 after a site migration changed.
+
+    :param base_url: The base URL of the website.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param max_age_days: Only verify redirects last verified more than this many days ago.
+    :param options: Further keyword arguments for crawl_pages, e.g. breakers or host_limiter.
+    :return: The number of redirects verified.
+    """
+    sources = [url for url, _ in get_redirect_sources(base_url, max_age_days, db_name)]
+    crawl_pages(sources, db_name, **options)
+    print(f"Verified {len(sources)} redirects of {base_url}.")
+    return len(sources)
+
+def _store_sitemap_url(url, sitemap_url, db_name):
+    """Stores a URL listed in a sitemap, with the sitemap it was listed in."""
+    insert_if_not_exists(url=url, db_name=db_name)
+    update_sitemaps_for_url(url=url, sitemap_url=sitemap_url, db_name=db_name)
+
+def process_sitemaps(base_url, retries, timeout, db_name='db_websites.db', session_id=None):
+    """
+    Retrieves the URLs listed in the sitemaps of a website and stores them in the database.
+
+    When a crawl session is given, the retrieved URLs are kept with the session and the
+    ingestion position is checkpointed after every URL, so a resumed session continues
+    with the next URL instead of retrieving the sitemaps again.
+
+    :param base_url: The base URL of the website.
+    :param retries: Number of attempts per operation if it fails with a transient error.
+    :param timeout: The maximum time in seconds to wait between attempts.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param session_id: The id of the crawl session to checkpoint, if any.
+    :raises SitemapRetrievalError: If the sitemaps cannot be retrieved.
+    """
+    session = get_crawl_session(session_id, db_name) if session_id is not None else None
+    retry_policy = CRAWL.copy(attempts=retries, max_delay=timeout)
 
-def process_sitemaps(base_url, retries, timeout):
-    for attempt in range(retries):
+    if session is not None and session['sitemap_total'] is not None:
+        start = session['sitemap_position']
+        print(f"Resuming sitemap ingestion for {base_url} at {start}/{session['sitemap_total']}.")
+        pending = get_session_sitemap_urls(session_id, start, db_name)
+    else:
         try:
-            urls_collected_from_sitemaps = pages_from_sitemaps(website_url=base_url)
-            print(f"Retrieved URLs from sitemaps for {base_url}")
-            break
+            urls_collected_from_sitemaps = NETWORK.copy(attempts=retries, max_delay=timeout).call(
+                f"Retrieving URLs from sitemaps for {base_url}", pages_from_sitemaps, website_url=base_url
+            )
         except Exception as e:
-            print(f"Retrieving URLs from sitemaps failed, retrying {attempt + 1}/{retries}...")
-            time.sleep(timeout)
-    else:
-        print("Failed to retrieve URLs from sitemaps after multiple attempts.")
-        sys.exit(1)
-    
-    for url_from_sitemap, referring_sitemap in urls_collected_from_sitemaps:
-        for attempt in range(retries):
-            try:
-                insert_if_not_exists(url=url_from_sitemap)
-                update_sitemaps_for_url(url=url_from_sitemap, sitemap_url=referring_sitemap)
-                
-                print(f"Processed sitemap URL: {url_from_sitemap}")
-                break
-            except Exception as e:
-                print(f"Processing {url_from_sitemap} failed, retrying {attempt + 1}/{retries}...")
-                time.sleep(timeout)
-        else:
-            print(f"Failed to process {url_from_sitemap} after multiple attempts.")
+            raise SitemapRetrievalError(f"Failed to retrieve URLs from sitemaps for {base_url}.") from e
+        print(f"Retrieved URLs from sitemaps for {base_url}")
+
+        if session_id is not None:
+            store_session_sitemap_urls(session_id, urls_collected_from_sitemaps, db_name)
+        pending = [
+            (position, url_from_sitemap, referring_sitemap)
+            for position, (url_from_sitemap, referring_sitemap) in enumerate(urls_collected_from_sitemaps)
+        ]
+
+    prefetch_hosts([url_from_sitemap for _, url_from_sitemap, _ in pending])
+    for position, url_from_sitemap, referring_sitemap in pending:
+        try:
+            retry_policy.call(f"Processing {url_from_sitemap}", _store_sitemap_url, url_from_sitemap,
+                              referring_sitemap, db_name)
+            print(f"Processed sitemap URL: {url_from_sitemap}")
+        except Exception as e:
+            print(f"Failed to process {url_from_sitemap}: {e}")
+
+        if session_id is not None:
+            checkpoint_sitemap_position(session_id, position + 1, db_name)
+
+def crawl_all_pages(base_url, gap, retries, timeout, db_name='db_websites.db', session_id=None, batch_size=100, breakers=None,
+                    max_body_size=MAX_BODY_SIZE, host_limiter=None, archive=None):
+    """
+    Crawls every URL of a website that is due, in batches, until none are left.
+    Each batch holds the URLs with the highest crawl priority (see ``bertha.scheduler``).
+
+    When a crawl session is given, each batch is recorded with the session and the
+    position in the batch is checkpointed after every URL, so a resumed session
+    finishes the in-flight batch before selecting a new one.
+
+    :param base_url: The base URL of the website.
+    :param gap: The number of days to check if the URL's last crawl is outdated.
+    :param retries: Number of attempts per operation if it fails with a transient error.
+    :param timeout: The maximum time in seconds to wait between attempts.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param session_id: The id of the crawl session to checkpoint, if any.
+    :param batch_size: The number of URLs selected per batch.
+    :param breakers: A ``HostCircuitBreakers`` registry shared across calls. A new one is used if None.
+    :param max_body_size: The maximum number of bytes of a page body read for link extraction.
+    :param host_limiter: A ``HostLimiter`` capping concurrent requests per host, if any.
+    :param archive: A ``PageArchive`` keeping the bodies read, if any.
+    :raises CrawlFrontierError: If the URLs to crawl cannot be read from the database.
+    """
+    if breakers is None:
+        breakers = HostCircuitBreakers()
+    retry_policy = CRAWL.copy(attempts=retries, max_delay=timeout)
+    initialize_database(db_name)
+    refresh_crawl_priorities(base_url, db_name)
+
+    batch, position = None, 0
+    if session_id is not None:
+        session = get_crawl_session(session_id, db_name)
+        if session['batch_position'] < len(session['current_batch']):
+            batch, position = session['current_batch'], session['batch_position']
+            print(f"Resuming in-flight batch at {position}/{len(batch)}.")
 
-def crawl_all_pages(base_url, gap, retries, timeout):
     while True:
-        for attempt in range(retries):
+        if batch is None:
             try:
-                urls = get_urls_to_crawl(base_url, gap)
-                break
+                urls = retry_policy.call("Retrieving URLs to crawl", next_crawl_batch, base_url, gap, batch_size, db_name)
             except Exception as e:
-                print(f"Retrieving URLs to crawl failed, retrying {attempt + 1}/{retries}...")
-                time.sleep(timeout)
-        else:
-            print("Failed to retrieve URLs to crawl after multiple attempts.")
-            sys.exit(1)
+                raise CrawlFrontierError(f"Failed to retrieve URLs to crawl for {base_url}.") from e
 
-        if not urls:
-            print("No more URLs to crawl.")
-            break
+            if session_id is not None:
+                start_session_batch(session_id, urls, db_name)
 
-        for url in urls:
-            for attempt in range(retries):
-                try:
-                    crawl_pages([url])
+            if not urls:
+                print("No more URLs to crawl.")
+                break
+
+            batch, position = urls, 0
+
+        prefetch_hosts(batch[position:])
+        for index in range(position, len(batch)):
+            url = batch[index]
+            crawled = failed = False
+            try:
+                # Not retried as a whole: the page would be fetched again for a write that crawl_pages already retried
+                if crawl_pages([url], db_name, retries=retries, breakers=breakers, max_body_size=max_body_size,
+                               host_limiter=host_limiter, initialize=False, archive=archive, timeout=timeout):
                     print(f"Crawled page: {url}")
-                    break
-                except Exception as e:
-                    print(f"Crawling {url} failed, retrying {attempt + 1}/{retries}...")
-                    time.sleep(timeout)
-            else:
-                print(f"Failed to crawl {url} after multiple attempts.")
+                    crawled = True
+                else:
+                    # Parked while its host's circuit breaker is open; neither crawled nor failed
+                    print(f"Parked {url} until its host recovers.")
+            except Exception as e:
+                failed = True
+                print(f"Failed to crawl {url}: {e}")
+                # Record the failure so the URL is not selected again in this crawl
+                try:
+                    update_crawl_info(url, None, False, db_name)
+                except sqlite3.OperationalError as e:
+                    print(f"Recording the failure of {url} failed: {e}")
+
+            if session_id is not None:
+                checkpoint_batch_position(session_id, index + 1, crawled=int(crawled), failed=int(failed), db_name=db_name)
+
+        batch, position = None, 0
@@ -0,0 +1,270 @@
+# bertha/crawl_session.py
+
+"""
+Crawl sessions.
+
+A crawl session records how far a crawl of a website has progressed: the phase it
+is in, how many of the sitemap URLs have been ingested, the batch of URLs being
+crawled and how far into that batch it got. Progress is checkpointed after every
+URL, so a crawl that is interrupted resumes exactly where it stopped instead of
+replaying the sitemap retrieval or the batches already crawled.
+
+Phases run in this order: ``sitemaps`` -> ``crawl`` -> ``indexibility`` -> ``done``.
+A session is ``running`` while it is being worked on, and ends ``completed`` or
+``failed``. Any session that is not ``completed`` can be resumed.
+"""
+
+import json
+import sqlite3
+from datetime import datetime
+
+from bertha.database_operations import write_lock
+from bertha.exceptions import CrawlSessionError
+
+PHASES = ('sitemaps', 'crawl', 'indexibility', 'done')
+RESUMABLE_STATES = ('running', 'failed')
+
+_SESSION_COLUMNS = (
+    'id', 'base_url', 'state', 'phase', 'dt_started', 'dt_last_checkpoint', 'dt_finished',
+    'sitemap_total', 'sitemap_position', 'current_batch', 'batch_position',
+    'urls_crawled', 'urls_failed', 'error'
+)
+
+
+def _now():
+    return datetime.now().strftime('%Y%m%d%H%M%S')
+
+
+def start_crawl_session(base_url, db_name='db_websites.db'):
+    """
+    Creates a new crawl session for a website.
+
+    :param base_url: The base URL of the website being crawled.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: The id of the new session.
+    """
+    now = _now()
+    with write_lock(db_name), sqlite3.connect(db_name, timeout=30) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO tb_crawl_sessions (base_url, state, phase, dt_started, dt_last_checkpoint)
+            VALUES (?, 'running', ?, ?, ?)
+        ''', (base_url, PHASES[0], now, now))
+        session_id = cursor.lastrowid
+    print(f"Started crawl session {session_id} for {base_url}.")
+    return session_id
+
+
+def get_crawl_session(session_id, db_name='db_websites.db'):
+    """
+    Fetches a crawl session.
+
+    :param session_id: The id of the session.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: A dictionary with the session data. ``current_batch`` is decoded to a list.
+    :raises CrawlSessionError: If the session does not exist.
+    """
+    with sqlite3.connect(db_name, timeout=30) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {", ".join(_SESSION_COLUMNS)}
+            FROM tb_crawl_sessions
+            WHERE id = ?
+        ''', (session_id,))
+        row = cursor.fetchone()
+
+    if row is None:
+        raise CrawlSessionError(f"Crawl session {session_id} does not exist.")
+
+    session = dict(zip(_SESSION_COLUMNS, row))
+    session['current_batch'] = json.loads(session['current_batch']) if session['current_batch'] else []
+    return session
+
+
+def find_resumable_session(base_url, db_name='db_websites.db'):
+    """
+    Finds the most recent session of a website that did not complete.
+
+    :param base_url: The base URL of the website.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: A dictionary with the session data, or None if there is nothing to resume.
+    """
+    with sqlite3.connect(db_name, timeout=30) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT id
+            FROM tb_crawl_sessions
+            WHERE base_url = ? AND state IN ({", ".join("?" for _ in RESUMABLE_STATES)})
+            ORDER BY id DESC
+            LIMIT 1
+        ''', (base_url, *RESUMABLE_STATES))
+        row = cursor.fetchone()
+
+    if row is None:
+        return None
+    return get_crawl_session(row[0], db_name)
+
+
+def resume_crawl_session(session_id, db_name='db_websites.db'):
+    """
+    Marks a session as running again after an interruption or a failure.
+
+    :param session_id: The id of the session.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: A dictionary with the session data.
+    :raises CrawlSessionError: If the session does not exist or has already completed.
+    """
+    session = get_crawl_session(session_id, db_name)
+    if session['state'] not in RESUMABLE_STATES:
+        raise CrawlSessionError(f"Crawl session {session_id} is {session['state']} and cannot be resumed.")
+
+    with write_lock(db_name), sqlite3.connect(db_name, timeout=30) as conn:
+        conn.execute('''
+            UPDATE tb_crawl_sessions
+            SET state = 'running', error = NULL, dt_last_checkpoint = ?
+            WHERE id = ?
+        ''', (_now(), session_id))
+    print(f"Resuming crawl session {session_id} for {session['base_url']} in phase '{session['phase']}'.")
+    session['state'] = 'running'
+    session['error'] = None
+    return session
+
+
+def set_session_phase(session_id, phase, db_name='db_websites.db'):
+    """
+    Moves a session to the given phase.
+
+    :param session_id: The id of the session.
+    :param phase: One of ``PHASES``.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    """
+    if phase not in PHASES:
+        raise ValueError(f"Unknown crawl session phase: {phase}")
+
+    with write_lock(db_name), sqlite3.connect(db_name, timeout=30) as conn:
+        conn.execute('''
+            UPDATE tb_crawl_sessions
+            SET phase = ?, dt_last_checkpoint = ?
+            WHERE id = ?
+        ''', (phase, _now(), session_id))
+
+
+def finish_crawl_session(session_id, state='completed', error=None, db_name='db_websites.db'):
+    """
+    Ends a session.
+
+    :param session_id: The id of the session.
+    :param state: Either 'completed' or 'failed'.
+    :param error: A description of the error that ended the session, if any.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    """
+    now = _now()
+    phase_sql = ", phase = 'done'" if state == 'completed' else ''
+    with write_lock(db_name), sqlite3.connect(db_name, timeout=30) as conn:
+        conn.execute(f'''
+            UPDATE tb_crawl_sessions
+            SET state = ?, error = ?, dt_finished = ?, dt_last_checkpoint = ?{phase_sql}
+            WHERE id = ?
+        ''', (state, error, now, now, session_id))
+    print(f"Crawl session {session_id} {state}.")
+
+
+def store_session_sitemap_urls(session_id, urls_from_sitemaps, db_name='db_websites.db'):
+    """
+    Stores the URLs retrieved from the sitemaps so they can be ingested, and resumed, in order.
+
+    :param session_id: The id of the session.
+    :param urls_from_sitemaps: An iterable of (url, sitemap_url) tuples.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: The number of URLs stored.
+    """
+    rows = [
+        (session_id, position, url, sitemap_url)
+        for position, (url, sitemap_url) in enumerate(urls_from_sitemaps)
+    ]
+    with write_lock(db_name), sqlite3.connect(db_name, timeout=30) as conn:
+        conn.execute('DELETE FROM tb_session_sitemap_urls WHERE session_id = ?', (session_id,))
+        conn.executemany('''
+            INSERT INTO tb_session_sitemap_urls (session_id, position, url, sitemap_url)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        conn.execute('''
+            UPDATE tb_crawl_sessions
+            SET sitemap_total = ?, sitemap_position = 0, dt_last_checkpoint = ?
+            WHERE id = ?
+        ''', (len(rows), _now(), session_id))
+    return len(rows)
+
+
+def get_session_sitemap_urls(session_id, start=0, db_name='db_websites.db'):
+    """
+    Returns the stored sitemap URLs of a session from the given position onwards.
+
+    :param session_id: The id of the session.
+    :param start: The position to start from.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: A list of (position, url, sitemap_url) tuples.
+    """
+    with sqlite3.connect(db_name, timeout=30) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT position, url, sitemap_url
+            FROM tb_session_sitemap_urls
+            WHERE session_id = ? AND position >= ?
+            ORDER BY position
+        ''', (session_id, start))
+        return cursor.fetchall()
+
+
+def checkpoint_sitemap_position(session_id, position, db_name='db_websites.db'):
+    """
+    Records that every sitemap URL before ``position`` has been ingested.
+
+    :param session_id: The id of the session.
+    :param position: The position of the next sitemap URL to ingest.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    """
+    with write_lock(db_name), sqlite3.connect(db_name, timeout=30) as conn:
+        conn.execute('''
+            UPDATE tb_crawl_sessions
+            SET sitemap_position = ?, dt_last_checkpoint = ?
+            WHERE id = ?
+        ''', (position, _now(), session_id))
+
+
+def start_session_batch(session_id, urls, db_name='db_websites.db'):
+    """
+    Records the batch of URLs the session is about to crawl.
+
+    :param session_id: The id of the session.
+    :param urls: The URLs in the batch, in crawl order.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    """
+    batch = json.dumps(list(urls)) if urls else None
+    with write_lock(db_name), sqlite3.connect(db_name, timeout=30) as conn:
+        conn.execute('''
+            UPDATE tb_crawl_sessions
+            SET current_batch = ?, batch_position = 0, dt_last_checkpoint = ?
+            WHERE id = ?
+        ''', (batch, _now(), session_id))
+
+
+def checkpoint_batch_position(session_id, position, crawled=0, failed=0, db_name='db_websites.db'):
+    """
+    Records that every URL of the current batch before ``position`` has been processed.
+
+    :param session_id: The id of the session.
+    :param position: The position of the next URL of the batch to crawl.
+    :param crawled: The number of URLs crawled since the previous checkpoint.
+    :param failed: The number of URLs that failed since the previous checkpoint.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    """
+    with write_lock(db_name), sqlite3.connect(db_name, timeout=30) as conn:
+        conn.execute('''
+            UPDATE tb_crawl_sessions
+            SET batch_position = ?,
+                urls_crawled = urls_crawled + ?,
+                urls_failed = urls_failed + ?,
+                dt_last_checkpoint = ?
+            WHERE id = ?
+        ''', (position, crawled, failed, _now(), session_id))
@@ -1,58 +1,84 @@
-import time
-import sys
+import os
+import json
+import threading
 from sqlite3 import dbapi2 as sqlite3
 from urllib.parse import urlparse
-from sqlalchemy.pool import QueuePool
 from datetime import datetime, timedelta
-from bertha.database_setup import initialize_database
-from bertha.utils import get_robots, is_actual_page, normalize_url
+from bertha.database_setup import initialize_database, add_page_link, referring_pages_sql
+from bertha.exceptions import DatabaseInitializationError, MainUrlInsertionError
+from bertha.change_feed import record_change, robots_flags
+from bertha.utils import get_robots, is_actual_page, is_page_url, normalize_url
+from bertha.retry_policy import DATABASE, CRAWL
+
+# Status codes of URLs that no longer exist
+GONE_STATUS_CODES = (404, 410)
+# Number of gone responses in a row before a URL is skipped, and the backoff that follows
+GONE_THRESHOLD = 2
+GONE_BACKOFF_DAYS = 1
+GONE_MAX_BACKOFF_DAYS = 180
+# Days a known redirect is trusted before its source is crawled again to verify it
+REDIRECT_VERIFY_DAYS = 90
+
+# Writes from the threads of this process are serialized per database file, so websites
+# crawled concurrently queue here instead of failing with 'database is locked'.
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+def write_lock(db_name='db_websites.db'):
+    """
+    Returns the lock that serializes writes to a database within this process.
+
+    :param db_name: The name of the SQLite database file.
+    :return: A re-entrant lock.
+    """
+    with _write_locks_guard:
+        return _write_locks.setdefault(os.path.abspath(db_name), threading.RLock())
+
+def count_website_pages(base_url, db_name='db_websites.db'):
+    """
+    Returns the number of pages of a website stored in the database.
 
-# Create a connection pool
-pool = QueuePool(lambda: sqlite3.connect('db_websites.db'), max_overflow=10, pool_size=5)
+    :param base_url: The base URL of the website.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: The number of pages.
+    """
+    with sqlite3.connect(db_name, timeout=30) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM tb_pages WHERE url LIKE ?', (f'%{base_url}%',))
+        return cursor.fetchone()[0]
 
 def get_conn(db_name='db_websites.db'):
     """
-    Get a connection from the pool, using the specified database name.
+    Open a connection to the specified database.
     
     :param db_name: The name of the SQLite database file.
     :return: A connection object.
     """
     return sqlite3.connect(db_name)
 
-def update_all_urls_indexibility(base_url, retries=5, timeout=2):
+def update_all_urls_indexibility(base_url, retries=5, timeout=2, db_name='db_websites.db'):
     """
     Updates the indexibility of all URLs in the database for the given base URL.
     
     :param base_url: The base URL of the website to check.
-    :param retries: The number of retries for each operation if a timeout occurs.
-    :param timeout: Time in seconds to wait between retries.
+    :param retries: The number of attempts per URL if the database is locked.
+    :param timeout: The maximum time in seconds to wait between attempts.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
     """
     robots_rules = get_robots(base_url)
     if robots_rules is None:
         print(f"No robots.txt rules found for {base_url}. Skipping indexibility updates.")
         return
 
-    conn = get_conn()
-    cursor = conn.cursor()
-    try:
-        cursor.execute('SELECT url FROM tb_pages WHERE url LIKE ?', (f'%{base_url}%',))
-        urls = cursor.fetchall()
-    finally:
-        conn.close()
-
-    for url_tuple in urls:
-        url = url_tuple[0]
-        for attempt in range(retries):
-            try:
-                update_indexibility(url, robots_rules, db_name='db_websites.db')
-                break
-            except Exception as e:
-                print(f"Updating indexibility for {url} failed, retrying {attempt + 1}/{retries}...")
-                time.sleep(timeout)
-        else:
-            print(f"Failed to update indexibility for {url} after multiple attempts.")
+    retry_policy = DATABASE.copy(attempts=retries, max_delay=timeout)
+    # Streamed in batches, so no read transaction is open while the updates write
+    for url in iter_website_urls(base_url, db_name):
+        try:
+            update_indexibility(url, robots_rules, db_name=db_name, retry_policy=retry_policy)
+        except Exception as e:
+            print(f"Failed to update indexibility for {url}: {e}")
 
-def update_indexibility(url, robots_rules, db_name='db_websites.db'):
+def update_indexibility(url, robots_rules, db_name='db_websites.db', retry_policy=DATABASE):
     """
     Updates the robots_index and robots_follow fields for a given URL in the database
     based on the robots.txt rules.
@@ -60,6 +86,7 @@ def update_indexibility(url, robots_rules, db_name='db_websites.db'):
     :param url: The URL to update.
     :param robots_rules: A dictionary of robots.txt rules or None if robots.txt is inaccessible.
     :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param retry_policy: The ``RetryPolicy`` applied if the database is locked.
     """
     if robots_rules is None:
         print(f"No robots.txt rules to apply for {url}. Skipping indexibility update.")
@@ -79,85 +106,109 @@ def update_indexibility(url, robots_rules, db_name='db_websites.db'):
             follow = rule_flags["follow"]
             break
 
-    for i in range(5):
-        try:
-            with sqlite3.connect(db_name, timeout=30) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE tb_pages
-                    SET robots_index = ?, robots_follow = ?
-                    WHERE url = ?
-                ''', (index, follow, url))
-                print(f"Updated robots info for '{url}' with index: {index}, follow: {follow}.")
-                conn.commit()
-            break
+    def write():
+        with write_lock(db_name), sqlite3.connect(db_name, timeout=30) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT robots_index, robots_follow FROM tb_pages WHERE url = ?', (url,))
+            previous = cursor.fetchone()
+            cursor.execute('''
+                UPDATE tb_pages
+                SET robots_index = ?, robots_follow = ?
+                WHERE url = ?
+            ''', (index, follow, url))
+            if previous is not None:
+                old_flags = robots_flags(*previous)
+                new_flags = robots_flags(index, follow)
+                if old_flags != new_flags:
+                    record_change(cursor, url, 'indexibility', old_flags, new_flags)
+            print(f"Updated robots info for '{url}' with index: {index}, follow: {follow}.")
+            conn.commit()
 
-        except sqlite3.OperationalError as e:
-            if 'locked' in str(e):
-                print(f"Database is locked, retrying {i + 1}/5...")
-                time.sleep(2)
-            else:
-                raise
+    retry_policy.call(f"Updating robots info for '{url}'", write)
 
-def insert_if_not_exists(url, referring_page=None, db_name='db_websites.db', retries=5):
+def insert_if_not_exists(url, referring_page=None, db_name='db_websites.db', retries=5, depth=None, check_page=True,
+                         retry_policy=None):
+    """
+    Inserts a URL into the database unless it, or its variant with a trailing slash, is already there.
+
+    :param url: The URL to insert. It is normalized before being stored.
+    :param referring_page: The page the URL was found on, if any.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param retries: The number of times to retry the operation if the database is locked.
+    :param depth: The number of clicks from the base URL the URL was found at, if known.
+                  The depth of an existing URL is lowered when a shorter path to it is found.
+    :param check_page: Whether to check that a URL not stored yet is a page first. Pass False when
+                       its response is already known to be HTML, to skip the HEAD request.
+    :param retry_policy: The ``RetryPolicy`` applied if the database is locked, instead of
+                         DATABASE with ``retries`` attempts.
+    :return: True if the URL is stored, False if it was skipped as not being a page.
+    """
     # Normalize the URL to ensure consistency
     normalized_url = normalize_url(url)
 
-    # Check if the URL is an actual page before proceeding
-    if not is_actual_page(normalized_url):
+    retry_policy = retry_policy or DATABASE.copy(attempts=retries)
+
+    # Check if the URL is an actual page before proceeding; a URL already stored was checked when it was inserted
+    if (check_page and not retry_policy.call(f"Looking up '{normalized_url}'", url_exists, normalized_url, db_name)
+            and not is_actual_page(normalized_url)):
         print(f"insert_if_not_exists: Skipping non-page URL: {normalized_url}")
-        return
+        return False
 
-    for i in range(retries):
-        try:
-            with get_conn(db_name) as conn:
-                cursor = conn.cursor()
-                # Perform the check using the normalized URL
-                cursor.execute('SELECT COUNT(*) FROM tb_pages WHERE url = ? OR url = ?', (normalized_url, normalized_url + '/'))
-                count = cursor.fetchone()[0]
-
-                if count == 0:
-                    dt_discovered = datetime.now().strftime('%Y%m%d%H%M%S')
-                    cursor.execute('''
-                        INSERT INTO tb_pages (url, dt_discovered, sitemaps, referring_pages, successful_page_fetch, status_code)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (normalized_url, dt_discovered, None, referring_page, False, 0))
-                    print(f"Inserted '{normalized_url}' into 'tb_pages' with discovery timestamp '{dt_discovered}'.")
-                else:
-                    print(f"'{normalized_url}' or '{normalized_url}/' already exists in 'tb_pages'.")
-            break
-        except sqlite3.OperationalError as e:
-            if 'locked' in str(e):
-                print(f"Database is locked, retrying {i + 1}/{retries}...")
-                time.sleep(2)  # wait before retrying, increase the sleep time if necessary
+    def write():
+        with write_lock(db_name), get_conn(db_name) as conn:
+            cursor = conn.cursor()
+            # Perform the check using the normalized URL
+            cursor.execute('SELECT COUNT(*) FROM tb_pages WHERE url = ? OR url = ?', (normalized_url, normalized_url + '/'))
+            count = cursor.fetchone()[0]
+
+            if count == 0:
+                dt_discovered = datetime.now().strftime('%Y%m%d%H%M%S')
+                cursor.execute('''
+                    INSERT INTO tb_pages (url, dt_discovered, sitemaps, successful_page_fetch, status_code, depth)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (normalized_url, dt_discovered, None, False, 0, depth))
+                if referring_page:
+                    add_page_link(cursor, cursor.lastrowid, referring_page)
+                record_change(cursor, normalized_url, 'discovered', None, dt_discovered)
+                print(f"Inserted '{normalized_url}' into 'tb_pages' with discovery timestamp '{dt_discovered}'.")
             else:
-                raise
+                if depth is not None:
+                    cursor.execute('''
+                        UPDATE tb_pages
+                        SET depth = ?, crawl_priority = NULL
+                        WHERE (url = ? OR url = ?) AND (depth IS NULL OR depth > ?)
+                    ''', (depth, normalized_url, normalized_url + '/', depth))
+                print(f"'{normalized_url}' or '{normalized_url}/' already exists in 'tb_pages'.")
+
+    retry_policy.call(f"Inserting '{normalized_url}'", write)
+    return True
           
 def update_sitemaps_for_url(url, sitemap_url,  db_name='db_websites.db'):
-    conn = get_conn(db_name=db_name)
-    cursor = conn.cursor()
-    try:
-        cursor.execute('SELECT sitemaps FROM tb_pages WHERE url = ?', (url,))
-        row = cursor.fetchone()
+    with write_lock(db_name):
+        conn = get_conn(db_name=db_name)
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SELECT sitemaps FROM tb_pages WHERE url = ?', (url,))
+            row = cursor.fetchone()
 
-        if row:
-            existing_sitemaps = row[0]
-            if existing_sitemaps:
-                new_sitemaps = f"{existing_sitemaps},{sitemap_url}"
-            else:
-                new_sitemaps = sitemap_url
+            if row:
+                existing_sitemaps = row[0]
+                if existing_sitemaps:
+                    new_sitemaps = f"{existing_sitemaps},{sitemap_url}"
+                else:
+                    new_sitemaps = sitemap_url
             
-            cursor.execute('''
-                UPDATE tb_pages
-                SET sitemaps = ?
-                WHERE url = ?
-            ''', (new_sitemaps, url))
-            conn.commit()
-            print(f"Updated 'sitemaps' field for '{url}'.")
-    finally:
-        conn.close()  # Return the connection to the pool
+                cursor.execute('''
+                    UPDATE tb_pages
+                    SET sitemaps = ?
+                    WHERE url = ?
+                ''', (new_sitemaps, url))
+                conn.commit()
+                print(f"Updated 'sitemaps' field for '{url}'.")
+        finally:
+            conn.close()
 
-def update_crawl_info(url, status_code, successful, db_name='db_websites.db'):
+def update_crawl_info(url, status_code, successful, db_name='db_websites.db', redirect_chain=None):
     """
     Updates the crawl information for a given URL in the database.
 
@@ -165,38 +216,178 @@ def update_crawl_info(url, status_code, successful, db_name='db_websites.db'):
     :param status_code: The HTTP status code returned by the URL.
     :param successful: Boolean indicating whether the page fetch was successful.
     :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param redirect_chain: The redirects followed from the URL (see utils.redirect_chain). The
+                           chain and its final target are stored and marked verified now; an
+                           empty list clears them. None leaves the stored redirect as it is.
     """
-    dt_last_crawl = datetime.now().strftime('%Y%m%d%H%M%S')
-    with sqlite3.connect(db_name, timeout=30) as conn:
+    now = datetime.now()
+    dt_last_crawl = now.strftime('%Y%m%d%H%M%S')
+    with write_lock(db_name), sqlite3.connect(db_name, timeout=30) as conn:
         cursor = conn.cursor()
+
+        cursor.execute('SELECT status_code, dt_last_crawl, gone_count, redirect_target FROM tb_pages WHERE url = ?', (url,))
+        previous = cursor.fetchone()
+
+        # URLs that keep answering 404/410 are skipped for exponentially longer periods
+        gone_count = 0
+        dt_retry_after = None
+        if status_code in GONE_STATUS_CODES:
+            gone_count = ((previous[2] or 0) if previous else 0) + 1
+            if gone_count >= GONE_THRESHOLD:
+                backoff_days = min(GONE_BACKOFF_DAYS * 2 ** (gone_count - GONE_THRESHOLD), GONE_MAX_BACKOFF_DAYS)
+                dt_retry_after = (now + timedelta(days=backoff_days)).strftime('%Y%m%d%H%M%S')
+
+        # The right-hand sides see the row before the update, so a change is counted
+        # when the status differs from the one recorded by the previous crawl.
+        # The priority is cleared so the scheduler scores the URL again.
         cursor.execute('''
             UPDATE tb_pages
-            SET status_code = ?, dt_last_crawl = ?, successful_page_fetch = ?
+            SET status_code = ?, dt_last_crawl = ?, successful_page_fetch = ?,
+                crawl_count = COALESCE(crawl_count, 0) + 1,
+                change_count = COALESCE(change_count, 0)
+                    + (CASE WHEN dt_last_crawl IS NOT NULL AND status_code IS NOT ? THEN 1 ELSE 0 END),
+                crawl_priority = NULL,
+                gone_count = ?, dt_retry_after = ?
             WHERE url = ?
-        ''', (status_code, dt_last_crawl, successful, url))
+        ''', (status_code, dt_last_crawl, successful, status_code, gone_count, dt_retry_after, url))
+
+        if previous is not None:
+            # A URL that was never crawled has no previous status
+            previous_status = previous[0] if previous[1] is not None else None
+            if previous[1] is None or previous_status != status_code:
+                record_change(cursor, url, 'status', previous_status, status_code)
+            if (previous[1] is not None and status_code in GONE_STATUS_CODES
+                    and previous_status not in GONE_STATUS_CODES):
+                record_change(cursor, url, 'removed', previous_status, status_code)
+
+        if redirect_chain or (redirect_chain is not None and previous is not None and previous[3] is not None):
+            # Later crawls skip the source and crawl its target, until the redirect is verified again
+            redirect_target = normalize_url(redirect_chain[-1]["location"]) if redirect_chain else None
+            cursor.execute('''
+                UPDATE tb_pages
+                SET redirect_target = ?, redirect_chain = ?, dt_redirect_verified = ?
+                WHERE url = ?
+            ''', (
+                redirect_target,
+                json.dumps(redirect_chain) if redirect_chain else None,
+                dt_last_crawl if redirect_chain else None,
+                url
+            ))
+            if previous is not None and previous[3] != redirect_target:
+                record_change(cursor, url, 'redirect', previous[3], redirect_target)
         conn.commit()
         print(f"Updated crawl info for '{url}' with status {status_code}, dt_last_crawl {dt_last_crawl}, and successful_page_fetch {successful}.")
+        if dt_retry_after:
+            print(f"'{url}' is gone ({gone_count} times in a row), skipping it until {dt_retry_after}.")
+
+def park_url(url, seconds, db_name='db_websites.db'):
+    """
+    Keeps a URL out of the crawl frontier for a while, e.g. because its host is failing.
+
+    :param url: The URL to park.
+    :param seconds: The number of seconds to park it for.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    """
+    dt_retry_after = (datetime.now() + timedelta(seconds=seconds)).strftime('%Y%m%d%H%M%S')
+    with write_lock(db_name), sqlite3.connect(db_name, timeout=30) as conn:
+        conn.execute('''
+            UPDATE tb_pages
+            SET dt_retry_after = ?
+            WHERE url = ?
+        ''', (dt_retry_after, url))
+    print(f"Parked '{url}' until {dt_retry_after}.")
+
+
+def _iter_urls(where, params, db_name, batch_size):
+    """Streams the URLs of tb_pages matching a condition in URL order, reading batch_size rows at a time."""
+    query = f'SELECT url FROM tb_pages WHERE {where} AND url > ? ORDER BY url LIMIT ?'
+    last_url = ''
+    conn = sqlite3.connect(db_name, timeout=30)
+    try:
+        while True:
+            rows = conn.execute(query, params + (last_url, batch_size)).fetchall()
+            if not rows:
+                return
+            for (url,) in rows:
+                yield url
+            last_url = rows[-1][0]
+    finally:
+        conn.close()
 
+def iter_website_urls(base_url, db_name='db_websites.db', batch_size=1000):
+    """
+    Streams the URLs of a website stored in the database.
 
+    :param base_url: The base URL of the website.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param batch_size: The number of rows read from the database at a time.
+    :return: A generator of URLs, in URL order.
+    """
+    return _iter_urls('url LIKE ?', (f'%{base_url}%',), db_name, batch_size)
 
-def get_urls_to_crawl(base_url, gap=30, db_name='db_websites.db'):
-    # Calculate cutoff date
+def _due_filter(base_url, gap, redirect_verify_days):
+    """Returns the WHERE clause and parameters selecting the URLs of a website that are due for a crawl."""
     if gap == 0:
         # Set cutoff to the start of today
         cutoff_date = datetime.now().strftime('%Y%m%d000000')
     else:
         # Set cutoff to the exact time X days ago
         cutoff_date = (datetime.now() - timedelta(days=gap)).strftime('%Y%m%d%H%M%S')
+    now = datetime.now().strftime('%Y%m%d%H%M%S')
+    verify_cutoff = (datetime.now() - timedelta(days=redirect_verify_days)).strftime('%Y%m%d%H%M%S')
+
+    where = '''(dt_last_crawl IS NULL OR dt_last_crawl < ?)
+        AND (dt_retry_after IS NULL OR dt_retry_after <= ?)
+        AND (redirect_target IS NULL OR dt_redirect_verified IS NULL OR dt_redirect_verified < ?)
+        AND url LIKE ?'''
+    return where, (cutoff_date, now, verify_cutoff, f'%{base_url}%')
+
+def iter_urls_to_crawl(base_url, gap=30, db_name='db_websites.db', batch_size=1000,
+                       redirect_verify_days=REDIRECT_VERIFY_DAYS):
+    """
+    Streams the URLs of a website that are due for a crawl, as get_urls_to_crawl selects them.
+
+    Unlike get_urls_to_crawl, memory use does not grow with the frontier: the URLs are read
+    batch_size at a time in URL order, continuing after the last one, and no read transaction
+    is held while the caller crawls them.
+
+    :param base_url: The base URL of the website.
+    :param gap: The number of days after which a crawled URL is due again. 0 means anything not crawled today.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param batch_size: The number of rows read from the database at a time.
+    :param redirect_verify_days: The number of days after which a known redirect is verified again.
+    :return: A generator of URLs, in URL order.
+    """
+    where, params = _due_filter(base_url, gap, redirect_verify_days)
+    return _iter_urls(where, params, db_name, batch_size)
+
+def get_urls_to_crawl(base_url, gap=30, db_name='db_websites.db', limit=None, redirect_verify_days=REDIRECT_VERIFY_DAYS):
+    """
+    Returns the URLs of a website that were never crawled or were last crawled before the cutoff.
+
+    :param base_url: The base URL of the website.
+    :param gap: The number of days after which a crawled URL is due again. 0 means anything not crawled today.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param limit: The maximum number of URLs to return, or None for all of them.
+    :param redirect_verify_days: The number of days after which a known redirect is verified again.
+    :return: A list of URLs, highest crawl priority first. Parked and gone URLs are left out until their retry time,
+             and known redirects until they are due for verification; their targets are crawled instead.
+    """
+    where, params = _due_filter(base_url, gap, redirect_verify_days)
+    query = f'''
+        SELECT url
+        FROM tb_pages
+        WHERE {where}
+        ORDER BY crawl_priority DESC
+    '''
+    if limit is not None:
+        query += ' LIMIT ?'
+        params += (limit,)
 
     conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
     try:
-        cursor.execute('''
-            SELECT url 
-            FROM tb_pages 
-            WHERE (dt_last_crawl IS NULL OR dt_last_crawl < ?)
-            AND url LIKE ?
-        ''', (cutoff_date, f'%{base_url}%'))
+        cursor.execute(query, params)
 
         urls = cursor.fetchall()
     finally:
@@ -204,108 +395,183 @@ def get_urls_to_crawl(base_url, gap=30, db_name='db_websites.db'):
 
     return [url[0] for url in urls]
 
-def update_referring_pages(url, referring_url, db_name='db_websites.db'):
+def url_exists(url, db_name='db_websites.db'):
     """
-    Updates the referring_pages field for a given URL in the database by appending a new referring URL.
+    Tells whether a URL, or its variant with a trailing slash, is stored in the database.
+
+    :param url: The normalized URL.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: True if the URL is stored.
+    """
+    with sqlite3.connect(db_name, timeout=30) as conn:
+        row = conn.execute('SELECT 1 FROM tb_pages WHERE url = ? OR url = ? LIMIT 1', (url, url + '/')).fetchone()
+    return row is not None
+
+def get_url_depth(url, db_name='db_websites.db'):
+    """
+    Returns the number of clicks from the base URL a URL was found at.
+
+    :param url: The URL.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: The depth, or None if it is not known.
+    """
+    with sqlite3.connect(db_name, timeout=30) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT depth FROM tb_pages WHERE url = ?', (url,))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+def get_redirect_sources(base_url, max_age_days=REDIRECT_VERIFY_DAYS, db_name='db_websites.db'):
+    """
+    Returns the known redirects of a website that were last verified more than max_age_days ago.
+
+    :param base_url: The base URL of the website.
+    :param max_age_days: The age in days of the verifications to redo. 0 returns every known redirect.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: A list of (url, redirect_target) tuples.
+    """
+    cutoff = (datetime.now() - timedelta(days=max_age_days)).strftime('%Y%m%d%H%M%S')
+    with sqlite3.connect(db_name, timeout=30) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT url, redirect_target
+            FROM tb_pages
+            WHERE url LIKE ? AND redirect_target IS NOT NULL
+            AND (dt_redirect_verified IS NULL OR dt_redirect_verified <= ?)
+        ''', (f'%{base_url}%', cutoff))
+        return cursor.fetchall()
+
+def update_referring_pages(url, referring_url, db_name='db_websites.db', retry_policy=DATABASE):
+    """
+    Adds a referring URL to the links of a given URL in the database.
+    A referrer that is already linked is not added again, so inlinks counts distinct referrers.
 
     :param url: The URL for which to update the referring pages.
     :param referring_url: The URL of the page that refers to the target URL.
     :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param retry_policy: The ``RetryPolicy`` applied if the database is locked.
     """
-    for i in range(5):
-        try:
-            with sqlite3.connect(db_name, timeout=30) as conn:
-                cursor = conn.cursor()
-
-                cursor.execute('SELECT referring_pages FROM tb_pages WHERE url = ?', (url,))
-                row = cursor.fetchone()
-
-                if row:
-                    existing_referring_pages = row[0]
-                    if existing_referring_pages:
-                        new_referring_pages = f"{existing_referring_pages},{referring_url}"
-                    else:
-                        new_referring_pages = referring_url
-                    
-                    cursor.execute('''
-                        UPDATE tb_pages
-                        SET referring_pages = ?
-                        WHERE url = ?
-                    ''', (new_referring_pages, url))
-                    print(f"Updated 'referring_pages' for '{url}' with new referrer '{referring_url}'.")
+    def write():
+        with write_lock(db_name), sqlite3.connect(db_name, timeout=30) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM tb_pages WHERE url = ?', (url,))
+            row = cursor.fetchone()
+            if row and add_page_link(cursor, row[0], referring_url):
+                cursor.execute('UPDATE tb_pages SET inlinks = COALESCE(inlinks, 0) + 1 WHERE id = ?', (row[0],))
+                print(f"Updated 'referring_pages' for '{url}' with new referrer '{referring_url}'.")
 
-                conn.commit()
-            break  # Exit the retry loop if successful
+            conn.commit()
 
-        except sqlite3.OperationalError as e:
-            if 'locked' in str(e):
-                print(f"Database is locked, retrying {i + 1}/5...")
-                time.sleep(2)  # Wait before retrying, increase the sleep time if necessary
-            else:
-                raise
+    retry_policy.call(f"Updating 'referring_pages' for '{url}'", write)
 
-def initialize_database_with_retries(retries, timeout):
-    for attempt in range(retries):
-        try:
-            initialize_database()
-            print("Database initialized successfully.")
-            break
-        except Exception as e:
-            print(f"Database initialization failed, retrying {attempt + 1}/{retries}...")
-            time.sleep(timeout)
-    else:
-        print("Failed to initialize the database after multiple attempts.")
-        sys.exit(1)
+def store_internal_links(url, links, db_name='db_websites.db', check_page=True, retry_policy=DATABASE):
+    """
+    Stores the internal links found on a page: each link is inserted unless it is already known,
+    one click deeper than the page, and the page is added to the referrers of each link.
 
-def insert_main_url(base_url, retries, timeout):
-    for attempt in range(retries):
-        try:
-            insert_if_not_exists(url=base_url)
-            print(f"Inserted main URL: {base_url}")
-            break
-        except Exception as e:
-            print(f"Inserting main URL failed, retrying {attempt + 1}/{retries}...")
-            time.sleep(timeout)
-    else:
-        print("Failed to insert main URL after multiple attempts.")
-        sys.exit(1)
+    :param url: The URL of the page.
+    :param links: The absolute URLs the page links to.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param check_page: Whether new links are checked to be pages with a HEAD request. When False,
+                       no request is made and only links with the extension of a file are left out.
+    :param retry_policy: The ``RetryPolicy`` applied to each write if the database is locked.
+    """
+    depth = get_url_depth(url, db_name)
+    link_depth = depth + 1 if depth is not None else None
+
+    for link in links:
+        if not check_page and not is_page_url(link):
+            continue
+        # Normalize once, so the referrers are added to the row the link is stored as
+        link = normalize_url(link)
+        # Insert the link if it doesn't already exist, then add the page to its referrers
+        insert_if_not_exists(link, db_name=db_name, depth=link_depth, check_page=check_page, retry_policy=retry_policy)
+        update_referring_pages(link, url, db_name=db_name, retry_policy=retry_policy)
+
+def initialize_database_with_retries(retries, timeout, db_name='db_websites.db'):
+    """
+    Initializes the database, retrying if it fails.
 
-def fetch_all_website_data(base_url, db_name='db_websites.db'):
+    :param retries: The number of attempts.
+    :param timeout: The maximum time in seconds to wait between attempts.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :raises DatabaseInitializationError: If every attempt fails, or an attempt fails with an error that is not transient.
     """
-    Fetches all data for a given website (base URL) from the database.
+    try:
+        CRAWL.copy(attempts=retries, max_delay=timeout).call("Database initialization", initialize_database, db_name)
+    except Exception as e:
+        raise DatabaseInitializationError(f"Failed to initialize the database '{db_name}'.") from e
+    print("Database initialized successfully.")
+
+def insert_main_url(base_url, retries, timeout, db_name='db_websites.db'):
+    """
+    Stores the base URL of a website, retrying if it fails.
 
     :param base_url: The base URL of the website.
+    :param retries: The number of attempts.
+    :param timeout: The maximum time in seconds to wait between attempts.
     :param db_name: The name of the SQLite database file (default is 'db_websites.db').
-    :return: A list of dictionaries containing all data for each URL.
+    :raises MainUrlInsertionError: If every attempt fails, an attempt fails with an error that is not transient,
+                                   or the URL does not answer as an HTML page, e.g. because its host does not resolve.
     """
-    conn = get_conn(db_name=db_name)
-    cursor = conn.cursor()
     try:
-        cursor.execute('''
-            SELECT url, dt_discovered, sitemaps, referring_pages, successful_page_fetch, status_code, dt_last_crawl, robots_index, robots_follow
-            FROM tb_pages
-            WHERE url LIKE ?
-        ''', (f'%{base_url}%',))
+        stored = CRAWL.copy(attempts=retries, max_delay=timeout).call(
+            "Inserting main URL", insert_if_not_exists, url=base_url, db_name=db_name, depth=0
+        )
+    except Exception as e:
+        raise MainUrlInsertionError(f"Failed to insert main URL {base_url}.") from e
+    if not stored:
+        raise MainUrlInsertionError(f"The main URL {base_url} did not answer as an HTML page.")
+    print(f"Inserted main URL: {base_url}")
+
+def iter_website_data(base_url, db_name='db_websites.db', batch_size=1000):
+    """
+    Streams the data of every URL of a website, reading batch_size rows at a time.
 
-        rows = cursor.fetchall()
-        data = [
-            {
-                "url": row[0],
-                "dt_discovered": row[1],
-                "sitemaps": row[2],
-                "referring_pages": row[3],
-                "successful_page_fetch": row[4],
-                "status_code": row[5],
-                "dt_last_crawl": row[6],
-                "robots_index": row[7],
-                "robots_follow": row[8]
-            }
-            for row in rows
-        ]
+    :param base_url: The base URL of the website.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param batch_size: The number of rows read from the database at a time.
+    :return: A generator of dictionaries with the data of each URL, in URL order.
+    """
+    conn = get_conn(db_name=db_name)
+    try:
+        last_url = ''
+        while True:
+            rows = conn.execute(f'''
+                SELECT url, dt_discovered, sitemaps, {referring_pages_sql()} AS referring_pages, successful_page_fetch, status_code, dt_last_crawl, robots_index, robots_follow
+                FROM tb_pages
+                WHERE url LIKE ? AND url > ?
+                ORDER BY url LIMIT ?
+            ''', (f'%{base_url}%', last_url, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield {
+                    "url": row[0],
+                    "dt_discovered": row[1],
+                    "sitemaps": row[2],
+                    "referring_pages": row[3],
+                    "successful_page_fetch": row[4],
+                    "status_code": row[5],
+                    "dt_last_crawl": row[6],
+                    "robots_index": row[7],
+                    "robots_follow": row[8]
+                }
+            last_url = rows[-1][0]
     finally:
         conn.close()
 
-    return data
+def fetch_all_website_data(base_url, db_name='db_websites.db'):
+    """
+    Fetches all data for a given website (base URL) from the database.
+
+    Use iter_website_data for large websites, to read the rows as they are processed.
+
+    :param base_url: The base URL of the website.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: A list of dictionaries containing all data for each URL.
+    """
+    return list(iter_website_data(base_url, db_name))
 
 def fetch_url_data(url, db_name='db_websites.db'):
     """
@@ -318,8 +584,8 @@ def fetch_url_data(url, db_name='db_websites.db'):
     conn = get_conn(db_name)  # Pass the db_name to get_conn
     cursor = conn.cursor()
     try:
-        cursor.execute('''
-            SELECT url, dt_discovered, sitemaps, referring_pages, successful_page_fetch, status_code, dt_last_crawl, robots_index, robots_follow
+        cursor.execute(f'''
+            SELECT url, dt_discovered, sitemaps, {referring_pages_sql()} AS referring_pages, successful_page_fetch, status_code, dt_last_crawl, robots_index, robots_follow
             FROM tb_pages
             WHERE url = ?
         ''', (url,))
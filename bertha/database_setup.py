@@ -1,6 +1,103 @@
 # bertha/database_setup.py
 import sqlite3
 
+# Columns added to tb_pages after its first release. They are created on new databases
+# and added to existing ones by initialize_database.
+PAGE_COLUMNS = {
+    'depth': 'INTEGER',
+    'inlinks': 'INTEGER DEFAULT 0',
+    'crawl_count': 'INTEGER DEFAULT 0',
+    'change_count': 'INTEGER DEFAULT 0',
+    'crawl_priority': 'REAL',
+    'gone_count': 'INTEGER DEFAULT 0',
+    'dt_retry_after': 'TEXT',
+    'redirect_target': 'TEXT',
+    'redirect_chain': 'TEXT',
+    'dt_redirect_verified': 'TEXT',
+}
+
+def add_missing_columns(cursor, table, columns):
+    """
+    Adds the columns that do not exist yet to a table.
+
+    :param cursor: A cursor on the database.
+    :param table: The name of the table.
+    :param columns: A dictionary of column names to their SQL definition.
+    """
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
+def report_host_sql(column):
+    """
+    Returns the SQL expression of the scheme and host of a URL, as reports.report_host computes it.
+
+    :param column: The SQL expression of the URL, e.g. 'NEW.url'.
+    :return: An SQL expression: the URL up to the first '/' after '://', or the whole URL if there is none.
+    """
+    host_start = f"instr({column}, '://')"
+    slash = f"instr(substr({column}, {host_start} + 3), '/')"
+    return f"(CASE WHEN {host_start} = 0 OR {slash} = 0 THEN {column} ELSE substr({column}, 1, {host_start} + 1 + {slash}) END)"
+
+def referring_pages_sql(table='tb_pages'):
+    """
+    Returns the SQL expression of the comma separated referring pages of a page, rebuilt from tb_page_links.
+
+    :param table: The name or alias of the tb_pages row the expression is evaluated for.
+    :return: An SQL expression: the referrers in the order they were first seen, or the legacy
+             referring_pages column when the page has no links.
+    """
+    return f"""COALESCE((SELECT group_concat(url, ',') FROM (
+        SELECT s.url FROM tb_page_links l JOIN tb_link_sources s ON s.source_id = l.source_id
+        WHERE l.target_id = {table}.id ORDER BY l.source_id)), {table}.referring_pages)"""
+
+def migrate_referring_pages(cursor, batch_size=1000):
+    """
+    Moves the comma separated referring_pages lists of tb_pages into tb_page_links,
+    and clears the column of the migrated rows.
+
+    :param cursor: A cursor on the database.
+    :param batch_size: The number of pages migrated per query.
+    """
+    last_id = 0
+    while True:
+        cursor.execute('''
+            SELECT id, referring_pages FROM tb_pages
+            WHERE id > ? AND referring_pages IS NOT NULL
+            ORDER BY id LIMIT ?
+        ''', (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        for page_id, referring_pages in rows:
+            for referrer in referring_pages.split(','):
+                if referrer:
+                    add_page_link(cursor, page_id, referrer)
+        last_id = rows[-1][0]
+        cursor.execute(
+            'UPDATE tb_pages SET referring_pages = NULL WHERE id IN (%s)' % ','.join('?' * len(rows)),
+            [row[0] for row in rows]
+        )
+
+def add_page_link(cursor, page_id, referrer):
+    """
+    Records that a page is linked from a referrer, storing the referrer URL once for all its links.
+
+    :param cursor: A cursor on the database.
+    :param page_id: The id of the linked page in tb_pages.
+    :param referrer: The URL of the referring page.
+    :return: True if the link is new, False if it was already recorded.
+    """
+    cursor.execute(
+        'INSERT INTO tb_link_sources (url) VALUES (?) ON CONFLICT (url) DO NOTHING', (referrer,)
+    )
+    cursor.execute('''
+        INSERT OR IGNORE INTO tb_page_links (target_id, source_id)
+        SELECT ?, source_id FROM tb_link_sources WHERE url = ?
+    ''', (page_id, referrer))
+    return cursor.rowcount > 0
 
 def initialize_database(db_name='db_websites.db'):
     conn = sqlite3.connect(db_name)
@@ -21,9 +118,129 @@ def initialize_database(db_name='db_websites.db'):
             robots_follow BOOLEAN DEFAULT NULL
         )
     ''')
+    add_missing_columns(cursor, 'tb_pages', PAGE_COLUMNS)
+
+    # Links to a page. Each referrer URL is stored once in tb_link_sources and every link
+    # is a pair of integers, instead of repeating the URL in the referring_pages of each page it links to
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tb_link_sources (
+            source_id INTEGER PRIMARY KEY,
+            url TEXT UNIQUE NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tb_page_links (
+            target_id INTEGER NOT NULL,
+            source_id INTEGER NOT NULL,
+            PRIMARY KEY (target_id, source_id)
+        ) WITHOUT ROWID
+    ''')
+    migrate_referring_pages(cursor)
+
+    # The scheduler selects the next batch to crawl through this index
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_pages_crawl_priority
+        ON tb_pages (crawl_priority DESC)
+    ''')
+
+    # Report queries (see reports.py) scan these instead of the whole table
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_pages_indexible
+        ON tb_pages (url) WHERE successful_page_fetch = 1 AND robots_index = 1
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_pages_status
+        ON tb_pages (status_code, url)
+    ''')
+
+    # Bumped, per host and in total (host ''), on every write the report counts depend on,
+    # so cached counts of a host are only invalidated by writes to that host's pages
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tb_report_versions (
+            host TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+    for event, rows in (
+        ('INSERT', ('NEW',)),
+        ('DELETE', ('OLD',)),
+        ('UPDATE OF url, successful_page_fetch, status_code, dt_last_crawl, robots_index', ('OLD', 'NEW')),
+    ):
+        event_name = event.split()[0].lower()
+        # UNION drops the duplicate when an update keeps the host; WHERE true lets SQLite parse the upsert
+        hosts = ' UNION '.join([f"SELECT {report_host_sql(f'{row}.url')} AS host" for row in rows] + ["SELECT ''"])
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_pages_report_host_{event_name} AFTER {event} ON tb_pages
+            BEGIN
+                INSERT INTO tb_report_versions (host, version)
+                SELECT host, 1 FROM ({hosts}) WHERE true
+                ON CONFLICT (host) DO UPDATE SET version = version + 1;
+            END
+        ''')
+
+    # Crawl sessions record the progress of a crawl so it can be resumed
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tb_crawl_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            base_url TEXT NOT NULL,
+            state TEXT NOT NULL,
+            phase TEXT NOT NULL,
+            dt_started TEXT,
+            dt_last_checkpoint TEXT,
+            dt_finished TEXT,
+            sitemap_total INTEGER,
+            sitemap_position INTEGER DEFAULT 0,
+            current_batch TEXT,
+            batch_position INTEGER DEFAULT 0,
+            urls_crawled INTEGER DEFAULT 0,
+            urls_failed INTEGER DEFAULT 0,
+            error TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_crawl_sessions_base_url
+        ON tb_crawl_sessions (base_url, state)
+    ''')
+
+    # Change feed of crawl results, read with change_feed.changes_since
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tb_changes (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL,
+            change_type TEXT NOT NULL,
+            old_value TEXT,
+            new_value TEXT,
+            dt_change TEXT
+        )
+    ''')
+
+    # URLs retrieved from the sitemaps, kept so ingestion can resume without refetching them
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tb_session_sitemap_urls (
+            session_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            sitemap_url TEXT,
+            PRIMARY KEY (session_id, position)
+        )
+    ''')
     conn.commit()
     cursor.close()
     conn.close()
 
+def enable_wal(db_name='db_websites.db'):
+    """
+    Switches the database to write-ahead logging, so reads do not wait for writes.
+    The setting is stored in the database file.
+
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: The journal mode now in use.
+    """
+    conn = sqlite3.connect(db_name)
+    try:
+        return conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    finally:
+        conn.close()
+
 if __name__ == "__main__":
     initialize_database()
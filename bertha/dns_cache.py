@@ -0,0 +1,309 @@
+# bertha/dns_cache.py
+
+"""
+In-process DNS cache.
+
+Each new connection urllib3 opens for ``requests`` resolves its host through
+``socket.getaddrinfo``, i.e. the system resolver, again. ``dns_cache_adapter`` returns a
+transport adapter whose connections resolve through a ``DnsCache`` instead, so every
+host is resolved once per ``ttl`` by the sessions it is mounted on:
+
+- Failed lookups are cached for ``negative_ttl``, so a host that does not resolve
+  does not hit the resolver for every URL.
+- When a lookup fails but an expired answer is at most ``max_stale`` seconds old,
+  the expired answer is used, so a resolver timeout does not fail the crawl.
+- Threads looking up the same host wait for one resolution instead of each resolving it.
+- ``prefetch`` resolves the hosts of a list of URLs concurrently, before they are
+  crawled. ``prefetch_hosts`` does it with the cache of the shared session, if any.
+- ``metrics`` reports hits, misses, failures and resolution times.
+
+Only TCP lookups without flags are cached; any other call goes to the resolver. The
+system resolver does not tell the record TTLs, so ``ttl`` applies to every host.
+
+``socket.getaddrinfo`` itself is never replaced, so other libraries of the process are
+not affected. ``utils.use_shared_http_session`` mounts a cache on the shared session,
+which every crawl entry point opens.
+"""
+
+import ipaddress
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+DEFAULT_TTL = 300
+DEFAULT_NEGATIVE_TTL = 30
+DEFAULT_MAX_STALE = 3600
+
+
+
+class _Entry:
+    __slots__ = ('results', 'error', 'expires_at', 'stale_until')
+
+    def __init__(self, results, error, expires_at, stale_until=None):
+        self.results = results
+        self.error = error
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+
+
+class DnsCache:
+    """
+    A TTL cache of getaddrinfo results.
+
+    :param ttl: Seconds an answer is used for.
+    :param negative_ttl: Seconds a failed lookup is remembered for.
+    :param max_stale: Seconds after expiry an answer is still used when the resolver fails.
+    :param resolver: The getaddrinfo function to cache. Defaults to the system resolver.
+    :param clock: The function returning the current time in seconds.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, max_stale=DEFAULT_MAX_STALE,
+                 resolver=None, clock=time.monotonic):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_stale = max_stale
+        self.resolver = resolver or socket.getaddrinfo
+        self.clock = clock
+        self._entries = {}
+        self._host_locks = {}
+        self._lock = threading.Lock()
+        self._metrics = {
+            "lookups": 0, "hits": 0, "misses": 0, "failures": 0, "stale": 0,
+            "resolve_seconds": 0.0, "max_resolve_seconds": 0.0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._metrics[name] += amount
+
+    def _cached(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > now:
+            return entry
+        return None
+
+    def _answer(self, entry):
+        if entry.error is not None:
+            raise socket.gaierror(*entry.error.args)
+        return entry.results
+
+    def lookup(self, host):
+        """
+        Returns the TCP addresses of a host, resolving it only if no fresh answer is cached.
+
+        :param host: The host name.
+        :return: A list of getaddrinfo 5-tuples, with port 0 in their socket addresses.
+        :raises socket.gaierror: If the host cannot be resolved.
+        """
+        key = host.lower()
+        self._count("lookups")
+
+        entry = self._cached(key, self.clock())
+        if entry is not None:
+            self._count("hits")
+            return self._answer(entry)
+
+        with self._lock:
+            host_lock = self._host_locks.setdefault(key, threading.Lock())
+        with host_lock:
+            now = self.clock()
+            entry = self._cached(key, now)
+            if entry is not None:
+                # Resolved by another thread while this one waited
+                self._count("hits")
+                return self._answer(entry)
+
+            start = time.perf_counter()
+            try:
+                results = self.resolver(host, None, 0, socket.SOCK_STREAM)
+                error = None
+            except OSError as e:
+                results = None
+                error = e
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self._metrics["misses"] += 1
+                self._metrics["resolve_seconds"] += elapsed
+                self._metrics["max_resolve_seconds"] = max(self._metrics["max_resolve_seconds"], elapsed)
+                previous = self._entries.get(key)
+
+                if error is None:
+                    self._entries[key] = _Entry(results, None, now + self.ttl, now + self.ttl + self.max_stale)
+                    return results
+
+                self._metrics["failures"] += 1
+                if previous is not None and previous.results is not None and now <= previous.stale_until:
+                    # Keep using the expired answer for a while instead of failing every request
+                    self._metrics["stale"] += 1
+                    self._entries[key] = _Entry(previous.results, None, min(now + self.negative_ttl, previous.stale_until),
+                                                previous.stale_until)
+                    print(f"Resolving {host} failed ({error}), using its expired answer.")
+                    return previous.results
+                self._entries[key] = _Entry(None, error, now + self.negative_ttl)
+            raise error
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        """
+        A drop-in replacement for socket.getaddrinfo, answering TCP lookups from the cache.
+
+        Hosts are cached without their port, so a prefetched host is answered for any port.
+        """
+        if isinstance(port, str) and port.isdigit():
+            port = int(port)
+        if (not isinstance(host, str) or not (port is None or isinstance(port, int)) or flags
+                or type not in (0, socket.SOCK_STREAM) or proto not in (0, socket.IPPROTO_TCP)
+                or _is_ip_address(host)):
+            return self.resolver(host, port, family, type, proto, flags)
+
+        results = [
+            (result_family, result_type, result_proto, canonname, (sockaddr[0], port or 0) + tuple(sockaddr[2:]))
+            for result_family, result_type, result_proto, canonname, sockaddr in self.lookup(host)
+            if not family or result_family == family
+        ]
+        if not results:
+            raise socket.gaierror(socket.EAI_NONAME, f"No address of family {family} for {host}")
+        return results
+
+    def prefetch(self, urls, max_workers=8):
+        """
+        Resolves the hosts of URLs concurrently, skipping those with a fresh answer.
+
+        :param urls: URLs, or host names.
+        :param max_workers: The maximum number of lookups at the same time.
+        :return: The number of hosts resolved.
+        """
+        now = self.clock()
+        hosts = set()
+        for url in urls:
+            host = urlparse(url).hostname if '://' in url else url
+            if host and not _is_ip_address(host) and self._cached(host.lower(), now) is None:
+                hosts.add(host.lower())
+        if not hosts:
+            return 0
+
+        def resolve(host):
+            try:
+                self.lookup(host)
+            except OSError:
+                pass  # Remembered as a failed lookup
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(hosts)), thread_name_prefix='bertha-dns') as executor:
+            list(executor.map(resolve, hosts))
+        return len(hosts)
+
+    def metrics(self):
+        """
+        Returns the lookup counters and resolution times.
+
+        :return: A dictionary with the number of lookups, hits, misses (resolutions), failures,
+                 stale answers used, the total and maximum resolution seconds, the average
+                 resolution time in ms and the hit rate.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["hosts"] = len(self._entries)
+        metrics["avg_resolve_ms"] = 1000 * metrics["resolve_seconds"] / metrics["misses"] if metrics["misses"] else 0.0
+        metrics["hit_rate"] = metrics["hits"] / metrics["lookups"] if metrics["lookups"] else 0.0
+        return metrics
+
+    def clear(self):
+        """
+        Forgets every cached answer.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+def _is_ip_address(host):
+    try:
+        ipaddress.ip_address(host.strip('[]'))
+        return True
+    except ValueError:
+        return False
+
+
+def dns_cache_adapter(cache, **adapter_kwargs):
+    """
+    Returns a ``requests`` transport adapter whose connections resolve hosts through a DNS cache.
+
+    Only the connections of the sessions the adapter is mounted on use the cache; the
+    rest of the process keeps the system resolver. Each address of the host is tried in
+    turn, as urllib3 does.
+
+    :param cache: The DnsCache to resolve hosts with.
+    :param adapter_kwargs: Keyword arguments for ``requests.adapters.HTTPAdapter``, e.g. pool_maxsize.
+    :return: A ``requests.adapters.HTTPAdapter`` with the cache in its ``dns_cache`` attribute.
+    """
+    from requests.adapters import HTTPAdapter
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class DnsCacheAdapter(HTTPAdapter):
+        __attrs__ = HTTPAdapter.__attrs__ + ['dns_cache']
+
+        def __init__(self, **kwargs):
+            self.dns_cache = cache
+            super().__init__(**kwargs)
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': _cached_resolution_pool(HTTPConnectionPool, self.dns_cache),
+                'https': _cached_resolution_pool(HTTPSConnectionPool, self.dns_cache),
+            }
+
+    return DnsCacheAdapter(**adapter_kwargs)
+
+
+def _cached_resolution_pool(pool_class, cache):
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+    from urllib3.util.connection import allowed_gai_family
+
+    class CachedResolutionConnection(pool_class.ConnectionCls):
+        def _new_conn(self):
+            host = self._dns_host
+            try:
+                addresses = cache.getaddrinfo(host.strip('[]'), self.port, allowed_gai_family(), socket.SOCK_STREAM)
+            except OSError as e:
+                raise NewConnectionError(self, f"Failed to resolve {host}: {e}") from e
+
+            # Connect to each address in turn; urllib3 then only sees an IP address to connect to
+            error = None
+            for address in addresses:
+                self._dns_host = address[4][0]
+                try:
+                    return super()._new_conn()
+                except ConnectTimeoutError as e:
+                    error = e
+                finally:
+                    self._dns_host = host
+            raise error
+
+    return type(f"CachedResolution{pool_class.__name__}", (pool_class,), {"ConnectionCls": CachedResolutionConnection})
+
+
+def active_dns_cache():
+    """
+    Returns the DNS cache of the shared HTTP session.
+
+    :return: A DnsCache, or None if no shared session is open.
+    """
+    from bertha.utils import shared_dns_cache
+    return shared_dns_cache()
+
+
+def prefetch_hosts(urls, max_workers=8):
+    """
+    Resolves the hosts of URLs ahead of crawling them, if the shared HTTP session has a DNS cache.
+
+    :param urls: URLs about to be crawled.
+    :param max_workers: The maximum number of lookups at the same time.
+    :return: The number of hosts resolved.
+    """
+    cache = active_dns_cache()
+    if cache is None:
+        return 0
+    return cache.prefetch(urls, max_workers)
@@ -0,0 +1,33 @@
+# bertha/exceptions.py
+
+"""
+Exception types raised by bertha.
+
+Every error raised on purpose by the package derives from :class:`BerthaError`,
+so an embedding service can catch a single base class and decide for itself
+whether to retry, alert or exit.
+"""
+
+
+class BerthaError(Exception):
+    """Base class for all errors raised by bertha."""
+
+
+class DatabaseInitializationError(BerthaError):
+    """Raised when the SQLite database cannot be initialized."""
+
+
+class MainUrlInsertionError(BerthaError):
+    """Raised when the base URL of a website cannot be stored in the database."""
+
+
+class SitemapRetrievalError(BerthaError):
+    """Raised when the URLs listed in a website's sitemaps cannot be retrieved."""
+
+
+class CrawlFrontierError(BerthaError):
+    """Raised when the URLs waiting to be crawled cannot be read from the database."""
+
+
+class CrawlSessionError(BerthaError):
+    """Raised when a crawl session does not exist or cannot be resumed."""
@@ -0,0 +1,58 @@
+# bertha/host_limiter.py
+
+"""
+Per-host concurrency limits.
+
+When several websites are crawled in one process, each website runs in its own
+thread. A host shared by several of them, e.g. a CDN or two base URLs on the same
+domain, must still only see ``max_per_host`` requests at a time. Threads waiting
+for a host are released in the order they arrived.
+"""
+
+import threading
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+
+class HostLimiter:
+    """
+    Caps the number of concurrent requests per host.
+
+    :param max_per_host: The maximum number of requests in flight to a single host.
+    """
+
+    def __init__(self, max_per_host=1):
+        self.max_per_host = max_per_host
+        self.in_flight = {}
+        self.waiting = {}
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def slot(self, url):
+        """
+        Holds one of the request slots of the host of a URL while the block runs.
+
+        :param url: The URL about to be requested.
+        """
+        host = urlparse(url).netloc.lower()
+        ticket = object()
+        with self.condition:
+            queue = self.waiting.setdefault(host, deque())
+            queue.append(ticket)
+            while queue[0] is not ticket or self.in_flight.get(host, 0) >= self.max_per_host:
+                self.condition.wait()
+            queue.popleft()
+            if not queue:
+                del self.waiting[host]
+            self.in_flight[host] = self.in_flight.get(host, 0) + 1
+            self.condition.notify_all()
+
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight[host] -= 1
+                if not self.in_flight[host]:
+                    del self.in_flight[host]
+                self.condition.notify_all()
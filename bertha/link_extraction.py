@@ -0,0 +1,86 @@
+# bertha/link_extraction.py
+
+"""
+Extraction of internal links from an HTML body.
+
+Links are extracted from the body bertha already fetched, so a page is downloaded
+once per crawl instead of once for its status and again for its links.
+"""
+
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urldefrag, urlparse
+
+
+class _LinkParser(HTMLParser):
+    """Collects the href of <a> and <area> tags and the first <base href>."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.base_href = None
+        self.hrefs = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('a', 'area'):
+            href = dict(attrs).get('href')
+            if href:
+                self.hrefs.append(href.strip())
+        elif tag == 'base' and self.base_href is None:
+            href = dict(attrs).get('href')
+            if href:
+                self.base_href = href.strip()
+
+
+def decode_body(body, content_type=None):
+    """
+    Decodes an HTML body using the charset of its Content-Type, or UTF-8.
+
+    :param body: The body as bytes.
+    :param content_type: The Content-Type header of the response, if any.
+    :return: The body as a string.
+    """
+    encoding = 'utf-8'
+    if content_type:
+        for part in content_type.split(';')[1:]:
+            name, _, value = part.strip().partition('=')
+            if name.lower() == 'charset' and value:
+                encoding = value.strip('"\' ')
+    try:
+        return body.decode(encoding, errors='replace')
+    except LookupError:
+        return body.decode('utf-8', errors='replace')
+
+
+def extract_internal_links(body, page_url, content_type=None):
+    """
+    Returns the links of a page that point to the same host.
+
+    :param body: The HTML body of the page, as bytes or a string.
+    :param page_url: The URL the page was fetched from, used to resolve relative links.
+    :param content_type: The Content-Type header of the response, used to decode bytes.
+    :return: A list of absolute URLs without fragments, in document order and without duplicates.
+    """
+    if isinstance(body, bytes):
+        body = decode_body(body, content_type)
+
+    parser = _LinkParser()
+    try:
+        parser.feed(body)
+        parser.close()
+    except Exception as e:
+        # Keep whatever was collected before the markup became unparsable
+        print(f"Error parsing links on {page_url}: {e}")
+
+    base_url = urljoin(page_url, parser.base_href) if parser.base_href else page_url
+    host = urlparse(page_url).netloc.lower()
+
+    links = []
+    seen = set()
+    for href in parser.hrefs:
+        link = urldefrag(urljoin(base_url, href))[0]
+        parsed = urlparse(link)
+        if parsed.scheme not in ('http', 'https') or parsed.netloc.lower() != host:
+            continue
+        if link not in seen:
+            seen.add(link)
+            links.append(link)
+    return links
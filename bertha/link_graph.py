@@ -0,0 +1,461 @@
+# bertha/link_graph.py
+
+"""
+Link graph analytics.
+
+The referrers of a page are stored as a comma-joined URL list in ``tb_pages``, which
+cannot be analysed without loading every string. ``LinkGraph`` reads the links once
+and keeps them as a compressed sparse row (CSR) graph of integer node ids:
+
+- ``urls[node]`` is the URL of a node; referrers that were never stored as pages get
+  a node of their own.
+- ``indptr`` and ``indices`` hold the outlinks of every node: the targets of ``node``
+  are ``indices[indptr[node]:indptr[node + 1]]``.
+
+``indices`` holds one 4-byte integer per link, so a site with millions of links takes
+tens of MB instead of the GBs of a dump of the table. Duplicate links and links of a page to
+itself are dropped.
+
+A stored redirect is an edge from its source to its target. Like the crawler, which
+stores a redirect target at the depth of its source, click depth follows redirects
+without counting a click; PageRank and inlink counts treat them as links.
+
+With NumPy installed, counts, click depth and PageRank are computed with whole-array
+operations. Without it, the same results are computed with ``array`` and plain loops,
+which is fine for small sites. The graph can be built from the current layout
+(``from_database``) or from a compact database (``from_compact_database``), which
+already stores links as id pairs.
+
+Usage::
+
+    graph = LinkGraph.from_database('https://www.example.com', 'db_websites.db')
+    for page in graph.page_metrics('https://www.example.com'):
+        print(page['url'], page['inlinks'], page['depth'], page['pagerank'])
+"""
+
+import sqlite3
+from array import array
+from collections import deque
+
+from bertha.database_setup import referring_pages_sql
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, see the module docstring
+    np = None
+
+UNREACHABLE = -1
+
+
+def _split_list(value):
+    return [item for item in (value or '').split(',') if item]
+
+
+def _add_redirect(source, target, sources, targets, redirects):
+    """Records a redirect, and the link it makes, unless it only changed the URL's trailing slash."""
+    if source != target:
+        sources.append(source)
+        targets.append(target)
+        redirects[source] = target
+
+
+class LinkGraph:
+    """
+    A directed graph of the links between the pages of a website, in CSR form.
+
+    :param urls: The URL of every node, indexed by node id.
+    :param sources: An array('i') with the source node of every link.
+    :param targets: An array('i') with the target node of every link, aligned with sources.
+    :param in_sitemap: A bytearray with 1 for the nodes listed in a sitemap.
+    :param use_numpy: Whether to compute with NumPy. Defaults to using it if it is installed.
+    :param redirects: A dictionary of redirect source node to target node. Each redirect must
+                      also be a link in sources and targets.
+    """
+
+    def __init__(self, urls, sources, targets, in_sitemap=None, use_numpy=None, redirects=None):
+        if use_numpy is None:
+            use_numpy = np is not None
+        elif use_numpy and np is None:
+            raise ImportError("NumPy is not installed")
+
+        self.urls = urls
+        self.use_numpy = use_numpy
+        self.in_sitemap = in_sitemap if in_sitemap is not None else bytearray(len(urls))
+        self.num_nodes = len(urls)
+        self.num_edges = len(sources)
+        # Built on the first node_id lookup
+        self._node_ids = None
+
+        redirect_targets = array('i', [UNREACHABLE]) * self.num_nodes
+        for source, target in (redirects or {}).items():
+            redirect_targets[source] = target
+        self.redirect_targets = np.frombuffer(redirect_targets, dtype=np.intc) if use_numpy else redirect_targets
+
+        if use_numpy:
+            self._build_numpy(sources, targets)
+        else:
+            self._build_array(sources, targets)
+
+    def _build_numpy(self, sources, targets):
+        sources = np.frombuffer(sources, dtype=np.intc) if isinstance(sources, array) else np.asarray(sources, dtype=np.intc)
+        targets = np.frombuffer(targets, dtype=np.intc) if isinstance(targets, array) else np.asarray(targets, dtype=np.intc)
+
+        order = np.argsort(sources, kind='stable')
+        self.indices = targets[order]
+        self.indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=self.num_nodes), out=self.indptr[1:])
+        self._in_degree = np.bincount(targets, minlength=self.num_nodes)
+
+    def _build_array(self, sources, targets):
+        n = self.num_nodes
+        indptr = array('q', [0]) * (n + 1)
+        in_degree = array('i', [0]) * n
+        for source, target in zip(sources, targets):
+            indptr[source + 1] += 1
+            in_degree[target] += 1
+        for node in range(n):
+            indptr[node + 1] += indptr[node]
+
+        indices = array('i', [0]) * len(sources)
+        position = array('q', indptr[:n])
+        for source, target in zip(sources, targets):
+            indices[position[source]] = target
+            position[source] += 1
+
+        self.indptr = indptr
+        self.indices = indices
+        self._in_degree = in_degree
+
+    @classmethod
+    def from_database(cls, base_url, db_name='db_websites.db', use_numpy=None):
+        """
+        Builds the link graph of a website from the referrers and redirects stored in tb_pages.
+
+        Rows are streamed, and the URL-to-node index is dropped once the graph is built.
+
+        :param base_url: The base URL of the website.
+        :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+        :param use_numpy: Whether to compute with NumPy. Defaults to using it if it is installed.
+        :return: A LinkGraph.
+        """
+        urls = []
+        node_ids = {}
+        in_sitemap = bytearray()
+        sources = array('i')
+        targets = array('i')
+        redirects = {}
+
+        def node_id(url):
+            node = node_ids.get(url)
+            if node is None:
+                node = node_ids[url] = len(urls)
+                urls.append(url)
+                in_sitemap.append(0)
+            return node
+
+        conn = sqlite3.connect(db_name, timeout=30)
+        try:
+            rows = conn.execute(
+                f'SELECT url, {referring_pages_sql()}, sitemaps, redirect_target FROM tb_pages WHERE url LIKE ?',
+                (f'%{base_url}%',)
+            )
+            for url, referring_pages, sitemaps, redirect_target in rows:
+                target = node_id(url)
+                if _split_list(sitemaps):
+                    in_sitemap[target] = 1
+                for referring_url in set(_split_list(referring_pages)):
+                    source = node_id(referring_url)
+                    if source != target:
+                        sources.append(source)
+                        targets.append(target)
+                if redirect_target:
+                    _add_redirect(target, node_id(redirect_target), sources, targets, redirects)
+        finally:
+            conn.close()
+
+        return cls(urls, sources, targets, in_sitemap, use_numpy, redirects)
+
+    @classmethod
+    def from_compact_database(cls, host=None, db_name='db_compact.db', use_numpy=None):
+        """
+        Builds the link graph from the links and redirects of a compact database (see ``compact_schema``).
+
+        :param host: Only include the URLs of this scheme and host, e.g. 'https://www.example.com'.
+                     All URLs are included if None.
+        :param db_name: The name of the SQLite database file (default is 'db_compact.db').
+        :param use_numpy: Whether to compute with NumPy. Defaults to using it if it is installed.
+        :return: A LinkGraph.
+        """
+        host_filter = ' WHERE h.host = ?' if host is not None else ''
+        params = (host.rstrip('/'),) if host is not None else ()
+
+        urls = []
+        node_ids = {}
+        sources = array('i')
+        targets = array('i')
+
+        conn = sqlite3.connect(db_name, timeout=30)
+        try:
+            rows = conn.execute(f'''
+                SELECT u.url_id, h.host || p.prefix || u.path
+                FROM tb_urls u
+                JOIN tb_hosts h ON h.host_id = u.host_id
+                JOIN tb_path_prefixes p ON p.prefix_id = u.prefix_id
+                {host_filter}
+                ORDER BY u.url_id
+            ''', params)
+            for url_id, url in rows:
+                node_ids[url_id] = len(urls)
+                urls.append(url)
+
+            in_sitemap = bytearray(len(urls))
+            for (url_id,) in conn.execute('SELECT DISTINCT url_id FROM tb_url_sitemaps'):
+                node = node_ids.get(url_id)
+                if node is not None:
+                    in_sitemap[node] = 1
+
+            for target_id, source_id in conn.execute('SELECT target_id, source_id FROM tb_links'):
+                source = node_ids.get(source_id)
+                target = node_ids.get(target_id)
+                if source is not None and target is not None and source != target:
+                    sources.append(source)
+                    targets.append(target)
+
+            # Redirects are stored from version 2 of the compact schema on
+            redirects = {}
+            if 'redirect_target_id' in {row[1] for row in conn.execute('PRAGMA table_info(tb_urls)')}:
+                rows = conn.execute('SELECT url_id, redirect_target_id FROM tb_urls WHERE redirect_target_id IS NOT NULL')
+                for source_id, target_id in rows:
+                    source = node_ids.get(source_id)
+                    target = node_ids.get(target_id)
+                    if source is not None and target is not None:
+                        _add_redirect(source, target, sources, targets, redirects)
+        finally:
+            conn.close()
+
+        return cls(urls, sources, targets, in_sitemap, use_numpy, redirects)
+
+    def node_id(self, url):
+        """
+        Returns the node id of a URL, accepting it with or without a trailing slash.
+
+        :param url: The URL.
+        :return: The node id.
+        :raises KeyError: If the URL is not in the graph.
+        """
+        if self._node_ids is None:
+            self._node_ids = {node_url: node for node, node_url in enumerate(self.urls)}
+        for candidate in (url, url.rstrip('/'), url.rstrip('/') + '/'):
+            node = self._node_ids.get(candidate)
+            if node is not None:
+                return node
+        raise KeyError(url)
+
+    def outlinks(self, node):
+        """
+        Returns the node ids linked from a node.
+
+        :param node: The node id.
+        :return: A slice of the indices array.
+        """
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def inlink_counts(self):
+        """
+        Returns the number of distinct pages linking to each node.
+
+        :return: An array indexed by node id.
+        """
+        return self._in_degree
+
+    def outlink_counts(self):
+        """
+        Returns the number of distinct pages each node links to.
+
+        :return: An array indexed by node id.
+        """
+        if self.use_numpy:
+            return np.diff(self.indptr)
+        return array('q', (self.indptr[node + 1] - self.indptr[node] for node in range(self.num_nodes)))
+
+    def click_depths(self, start_url):
+        """
+        Returns the number of clicks needed to reach each node from a start page.
+        Following a redirect does not count as a click.
+
+        :param start_url: The URL of the start page, usually the base URL of the website.
+        :return: An array indexed by node id, with UNREACHABLE (-1) for nodes that cannot be reached.
+        :raises KeyError: If the start URL is not in the graph.
+        """
+        start = self.node_id(start_url)
+        if self.use_numpy:
+            return self._click_depths_numpy(start)
+
+        # Breadth-first search where redirects cost no click: their targets go to the front of the queue
+        depths = array('i', [UNREACHABLE]) * self.num_nodes
+        depths[start] = 0
+        queue = deque([start])
+        indptr, indices, redirect_targets = self.indptr, self.indices, self.redirect_targets
+        while queue:
+            node = queue.popleft()
+            depth = depths[node]
+            redirect_target = redirect_targets[node]
+            if redirect_target != UNREACHABLE and (depths[redirect_target] == UNREACHABLE
+                                                   or depths[redirect_target] > depth):
+                depths[redirect_target] = depth
+                queue.appendleft(redirect_target)
+            for position in range(indptr[node], indptr[node + 1]):
+                target = indices[position]
+                if depths[target] == UNREACHABLE:
+                    depths[target] = depth + 1
+                    queue.append(target)
+        return depths
+
+    def _with_redirect_targets(self, frontier, depths, depth):
+        """Adds to a frontier the nodes its nodes redirect to, at the same depth."""
+        pending = frontier
+        while pending.size:
+            redirected = self.redirect_targets[pending]
+            redirected = np.unique(redirected[redirected != UNREACHABLE])
+            pending = redirected[depths[redirected] == UNREACHABLE]
+            depths[pending] = depth
+            frontier = np.concatenate((frontier, pending))
+        return frontier
+
+    def _click_depths_numpy(self, start):
+        depths = np.full(self.num_nodes, UNREACHABLE, dtype=np.int32)
+        depths[start] = 0
+        frontier = self._with_redirect_targets(np.array([start], dtype=np.int64), depths, 0)
+        depth = 0
+        while frontier.size:
+            # Gather the outlinks of the whole frontier at once from the CSR slices
+            starts = self.indptr[frontier]
+            lengths = self.indptr[frontier + 1] - starts
+            total = int(lengths.sum())
+            if not total:
+                break
+            offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            neighbours = self.indices[offsets + np.arange(total)]
+            frontier = np.unique(neighbours[depths[neighbours] == UNREACHABLE])
+            depth += 1
+            depths[frontier] = depth
+            frontier = self._with_redirect_targets(frontier, depths, depth)
+        return depths
+
+    def orphan_pages(self):
+        """
+        Returns the pages listed in a sitemap that no page links to.
+
+        :return: A list of URLs.
+        """
+        in_degree = self._in_degree
+        return [self.urls[node] for node in range(self.num_nodes) if self.in_sitemap[node] and not in_degree[node]]
+
+    def pagerank(self, damping=0.85, tolerance=1e-6, max_iterations=100):
+        """
+        Computes the internal PageRank of every node by power iteration.
+
+        The rank of pages without outlinks is spread evenly over all pages, so the ranks
+        always sum to 1.
+
+        :param damping: The probability of following a link rather than jumping to a random page.
+        :param tolerance: Iteration stops once the ranks change by less than this in total.
+        :param max_iterations: The maximum number of iterations.
+        :return: An array of floats indexed by node id.
+        """
+        n = self.num_nodes
+        if not n:
+            return np.zeros(0) if self.use_numpy else array('d')
+        if self.use_numpy:
+            return self._pagerank_numpy(damping, tolerance, max_iterations)
+
+        out_degree = self.outlink_counts()
+        indptr, indices = self.indptr, self.indices
+        rank = array('d', [1.0 / n]) * n
+        for _ in range(max_iterations):
+            dangling = 0.0
+            new_rank = array('d', [0.0]) * n
+            for node in range(n):
+                if out_degree[node]:
+                    share = rank[node] / out_degree[node]
+                    for position in range(indptr[node], indptr[node + 1]):
+                        new_rank[indices[position]] += share
+                else:
+                    dangling += rank[node]
+            base = (1.0 - damping) / n + damping * dangling / n
+            delta = 0.0
+            for node in range(n):
+                value = base + damping * new_rank[node]
+                delta += abs(value - rank[node])
+                new_rank[node] = value
+            rank = new_rank
+            if delta < tolerance:
+                break
+        return rank
+
+    def _pagerank_numpy(self, damping, tolerance, max_iterations):
+        n = self.num_nodes
+        out_degree = np.diff(self.indptr)
+        has_outlinks = out_degree > 0
+        sources = np.repeat(np.arange(n), out_degree)
+        inverse_degree = np.zeros(n)
+        inverse_degree[has_outlinks] = 1.0 / out_degree[has_outlinks]
+
+        rank = np.full(n, 1.0 / n)
+        for _ in range(max_iterations):
+            shares = (rank * inverse_degree)[sources]
+            new_rank = np.bincount(self.indices, weights=shares, minlength=n)
+            dangling = rank[~has_outlinks].sum()
+            new_rank = (1.0 - damping) / n + damping * (new_rank + dangling / n)
+            delta = np.abs(new_rank - rank).sum()
+            rank = new_rank
+            if delta < tolerance:
+                break
+        return rank
+
+    def page_metrics(self, start_url=None, damping=0.85):
+        """
+        Streams the link metrics of every page.
+
+        :param start_url: The URL click depths are measured from. Depths are None if not given.
+        :param damping: The PageRank damping factor.
+        :return: A generator of dictionaries with the url, inlinks, outlinks, depth, pagerank,
+                 in_sitemap and orphan flag of each page.
+        """
+        inlinks = self.inlink_counts()
+        outlinks = self.outlink_counts()
+        depths = self.click_depths(start_url) if start_url is not None else None
+        ranks = self.pagerank(damping)
+        for node in range(self.num_nodes):
+            depth = None
+            if depths is not None and depths[node] != UNREACHABLE:
+                depth = int(depths[node])
+            in_sitemap = bool(self.in_sitemap[node])
+            yield {
+                "url": self.urls[node],
+                "inlinks": int(inlinks[node]),
+                "outlinks": int(outlinks[node]),
+                "depth": depth,
+                "pagerank": float(ranks[node]),
+                "in_sitemap": in_sitemap,
+                "orphan": in_sitemap and not int(inlinks[node]),
+            }
+
+
+def analyze_link_graph(base_url, db_name='db_websites.db', damping=0.85):
+    """
+    Computes the link metrics of every page of a website, with click depths from its base URL.
+
+    :param base_url: The base URL of the website.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param damping: The PageRank damping factor.
+    :return: A generator of dictionaries, as returned by ``LinkGraph.page_metrics``.
+    """
+    graph = LinkGraph.from_database(base_url, db_name)
+    start_url = base_url
+    try:
+        graph.node_id(base_url)
+    except KeyError:
+        print(f"The base URL {base_url} is not in the database; click depths are not computed.")
+        start_url = None
+    return graph.page_metrics(start_url, damping)
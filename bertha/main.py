@@ -1,129 +1,161 @@
 # main.py
-import sqlite3
 import sys
-from bertha.utils import check_http_status
+from bertha.utils import shared_http_session
 from bertha.crawl_pages import crawl_pages, crawl_all_pages, process_sitemaps
 from bertha.database_operations import (
     insert_main_url,
     initialize_database_with_retries,
     update_all_urls_indexibility,
     fetch_all_website_data,
-    fetch_url_data,
-    update_crawl_info
+    fetch_url_data
+)
+from bertha.reports import iter_indexible_pages
+from bertha.crawl_session import (
+    start_crawl_session,
+    find_resumable_session,
+    resume_crawl_session,
+    set_session_phase,
+    finish_crawl_session
 )
 
-def main(base_url, gap, retries=5, timeout=30):
+def main(base_url, gap, retries=5, timeout=30, db_name='db_websites.db', resume=True, archive=None):
     """
     Main function that initializes the database, stores the main URL, retrieves URLs from sitemaps,
     and processes them one by one.
+
+    The crawl runs inside a crawl session. If a previous crawl of the same website was interrupted
+    or failed, its session is resumed from the last checkpoint unless ``resume`` is False. Requests
+    go through the shared HTTP session and its DNS cache, opened for the crawl if none is open.
     
     :param base_url: The base URL of the website to crawl.
     :param gap: The number of days to check if the URL's last crawl is outdated.
-    :param retries: Number of retries for operations if a timeout occurs.
-    :param timeout: Time in seconds to wait between retries.
+    :param retries: Number of attempts per operation if it fails with a transient error.
+    :param timeout: The maximum time in seconds to wait between attempts.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param resume: Whether to resume an unfinished crawl session of the website.
+    :param archive: A ``PageArchive`` keeping the bodies read, if any.
     :return: The data of the website after crawling.
+    :raises BerthaError: If a step of the crawl fails after all retries.
     """
     
     # Step 1: Initialize the database
-    initialize_database_with_retries(retries, timeout)
-    
-    # Step 2: Insert the main URL
-    insert_main_url(base_url, retries, timeout)
-    
-    # Step 3: Retrieve and insert URLs from sitemaps
-    process_sitemaps(base_url, retries, timeout)
-    
-    # Step 4: Crawl the pages one by one
-    crawl_all_pages(base_url, gap, retries, timeout)
-    
-    # Step 5: Update indexibility for all URLs
-    print("Updating indexibility for all URLs...")
-    update_all_urls_indexibility(base_url, retries, timeout)
-    print("Indexibility update complete.")
+    initialize_database_with_retries(retries, timeout, db_name)
+
+    # Steps 2 to 6: Crawl the website in a session
+    with shared_http_session():
+        run_crawl_session(base_url, gap, retries, timeout, db_name, resume, archive=archive)
     
-    # Step 6: Return all data for the website
-    return fetch_all_website_data(base_url)
+    # Step 7: Return all data for the website
+    return fetch_all_website_data(base_url, db_name)
+
+def run_crawl_session(base_url, gap, retries=5, timeout=30, db_name='db_websites.db', resume=True,
+                      breakers=None, host_limiter=None, archive=None):
+    """
+    Crawls a website in a crawl session, on a database that is already initialized.
+
+    :param base_url: The base URL of the website to crawl.
+    :param gap: The number of days to check if the URL's last crawl is outdated.
+    :param retries: Number of attempts per operation if it fails with a transient error.
+    :param timeout: The maximum time in seconds to wait between attempts.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param resume: Whether to resume an unfinished crawl session of the website.
+    :param breakers: A ``HostCircuitBreakers`` registry, to share it between websites.
+    :param host_limiter: A ``HostLimiter`` capping concurrent requests per host, to share it between websites.
+    :param archive: A ``PageArchive`` keeping the bodies read, if any.
+    :return: The id of the crawl session.
+    :raises BerthaError: If a step of the crawl fails after all retries.
+    """
+    # Step 2: Start a crawl session, or pick up the one that did not finish
+    session = find_resumable_session(base_url, db_name) if resume else None
+    if session is not None:
+        session_id = resume_crawl_session(session['id'], db_name)['id']
+        phase = session['phase']
+    else:
+        session_id = start_crawl_session(base_url, db_name)
+        phase = 'sitemaps'
+
+    try:
+        if phase == 'sitemaps':
+            # Step 3: Insert the main URL
+            insert_main_url(base_url, retries, timeout, db_name)
+
+            # Step 4: Retrieve and insert URLs from sitemaps
+            process_sitemaps(base_url, retries, timeout, db_name, session_id=session_id)
+            set_session_phase(session_id, 'crawl', db_name)
+            phase = 'crawl'
 
-def crawl_website(base_url, gap=30):
+        if phase == 'crawl':
+            # Step 5: Crawl the pages one by one
+            crawl_all_pages(base_url, gap, retries, timeout, db_name, session_id=session_id,
+                            breakers=breakers, host_limiter=host_limiter, archive=archive)
+            set_session_phase(session_id, 'indexibility', db_name)
+            phase = 'indexibility'
+
+        if phase == 'indexibility':
+            # Step 6: Update indexibility for all URLs
+            print("Updating indexibility for all URLs...")
+            update_all_urls_indexibility(base_url, retries, timeout, db_name)
+            print("Indexibility update complete.")
+    except Exception as e:
+        finish_crawl_session(session_id, state='failed', error=str(e), db_name=db_name)
+        raise
+
+    finish_crawl_session(session_id, db_name=db_name)
+    return session_id
+
+def crawl_website(base_url, gap=30, db_name='db_websites.db', **options):
     """
     Initiates a crawl of the website starting from the base_url, using the provided gap.
     
     :param base_url: The base URL of the website to crawl.
     :param gap: The number of days to check if the URL's last crawl is outdated (default: 30 days).
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param options: Further keyword arguments for ``main`` (retries, timeout, resume, archive).
     :return: The data of the website after crawling.
     """
-    return main(base_url, gap)
+    return main(base_url, gap, db_name=db_name, **options)
 
-def recrawl_website(base_url):
+def recrawl_website(base_url, db_name='db_websites.db', **options):
     """
     Forces a recrawl of the entire website by setting the gap to 0.
     
     :param base_url: The base URL of the website to recrawl.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param options: Further keyword arguments for ``main`` (retries, timeout, resume, archive).
     :return: The data of the website after recrawling.
     """
-    return main(base_url, gap=0)
+    return main(base_url, gap=0, db_name=db_name, **options)
 
 def recrawl_url(url, db_name='db_websites.db'):
     """
-    Recrawls a specific URL, updating its status and related internal links in the database.
+    Recrawls a specific URL, updating its status, redirects and related internal links in the database.
     
     :param url: The specific URL to recrawl.
     :param db_name: The name of the SQLite database file (default is 'db_websites.db').
-    :return: The data of the specific URL after recrawling.
+    :return: The data of the specific URL after recrawling, or None if it is not available.
     """
-    status_code = check_http_status(url)
-    
+    # A single request: crawl_pages records the status, and the redirects followed, of the URL
+    with shared_http_session():
+        crawl_pages([url], db_name)
+
+    url_data = fetch_url_data(url, db_name)
+    status_code = url_data["status_code"] if url_data is not None else None
     if status_code is None or status_code >= 400:
         # Handle non-available URL gracefully
         print(f"URL '{url}' is not available. Status code: {status_code}")
-        update_crawl_info(url, status_code, successful=False, db_name=db_name)
         return None
-    
-    # Proceed with the regular crawl process
-    crawl_pages([url], db_name)
-    return fetch_url_data(url, db_name)
+    return url_data
 
 def indexible_pages(url_start, db_path="db_websites.db"):
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Query to select the URLs that match the criteria
-    query = """
-    SELECT url
-    FROM tb_pages
-    WHERE url LIKE ? AND successful_page_fetch = 1 AND robots_index = 1
     """
-    
-    # Execute the query with the provided URL start string
-    cursor.execute(query, (f'{url_start}%',))
-    
-    # Fetch all matching rows
-    urls = cursor.fetchall()
-    
-    # Close the connection
-    conn.close()
-    
-    # Return the list of URLs
-    return [url[0] for url in urls]
+    Returns the URLs starting with a prefix that were fetched successfully and may be indexed.
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python main.py <command> <base_url_or_url>")
-        sys.exit(1)
+    :param url_start: The URL prefix of the pages.
+    :param db_path: The name of the SQLite database file (default is 'db_websites.db').
+    :return: A list of URLs. Use reports.iter_indexible_pages to stream them instead.
+    """
+    return list(iter_indexible_pages(url_start, db_path))
 
-    command = sys.argv[1]
-    url = sys.argv[2]
-    
-    if command == "crawl":
-        website_data = crawl_website(url)
-        print(website_data)
-    elif command == "recrawl":
-        website_data = recrawl_website(url)
-        print(website_data)
-    elif command == "recrawl_url":
-        url_data = recrawl_url(url)
-        print(url_data)
-    else:
-        print("Unknown command. Use 'crawl', 'recrawl', or 'recrawl_url'.")
-        sys.exit(1)
+if __name__ == "__main__":
+    from bertha.cli import main as cli_main
+    sys.exit(cli_main())
@@ -0,0 +1,153 @@
+# bertha/orchestrator.py
+
+"""
+Crawling several websites in one process.
+
+``crawl_sites`` initializes the database once and crawls every website in its own
+thread. The threads share:
+
+- one HTTP session with a connection pool (see ``utils.use_shared_http_session``),
+- one DNS cache, so each host is resolved once per TTL (see ``dns_cache``),
+- the database, whose writes are serialized by ``database_operations.write_lock``
+  and which is switched to write-ahead logging so reads do not wait for writes,
+- one set of circuit breakers, and a ``HostLimiter`` so a host shared by several
+  websites still sees at most ``max_per_host`` requests at a time.
+
+Total wall time approaches that of the slowest website instead of the sum of all
+of them. A website that fails does not stop the others; its error is reported in
+its result.
+
+Websites can be given as a list or read from a config file, either JSON::
+
+    {"gap": 30, "sites": ["https://www.example.com", {"url": "https://shop.example.com", "gap": 7}]}
+
+or plain text with one base URL per line (``#`` starts a comment).
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bertha.circuit_breaker import HostCircuitBreakers
+from bertha.database_operations import initialize_database_with_retries, count_website_pages
+from bertha.database_setup import enable_wal
+from bertha.host_limiter import HostLimiter
+from bertha.main import run_crawl_session
+from bertha.retry_policy import retry_counters
+from bertha.utils import shared_http_session, shared_dns_cache
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def load_sites(path):
+    """
+    Reads the websites to crawl from a config file.
+
+    :param path: The path of a JSON file, or of a text file with one base URL per line.
+    :return: A list of dictionaries with the 'url' of each website and, if set, its 'gap'.
+    """
+    with open(path, 'r', encoding='utf-8') as config_file:
+        content = config_file.read()
+
+    if path.endswith('.json'):
+        config = json.loads(content)
+        if isinstance(config, dict):
+            default_gap = config.get('gap')
+            entries = config.get('sites', [])
+        else:
+            default_gap = None
+            entries = config
+
+        sites = []
+        for entry in entries:
+            site = {'url': entry} if isinstance(entry, str) else dict(entry)
+            if site.get('gap') is None and default_gap is not None:
+                site['gap'] = default_gap
+            sites.append(site)
+        return sites
+
+    sites = []
+    for line in content.splitlines():
+        url = line.split('#', 1)[0].strip()
+        if url:
+            sites.append({'url': url})
+    return sites
+
+
+def _crawl_site(site, gap, retries, timeout, db_name, resume, breakers, host_limiter, archive):
+    base_url = site['url']
+    site_gap = site.get('gap', gap)
+    start = time.monotonic()
+    result = {"url": base_url, "status": "completed", "session_id": None, "pages": None, "error": None}
+
+    try:
+        result["session_id"] = run_crawl_session(
+            base_url, site_gap, retries, timeout, db_name, resume,
+            breakers=breakers, host_limiter=host_limiter, archive=archive
+        )
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+        print(f"Crawling {base_url} failed: {result['error']}")
+
+    try:
+        result["pages"] = count_website_pages(base_url, db_name)
+    except Exception as e:
+        print(f"Counting the pages of {base_url} failed: {e}")
+
+    result["elapsed"] = time.monotonic() - start
+    return result
+
+
+def crawl_sites(sites, gap=30, db_name='db_websites.db', retries=5, timeout=30, resume=True,
+                max_workers=DEFAULT_MAX_WORKERS, max_per_host=1, archive=None):
+    """
+    Crawls several websites concurrently in this process, sharing the HTTP pool and the database.
+
+    :param sites: A list of base URLs, or of dictionaries with a 'url' and optionally a 'gap'.
+    :param gap: The number of days to check if a URL's last crawl is outdated, for websites without their own.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param retries: Number of attempts per operation if it fails with a transient error.
+    :param timeout: The maximum time in seconds to wait between attempts.
+    :param resume: Whether to resume unfinished crawl sessions.
+    :param max_workers: The maximum number of websites crawled at the same time.
+    :param max_per_host: The maximum number of concurrent requests to a single host.
+    :param archive: A ``PageArchive`` keeping the bodies read, shared by all websites, if any.
+    :return: A list with a result dictionary per website, in the order given: its url, status
+             ('completed' or 'failed'), session_id, pages stored, error and elapsed seconds.
+    :raises DatabaseInitializationError: If the database cannot be initialized.
+    """
+    sites = [{'url': site} if isinstance(site, str) else site for site in sites]
+    if not sites:
+        return []
+
+    initialize_database_with_retries(retries, timeout, db_name)
+    enable_wal(db_name)
+
+    workers = max(1, min(max_workers, len(sites)))
+    breakers = HostCircuitBreakers()
+    host_limiter = HostLimiter(max_per_host)
+
+    with shared_http_session(pool_connections=workers, pool_maxsize=workers * max_per_host):
+        dns_cache = shared_dns_cache()
+        # Resolve every website's host at once instead of one after the other as their threads start
+        dns_cache.prefetch([site['url'] for site in sites])
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bertha-site') as executor:
+            futures = [
+                executor.submit(_crawl_site, site, gap, retries, timeout, db_name, resume, breakers, host_limiter,
+                                archive)
+                for site in sites
+            ]
+            results = [future.result() for future in futures]
+
+    dns_metrics = dns_cache.metrics()
+    print(f"DNS: {dns_metrics['lookups']} lookups, {dns_metrics['hits']} from cache, "
+          f"{dns_metrics['misses']} resolved in {dns_metrics['avg_resolve_ms']:.1f} ms on average, "
+          f"{dns_metrics['failures']} failed.")
+    for name, counters in sorted(retry_counters().items()):
+        if counters["retries"]:
+            print(f"Retries ({name}): {counters['retries']} retries, {counters['recovered']} recovered, "
+                  f"{counters['exhausted']} gave up, {counters['sleep_seconds']:.1f}s waited.")
+    completed = sum(1 for result in results if result["status"] == "completed")
+    print(f"Crawled {completed}/{len(results)} websites.")
+    return results
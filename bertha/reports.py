@@ -0,0 +1,263 @@
+# bertha/reports.py
+
+"""
+Report queries for dashboards.
+
+Every report selects the pages under a URL prefix, e.g. 'https://www.example.com/' or
+'https://www.example.com/blog/'. The prefix is turned into a range on the url column,
+``url >= prefix AND url < upper``, which SQLite answers from the unique index on url.
+A ``LIKE 'prefix%'`` filter cannot use that index and scans the whole table. Unlike
+LIKE, the range is case-sensitive and treats '%' and '_' literally, as URLs require.
+
+The page lists are generators. They read ``batch_size`` rows at a time, continuing
+after the last row returned, so no read transaction is held while the caller
+processes them and memory use does not depend on the size of the site:
+
+- ``iter_indexible_pages`` uses the partial index idx_pages_indexible.
+- ``iter_status_pages`` and its shortcuts for redirects, 4xx and 5xx pages use
+  idx_pages_status on (status_code, url).
+- ``iter_stale_pages`` lists the pages that are due for a crawl.
+
+``site_counts`` returns aggregate counts for a prefix and caches them in memory.
+Triggers on tb_pages bump the version of the page's host in tb_report_versions
+whenever a column the counts depend on is written, so a cached entry is used only
+while the version of its prefix's host is unchanged. Writes to other websites sharing
+the database do not invalidate it. Prefixes that do not name a whole host, e.g.
+'https://www.', are compared against the total version, bumped by every write.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+COUNT_COLUMNS = ('pages', 'crawled', 'successful', 'indexible', 'redirects', 'client_errors', 'server_errors')
+
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+
+def prefix_range(url_prefix):
+    """
+    Returns the bounds of the URLs starting with a prefix, for ``url >= ? AND url < ?``.
+
+    :param url_prefix: The URL prefix.
+    :return: A (lower, upper) tuple. upper is None if every URL from lower on matches.
+    """
+    prefix = url_prefix
+    while prefix:
+        last = ord(prefix[-1])
+        if last < 0x10FFFF:
+            return url_prefix, prefix[:-1] + chr(last + 1)
+        prefix = prefix[:-1]
+    return url_prefix, None
+
+
+def _range_filter(url_prefix):
+    lower, upper = prefix_range(url_prefix)
+    if upper is None:
+        return 'url >= ?', (lower,)
+    return 'url >= ? AND url < ?', (lower, upper)
+
+
+def iter_indexible_pages(url_prefix, db_name='db_websites.db', batch_size=1000):
+    """
+    Streams the URLs under a prefix that were fetched successfully and may be indexed.
+
+    :param url_prefix: The URL prefix of the pages.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param batch_size: The number of rows read from the database at a time.
+    :return: A generator of URLs, in URL order.
+    """
+    url_range, range_params = _range_filter(url_prefix)
+    query = f'''
+        SELECT url FROM tb_pages
+        WHERE successful_page_fetch = 1 AND robots_index = 1 AND {url_range} AND url > ?
+        ORDER BY url LIMIT ?
+    '''
+    last_url = ''
+    conn = sqlite3.connect(db_name, timeout=30)
+    try:
+        while True:
+            rows = conn.execute(query, range_params + (last_url, batch_size)).fetchall()
+            if not rows:
+                return
+            for (url,) in rows:
+                yield url
+            last_url = rows[-1][0]
+    finally:
+        conn.close()
+
+
+def iter_status_pages(url_prefix, min_status, max_status, db_name='db_websites.db', batch_size=1000):
+    """
+    Streams the pages under a prefix whose last HTTP status is within a range.
+
+    :param url_prefix: The URL prefix of the pages.
+    :param min_status: The lowest status code included.
+    :param max_status: The highest status code included.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param batch_size: The number of rows read from the database at a time.
+    :return: A generator of dictionaries with the url and status_code of each page,
+             ordered by status code and URL.
+    """
+    url_range, range_params = _range_filter(url_prefix)
+    query = f'''
+        SELECT status_code, url FROM tb_pages
+        WHERE status_code BETWEEN ? AND ? AND {url_range} AND (status_code, url) > (?, ?)
+        ORDER BY status_code, url LIMIT ?
+    '''
+    last_key = (min_status - 1, '')
+    conn = sqlite3.connect(db_name, timeout=30)
+    try:
+        while True:
+            rows = conn.execute(query, (min_status, max_status) + range_params + last_key + (batch_size,)).fetchall()
+            if not rows:
+                return
+            for status_code, url in rows:
+                yield {"url": url, "status_code": status_code}
+            last_key = rows[-1]
+    finally:
+        conn.close()
+
+
+def iter_redirect_pages(url_prefix, db_name='db_websites.db', batch_size=1000):
+    """
+    Streams the pages under a prefix that answered with a redirect (3xx).
+
+    :param url_prefix: The URL prefix of the pages.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param batch_size: The number of rows read from the database at a time.
+    :return: A generator of dictionaries, as returned by iter_status_pages.
+    """
+    return iter_status_pages(url_prefix, 300, 399, db_name, batch_size)
+
+
+def iter_client_error_pages(url_prefix, db_name='db_websites.db', batch_size=1000):
+    """
+    Streams the pages under a prefix that answered with a client error (4xx).
+
+    :param url_prefix: The URL prefix of the pages.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param batch_size: The number of rows read from the database at a time.
+    :return: A generator of dictionaries, as returned by iter_status_pages.
+    """
+    return iter_status_pages(url_prefix, 400, 499, db_name, batch_size)
+
+
+def iter_server_error_pages(url_prefix, db_name='db_websites.db', batch_size=1000):
+    """
+    Streams the pages under a prefix that answered with a server error (5xx).
+
+    :param url_prefix: The URL prefix of the pages.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param batch_size: The number of rows read from the database at a time.
+    :return: A generator of dictionaries, as returned by iter_status_pages.
+    """
+    return iter_status_pages(url_prefix, 500, 599, db_name, batch_size)
+
+
+def iter_stale_pages(url_prefix, gap=30, db_name='db_websites.db', batch_size=1000):
+    """
+    Streams the pages under a prefix that were never crawled or were last crawled more than gap days ago.
+
+    :param url_prefix: The URL prefix of the pages.
+    :param gap: The number of days after which a crawled page is stale.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param batch_size: The number of rows read from the database at a time.
+    :return: A generator of dictionaries with the url and dt_last_crawl of each page, in URL order.
+    """
+    cutoff_date = (datetime.now() - timedelta(days=gap)).strftime('%Y%m%d%H%M%S')
+    url_range, range_params = _range_filter(url_prefix)
+    query = f'''
+        SELECT url, dt_last_crawl FROM tb_pages
+        WHERE {url_range} AND url > ? AND (dt_last_crawl IS NULL OR dt_last_crawl < ?)
+        ORDER BY url LIMIT ?
+    '''
+    last_url = ''
+    conn = sqlite3.connect(db_name, timeout=30)
+    try:
+        while True:
+            rows = conn.execute(query, range_params + (last_url, cutoff_date, batch_size)).fetchall()
+            if not rows:
+                return
+            for url, dt_last_crawl in rows:
+                yield {"url": url, "dt_last_crawl": dt_last_crawl}
+            last_url = rows[-1][0]
+    finally:
+        conn.close()
+
+
+def report_host(url_prefix):
+    """
+    Returns the scheme and host every URL under a prefix shares, as the report triggers key versions by.
+
+    :param url_prefix: The URL prefix.
+    :return: E.g. 'https://www.example.com' for 'https://www.example.com/blog/', or '' if the prefix
+             does not name a whole host.
+    """
+    host_start = url_prefix.find('://')
+    if host_start == -1:
+        return ''
+    slash = url_prefix.find('/', host_start + 3)
+    return url_prefix[:slash] if slash != -1 else ''
+
+
+def _report_version(conn, host):
+    row = conn.execute('SELECT version FROM tb_report_versions WHERE host = ?', (host,)).fetchone()
+    return row[0] if row else 0
+
+
+def site_counts(url_prefix, db_name='db_websites.db'):
+    """
+    Returns aggregate counts of the pages under a prefix, cached until pages of its host are written.
+
+    :param url_prefix: The URL prefix of the pages.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :return: A dictionary with the number of pages, crawled pages, successful fetches,
+             indexible pages, redirects, client errors and server errors.
+    """
+    cache_key = (os.path.abspath(db_name), url_prefix)
+    url_range, range_params = _range_filter(url_prefix)
+    host = report_host(url_prefix)
+
+    conn = sqlite3.connect(db_name, timeout=30)
+    try:
+        version = _report_version(conn, host)
+        with _count_cache_lock:
+            cached = _count_cache.get(cache_key)
+        if cached is not None and cached[0] == version:
+            return dict(cached[1])
+
+        # Read the version again in the same transaction as the counts, so counts
+        # computed while a write commits are stored under the older version
+        conn.execute('BEGIN')
+        version = _report_version(conn, host)
+        row = conn.execute(f'''
+            SELECT
+                COUNT(*),
+                COUNT(dt_last_crawl),
+                COALESCE(SUM(successful_page_fetch = 1), 0),
+                COALESCE(SUM(successful_page_fetch = 1 AND robots_index = 1), 0),
+                COALESCE(SUM(status_code BETWEEN 300 AND 399), 0),
+                COALESCE(SUM(status_code BETWEEN 400 AND 499), 0),
+                COALESCE(SUM(status_code BETWEEN 500 AND 599), 0)
+            FROM tb_pages
+            WHERE {url_range}
+        ''', range_params).fetchone()
+        conn.rollback()
+    finally:
+        conn.close()
+
+    counts = dict(zip(COUNT_COLUMNS, row))
+    with _count_cache_lock:
+        _count_cache[cache_key] = (version, counts)
+    return dict(counts)
+
+
+def clear_report_cache():
+    """
+    Drops every cached count, e.g. after tb_pages was written by a tool without the triggers.
+    """
+    with _count_cache_lock:
+        _count_cache.clear()
@@ -0,0 +1,211 @@
+# bertha/retry_policy.py
+
+"""
+Retrying operations that can fail for a moment.
+
+A ``RetryPolicy`` calls a function and, when it raises an error that ``is_transient``
+classifies as temporary, calls it again after an exponential backoff with jitter:
+
+- the n-th wait is up to ``base_delay * multiplier ** n`` seconds, capped by
+  ``max_delay``; ``jitter`` spreads waits so threads that failed together do not
+  retry together,
+- an operation gives up after ``attempts`` calls, or when the next wait would go past
+  its ``deadline`` seconds from the first call,
+- other errors, e.g. an SQL error, a missing file or a bug, are raised right away.
+
+Retries do not nest. An error that a policy already gave up on is not retried by an
+outer policy, so a database lock retried inside ``insert_if_not_exists`` is not
+retried again, attempts times over, by the crawl loop calling it. An inner policy
+also never waits past the deadline of the outer one running in the same thread.
+
+Policies count their calls, retries, recoveries, give-ups and wait time by name;
+``retry_counters`` returns the counters, e.g. to report them at the end of a crawl.
+
+``DATABASE`` is for writes that can meet a lock, ``NETWORK`` for requests and
+``CRAWL`` for whole steps of a crawl. Functions taking ``retries`` and ``timeout``
+use a copy with ``attempts=retries`` and ``max_delay=timeout``.
+"""
+
+import random
+import socket
+import sys
+import threading
+import time
+from sqlite3 import OperationalError
+
+# Errors a policy gave up on are marked with this attribute, so no other policy retries them
+_EXHAUSTED_ATTRIBUTE = '_bertha_retries_exhausted'
+
+_counters = {}
+_counters_lock = threading.Lock()
+_local = threading.local()
+
+
+def is_transient(error):
+    """
+    Tells whether an error may not happen again if the operation is retried.
+
+    :param error: The exception raised.
+    :return: True for locked or busy databases and for network errors: connection errors,
+             timeouts, failed DNS lookups and the requests exceptions for them. False for any
+             other error, e.g. a missing or unreadable file, and for errors a retry policy
+             already gave up on.
+    """
+    if getattr(error, _EXHAUSTED_ATTRIBUTE, False):
+        return False
+    if isinstance(error, OperationalError):
+        message = str(error).lower()
+        return 'locked' in message or 'busy' in message
+    if not isinstance(error, OSError):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError, socket.gaierror)):
+        return True
+    # Only look requests up once it is loaded; an error cannot come from it before
+    requests = sys.modules.get('requests')
+    if requests is None or not isinstance(error, requests.exceptions.RequestException):
+        return False
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                              requests.exceptions.ChunkedEncodingError))
+
+
+def _new_counters():
+    return {"calls": 0, "retries": 0, "recovered": 0, "exhausted": 0, "failed": 0, "sleep_seconds": 0.0}
+
+
+def _count(name, key, amount=1):
+    with _counters_lock:
+        counters = _counters.setdefault(name, _new_counters())
+        counters[key] += amount
+
+
+class RetryPolicy:
+    """
+    How often, and how long apart, an operation is attempted.
+
+    :param name: The name the counters of the policy are kept under.
+    :param attempts: The maximum number of calls.
+    :param base_delay: Seconds waited before the first retry, before jitter.
+    :param max_delay: The maximum seconds waited between two calls.
+    :param multiplier: The factor the wait grows by after each retry.
+    :param jitter: The fraction of each wait that is random, from 0 (none) to 1 (full jitter).
+    :param deadline: The maximum seconds from the first call to the last one. None for no limit.
+    :param classify: The function telling whether an error is worth retrying.
+    :param sleep: The function waiting a number of seconds.
+    :param clock: The function returning the current time in seconds.
+    """
+
+    def __init__(self, name, attempts=5, base_delay=0.5, max_delay=30.0, multiplier=2.0, jitter=1.0, deadline=None,
+                 classify=is_transient, sleep=time.sleep, clock=time.monotonic):
+        self.name = name
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.deadline = deadline
+        self.classify = classify
+        self.sleep = sleep
+        self.clock = clock
+
+    def copy(self, **changes):
+        """
+        Returns a policy with some settings changed, counting under the same name.
+
+        :param changes: The settings to change, as keyword arguments of RetryPolicy.
+        :return: A new RetryPolicy.
+        """
+        settings = {
+            "name": self.name, "attempts": self.attempts, "base_delay": self.base_delay,
+            "max_delay": self.max_delay, "multiplier": self.multiplier, "jitter": self.jitter,
+            "deadline": self.deadline, "classify": self.classify, "sleep": self.sleep, "clock": self.clock,
+        }
+        settings.update(changes)
+        return RetryPolicy(**settings)
+
+    def delay(self, retry):
+        """
+        Returns the seconds to wait before a retry.
+
+        :param retry: The number of the retry, from 0.
+        :return: The wait in seconds, with jitter applied.
+        """
+        ceiling = min(self.max_delay, self.base_delay * self.multiplier ** retry)
+        return ceiling * (1 - self.jitter * random.random())
+
+    def call(self, description, func, *args, **kwargs):
+        """
+        Calls a function, retrying it while it raises transient errors.
+
+        :param description: What the function does, for the messages printed, e.g. 'Inserting https://...'.
+        :param func: The function to call.
+        :param args: The positional arguments of the function.
+        :param kwargs: The keyword arguments of the function.
+        :return: The return value of the function.
+        :raises Exception: The last error raised by the function, once it is not retried anymore.
+        """
+        _count(self.name, "calls")
+        start = self.clock()
+        deadline = start + self.deadline if self.deadline is not None else None
+        outer_deadlines = getattr(_local, 'deadlines', None)
+        if outer_deadlines is None:
+            outer_deadlines = _local.deadlines = []
+        # Each deadline on the stack is already capped by the ones before it
+        if outer_deadlines and outer_deadlines[-1] is not None and (deadline is None or outer_deadlines[-1] < deadline):
+            deadline = outer_deadlines[-1]
+
+        outer_deadlines.append(deadline)
+        try:
+            retry = 0
+            while True:
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    if not self.classify(e):
+                        _count(self.name, "failed")
+                        raise
+                    wait = self.delay(retry)
+                    if retry + 1 >= self.attempts or (deadline is not None and self.clock() + wait > deadline):
+                        _count(self.name, "exhausted")
+                        setattr(e, _EXHAUSTED_ATTRIBUTE, True)
+                        print(f"{description} failed after {retry + 1} attempts: {e}")
+                        raise
+                    print(f"{description} failed ({e}), retrying {retry + 1}/{self.attempts - 1} in {wait:.1f}s...")
+                    _count(self.name, "retries")
+                    _count(self.name, "sleep_seconds", wait)
+                    self.sleep(wait)
+                    retry += 1
+                    continue
+                if retry:
+                    _count(self.name, "recovered")
+                return result
+        finally:
+            outer_deadlines.pop()
+
+
+# Writes meeting a lock held by another process; SQLite already waits for the lock itself
+DATABASE = RetryPolicy('database', attempts=5, base_delay=0.1, max_delay=2.0, deadline=60)
+# Requests to a website, e.g. for its sitemaps
+NETWORK = RetryPolicy('network', attempts=5, base_delay=1.0, max_delay=30.0, deadline=300)
+# Whole steps of a crawl: initializing the database, crawling a URL
+CRAWL = RetryPolicy('crawl', attempts=5, base_delay=0.5, max_delay=30.0, deadline=300)
+
+
+def retry_counters():
+    """
+    Returns the counters of every retry policy used so far.
+
+    :return: A dictionary mapping each policy name to its number of calls, retries,
+             calls that succeeded after a retry ('recovered'), calls that gave up after
+             retrying ('exhausted'), calls that failed with an error not retried ('failed')
+             and the total seconds waited between attempts.
+    """
+    with _counters_lock:
+        return {name: dict(counters) for name, counters in _counters.items()}
+
+
+def reset_retry_counters():
+    """
+    Sets every retry counter back to zero.
+    """
+    with _counters_lock:
+        _counters.clear()
@@ -0,0 +1,163 @@
+# bertha/scheduler.py
+
+"""
+Priority-ordered crawl scheduling.
+
+Every URL gets a crawl priority built from five signals stored in ``tb_pages``:
+
+- ``depth``: the number of clicks from the base URL; shallow pages score higher.
+- ``inlinks``: the number of distinct pages linking to the URL.
+- sitemap membership: URLs listed in a sitemap score higher.
+- staleness: the time since the last crawl; never-crawled URLs score highest.
+- change rate: how often the status of the URL changed between crawls.
+
+The priority is stored in the ``crawl_priority`` column, which is indexed, so the
+next batch is an indexed ``ORDER BY ... LIMIT`` instead of a sort of the frontier.
+Priorities of the whole site are refreshed once at the start of a crawl, because
+staleness depends on the current time, and only the missing ones before each batch,
+found through the same index.
+"""
+
+import math
+import sqlite3
+from datetime import datetime
+
+from bertha.database_operations import get_urls_to_crawl, write_lock
+
+DEFAULT_WEIGHTS = {
+    'depth': 3.0,
+    'inlinks': 2.0,
+    'sitemap': 1.5,
+    'staleness': 2.0,
+    'change_rate': 1.0,
+}
+
+# Depth assumed for URLs whose depth is not known, e.g. URLs only found in sitemaps
+UNKNOWN_DEPTH = 3
+
+# Number of days after which a page counts as half stale
+STALENESS_HALF_LIFE_DAYS = 30
+
+# Number of rows scored per write transaction when refreshing priorities
+REFRESH_BATCH_SIZE = 5000
+
+
+def score_url(depth, inlinks, in_sitemap, days_since_crawl, change_count, crawl_count, weights=None):
+    """
+    Computes the crawl priority of a URL. URLs with a higher priority are crawled first.
+
+    :param depth: The number of clicks from the base URL, or None if not known.
+    :param inlinks: The number of distinct pages linking to the URL.
+    :param in_sitemap: Whether the URL is listed in a sitemap.
+    :param days_since_crawl: The number of days since the last crawl, or None if never crawled.
+    :param change_count: The number of crawls in which the status of the URL changed.
+    :param crawl_count: The number of times the URL was crawled.
+    :param weights: A dictionary overriding entries of ``DEFAULT_WEIGHTS``.
+    :return: The priority as a float.
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+
+    depth_score = 1.0 / (1 + (UNKNOWN_DEPTH if depth is None else depth))
+    inlinks = inlinks or 0
+    inlink_score = math.log1p(inlinks) / (1 + math.log1p(inlinks))
+    sitemap_score = 1.0 if in_sitemap else 0.0
+    if days_since_crawl is None:
+        staleness_score = 1.0
+    else:
+        days = max(days_since_crawl, 0)
+        staleness_score = days / (days + STALENESS_HALF_LIFE_DAYS)
+    # Without history, assume the URL changes half of the time
+    change_rate = (change_count or 0) / crawl_count if crawl_count else 0.5
+
+    return (
+        weights['depth'] * depth_score
+        + weights['inlinks'] * inlink_score
+        + weights['sitemap'] * sitemap_score
+        + weights['staleness'] * staleness_score
+        + weights['change_rate'] * change_rate
+    )
+
+
+def refresh_crawl_priorities(base_url, db_name='db_websites.db', only_missing=False, weights=None,
+                             batch_size=REFRESH_BATCH_SIZE):
+    """
+    Recomputes the crawl priority of the URLs of a website.
+
+    Rows are scored batch_size at a time, each batch in its own transaction under the
+    database's write lock, so websites crawled concurrently are not locked out for the whole refresh.
+
+    With only_missing, the URLs without a priority are found through the crawl_priority
+    index, where they are grouped, so the cost follows the number of URLs to score instead
+    of the size of the table. The score does not depend on the website, so those of every website are scored.
+
+    :param base_url: The base URL of the website.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param only_missing: Only score URLs without a priority, e.g. URLs discovered since the last refresh.
+    :param weights: A dictionary overriding entries of ``DEFAULT_WEIGHTS``.
+    :param batch_size: The number of rows of tb_pages covered by each UPDATE.
+    :return: The number of URLs scored.
+    """
+    now = datetime.now()
+
+    def crawl_priority(depth, inlinks, in_sitemap, dt_last_crawl, change_count, crawl_count):
+        days_since_crawl = None
+        if dt_last_crawl:
+            try:
+                last_crawl = datetime.strptime(dt_last_crawl, '%Y%m%d%H%M%S')
+                days_since_crawl = (now - last_crawl).total_seconds() / 86400
+            except ValueError:
+                pass
+        return score_url(depth, inlinks, in_sitemap, days_since_crawl, change_count, crawl_count, weights)
+
+    score = '''
+        UPDATE tb_pages
+        SET crawl_priority = bertha_crawl_priority(
+            depth, inlinks, sitemaps IS NOT NULL, dt_last_crawl, change_count, crawl_count
+        )
+    '''
+
+    scored = 0
+    last_id = 0
+    conn = sqlite3.connect(db_name, timeout=30)
+    try:
+        conn.create_function('bertha_crawl_priority', 6, crawl_priority)
+        while True:
+            with write_lock(db_name), conn:
+                if only_missing:
+                    # Scored rows no longer match, so each batch takes the next unscored rows
+                    count = conn.execute(score + '''
+                        WHERE id IN (SELECT id FROM tb_pages WHERE crawl_priority IS NULL LIMIT ?)
+                    ''', (batch_size,)).rowcount
+                    scored += count
+                    if count < batch_size:
+                        return scored
+                    continue
+
+                end_id = conn.execute(
+                    'SELECT MAX(id) FROM (SELECT id FROM tb_pages WHERE id > ? ORDER BY id LIMIT ?)',
+                    (last_id, batch_size)
+                ).fetchone()[0]
+                if end_id is None:
+                    return scored
+                scored += conn.execute(score + ' WHERE url LIKE ? AND id > ? AND id <= ?',
+                                       (f'%{base_url}%', last_id, end_id)).rowcount
+            last_id = end_id
+    finally:
+        conn.close()
+
+
+def next_crawl_batch(base_url, gap=30, batch_size=100, db_name='db_websites.db', weights=None):
+    """
+    Returns the most valuable URLs of a website that are due for a crawl.
+
+    URLs discovered since the last refresh are scored first, so they compete with the rest of the frontier.
+
+    :param base_url: The base URL of the website.
+    :param gap: The number of days to check if the URL's last crawl is outdated.
+    :param batch_size: The maximum number of URLs to return.
+    :param db_name: The name of the SQLite database file (default is 'db_websites.db').
+    :param weights: A dictionary overriding entries of ``DEFAULT_WEIGHTS``.
+    :return: A list of URLs, highest crawl priority first.
+    """
+    refresh_crawl_priorities(base_url, db_name, only_missing=True, weights=weights)
+    return get_urls_to_crawl(base_url, gap, db_name=db_name, limit=batch_size)
@@ -0,0 +1,145 @@
+# bertha/sitemap_stream.py
+
+"""
+Streaming sitemap reader.
+
+``crawl_pages.pages_from_sitemaps`` returns every URL of every sitemap of a website
+at once, which for a site with millions of pages is a list of millions of tuples.
+``iter_sitemap_urls`` yields them one by one instead:
+
+- the sitemaps are those listed in robots.txt (``Sitemap:`` lines), or
+  /sitemap.xml if it lists none,
+- each sitemap is parsed chunk by chunk as it is downloaded, and every element
+  is dropped once read, so memory use does not depend on its size,
+- gzipped sitemaps are decompressed on the fly,
+- sitemap indexes are followed, each sitemap being read once.
+
+A sitemap that cannot be fetched or parsed is reported and skipped; the URLs read
+from it up to that point are kept.
+"""
+
+import zlib
+from collections import deque
+from urllib.parse import urlparse, urljoin
+from xml.etree import ElementTree
+
+from bertha.utils import http_client, requests
+
+GZIP_MAGIC = b'\x1f\x8b'
+# Bytes read and decompressed at a time
+CHUNK_SIZE = 64 * 1024
+MAX_CHUNK = 1024 * 1024
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def sitemap_locations(website_url, timeout=30):
+    """
+    Returns the sitemaps of a website listed in its robots.txt, or its /sitemap.xml if none are.
+
+    :param website_url: The base URL of the website.
+    :param timeout: Timeout in seconds for the robots.txt request.
+    :return: A list of sitemap URLs.
+    """
+    parsed_url = urlparse(website_url)
+    root_url = f"{parsed_url.scheme}://{parsed_url.netloc}/"
+    locations = []
+    try:
+        response = http_client().get(urljoin(root_url, 'robots.txt'), timeout=timeout)
+        if response.status_code == 200:
+            for line in response.text.splitlines():
+                name, _, value = line.partition(':')
+                if name.strip().lower() == 'sitemap' and value.strip():
+                    locations.append(urljoin(root_url, value.strip()))
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to fetch robots.txt for {website_url}: {e}")
+    return locations or [urljoin(root_url, 'sitemap.xml')]
+
+
+def _decompressed(chunks):
+    """Yields the chunks of a body, gunzipping them if the body starts as a gzip file."""
+    decompressor = None
+    for index, chunk in enumerate(chunks):
+        if index == 0 and chunk[:2] == GZIP_MAGIC:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if decompressor is None:
+            yield chunk
+            continue
+        # Decompress at most MAX_CHUNK bytes at a time, however much a chunk expands
+        while chunk:
+            yield decompressor.decompress(chunk, MAX_CHUNK)
+            chunk = decompressor.unconsumed_tail
+    if decompressor is not None:
+        yield decompressor.flush()
+
+
+def _parse_sitemap(chunks, sitemap_url, child_sitemaps):
+    """Yields the page URLs of a sitemap read from chunks of its body, queuing the sitemaps of an index."""
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    root = None
+    parents = []
+    for chunk in _decompressed(chunks):
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            name = _local_name(element.tag)
+            if event == 'start':
+                if root is None:
+                    root = element
+                parents.append(name)
+                continue
+
+            parents.pop()
+            if name == 'loc' and element.text and parents:
+                location = element.text.strip()
+                if parents[-1] == 'url':
+                    yield location
+                elif parents[-1] == 'sitemap':
+                    child_sitemaps.append(urljoin(sitemap_url, location))
+            elif name in ('url', 'sitemap') and root is not None:
+                # Drop the entries read so far, so the tree never grows
+                root.clear()
+    parser.close()
+
+
+def iter_sitemap_urls(website_url, timeout=30, max_sitemaps=10000):
+    """
+    Streams the URLs listed in the sitemaps of a website.
+
+    :param website_url: The base URL of the website.
+    :param timeout: Timeout in seconds for connecting and for each read.
+    :param max_sitemaps: The maximum number of sitemaps read, sitemap indexes included.
+    :return: A generator of (url, sitemap_url) tuples, as pages_from_sitemaps returns them.
+    """
+    pending = deque(sitemap_locations(website_url, timeout))
+    seen = set(pending)
+    read = 0
+    while pending and read < max_sitemaps:
+        sitemap_url = pending.popleft()
+        read += 1
+        try:
+            response = http_client().get(sitemap_url, timeout=timeout, stream=True)
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to fetch sitemap {sitemap_url}: {e}")
+            continue
+
+        child_sitemaps = []
+        count = 0
+        try:
+            if response.status_code != 200:
+                print(f"Failed to fetch sitemap {sitemap_url}: status {response.status_code}")
+                continue
+            for url in _parse_sitemap(response.iter_content(chunk_size=CHUNK_SIZE), sitemap_url, child_sitemaps):
+                count += 1
+                yield url, sitemap_url
+        except (ElementTree.ParseError, zlib.error, OSError) as e:
+            print(f"Failed to read sitemap {sitemap_url} after {count} URLs: {e}")
+        finally:
+            response.close()
+
+        for child in child_sitemaps:
+            if child not in seen:
+                seen.add(child)
+                pending.append(child)
+        print(f"Read {count} URLs and {len(child_sitemaps)} sitemaps from {sitemap_url}")
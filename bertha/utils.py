@@ -1,7 +1,88 @@
 # bertha/utils.py
 
-import requests
-from urllib.parse import urlparse
+from contextlib import contextmanager
+from urllib.parse import urlparse, urljoin
+from bertha._lazy import lazy_import
+
+requests = lazy_import('requests')
+
+# Limits applied to page bodies by fetch_page
+MAX_BODY_SIZE = 2 * 1024 * 1024
+MAX_COMPRESSION_RATIO = 100
+# Size the decompressed body must reach before the compression ratio is checked
+COMPRESSION_CHECK_SIZE = 256 * 1024
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+# Session shared by every request of the process, set by use_shared_http_session
+_shared_session = None
+_shared_dns_cache = None
+
+def use_shared_http_session(pool_connections=10, pool_maxsize=10, dns_cache=None):
+    """
+    Makes every request of the process go through one session with a connection pool,
+    so connections to a host are kept alive and reused across pages and threads, and
+    hosts are resolved through a DNS cache.
+
+    :param pool_connections: The number of hosts to keep a pool of connections for.
+    :param pool_maxsize: The maximum number of connections kept per host.
+    :param dns_cache: The ``dns_cache.DnsCache`` to resolve hosts with. A new one is created if None.
+    :return: The shared ``requests.Session``.
+    """
+    global _shared_session, _shared_dns_cache
+    from bertha.dns_cache import DnsCache, dns_cache_adapter
+
+    dns_cache = dns_cache or DnsCache()
+    session = requests.Session()
+    adapter = dns_cache_adapter(dns_cache, pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    _shared_session = session
+    _shared_dns_cache = dns_cache
+    return session
+
+def close_shared_http_session():
+    """Closes the shared session and its DNS cache; requests made afterwards use a connection each."""
+    global _shared_session, _shared_dns_cache
+    if _shared_session is not None:
+        _shared_session.close()
+        _shared_session = None
+    _shared_dns_cache = None
+
+@contextmanager
+def shared_http_session(pool_connections=10, pool_maxsize=10, dns_cache=None):
+    """
+    Uses the shared session inside a with block, opening it if none is open and closing
+    it at the end of the block if it was opened here.
+
+    :param pool_connections: The number of hosts to keep a pool of connections for.
+    :param pool_maxsize: The maximum number of connections kept per host.
+    :param dns_cache: The ``dns_cache.DnsCache`` to resolve hosts with if the session is opened here.
+    :return: A context manager giving the shared ``requests.Session``.
+    """
+    if _shared_session is not None:
+        yield _shared_session
+        return
+    session = use_shared_http_session(pool_connections, pool_maxsize, dns_cache)
+    try:
+        yield session
+    finally:
+        close_shared_http_session()
+
+def shared_dns_cache():
+    """
+    Returns the DNS cache of the shared session.
+
+    :return: A ``dns_cache.DnsCache``, or None if no shared session is open.
+    """
+    return _shared_dns_cache
+
+def http_client():
+    """
+    Returns what requests are made with: the shared session if there is one, the requests module otherwise.
+
+    :return: An object with ``get`` and ``head`` methods.
+    """
+    return _shared_session if _shared_session is not None else requests
 
 def parse_robots(robots_content):
     """
@@ -36,19 +117,29 @@ def parse_robots(robots_content):
 
     return rules
 
+# Extensions of URLs that are files rather than pages
+NON_PAGE_EXTENSIONS = [
+    '.xml', '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.svg',
+    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
+    '.zip', '.rar', '.exe', '.dmg', '.tar', '.gz'
+]
+
+def is_page_url(url):
+    """
+    Determines from its extension alone if a URL may be a page, without any request.
+
+    :param url: The URL.
+    :return: False if the URL ends with the extension of a file that is not a page.
+    """
+    return not any(url.lower().endswith(ext) for ext in NON_PAGE_EXTENSIONS)
+
 def is_actual_page(url):
     """
     Determines if a URL is likely to be an actual page, not a file.
     Checks both the file extension and the content type.
     """
-    # List of non-page file extensions to exclude
-    NON_PAGE_EXTENSIONS = [
-    '.xml', '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.svg', 
-    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', 
-    '.zip', '.rar', '.exe', '.dmg', '.tar', '.gz'
-    ]
     # Check if the URL ends with a known non-page extension
-    if any(url.lower().endswith(ext) for ext in NON_PAGE_EXTENSIONS):
+    if not is_page_url(url):
         return False
 
     # Optionally, check the content type by making a HEAD request
@@ -69,7 +160,7 @@ def get_robots(base_url):
     robots_url = f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt"
 
     try:
-        response = requests.get(robots_url)
+        response = http_client().get(robots_url)
         response.raise_for_status()
 
         robots_content = response.text
@@ -87,8 +178,9 @@ def check_http_status(url):
     :return: An integer representing the HTTP status code.
     """
     try:
-        # Send a GET request to the URL
-        response = requests.get(url, timeout=10)
+        # Send a GET request to the URL; the body is never downloaded
+        response = http_client().get(url, timeout=10, stream=True)
+        response.close()
         
         # Return the status code
         return response.status_code
@@ -98,6 +190,96 @@ def check_http_status(url):
         print(f"Error checking status for {url}: {e}")
         return None
 
+def is_html_content_type(content_type):
+    """
+    Tells whether a Content-Type header denotes an HTML document.
+
+    :param content_type: The Content-Type header, or None.
+    :return: True for HTML, and when no Content-Type was sent.
+    """
+    if not content_type:
+        return True
+    return content_type.split(';')[0].strip().lower() in HTML_CONTENT_TYPES
+
+def redirect_chain(response):
+    """
+    Returns the redirects followed to get a response, from the hops requests keeps in its history.
+
+    :param response: A ``requests.Response``.
+    :return: A list with a dictionary per hop: its url, status_code and location (absolute).
+    """
+    return [
+        {"url": hop.url, "status_code": hop.status_code, "location": urljoin(hop.url, hop.headers.get('Location', ''))}
+        for hop in response.history
+    ]
+
+def fetch_page(url, max_body_size=MAX_BODY_SIZE, max_compression_ratio=MAX_COMPRESSION_RATIO, timeout=10, chunk_size=16384):
+    """
+    Fetches a page, streaming its body so that large or endless responses cannot exhaust memory.
+
+    The body is only read for successful HTML responses, and reading stops at ``max_body_size``
+    bytes. Responses whose body decompresses far beyond what was transferred are treated as
+    decompression bombs and dropped.
+
+    :param url: The URL to fetch.
+    :param max_body_size: The maximum number of body bytes to keep. Longer bodies are truncated.
+    :param max_compression_ratio: The maximum ratio between decompressed and transferred bytes.
+    :param timeout: Timeout in seconds for connecting and for each read.
+    :param chunk_size: The number of bytes read at a time.
+    :return: A dictionary with the status_code (None if the request failed), content_type,
+             body (bytes, or None if it was not read), aborted (None, 'content_type',
+             'too_large' or 'decompression_bomb'), the redirects followed (see redirect_chain)
+             and the final url. The status, content type and body are those of the final url.
+    """
+    page = {"status_code": None, "content_type": None, "body": None, "aborted": None, "redirects": [], "url": url}
+    try:
+        response = http_client().get(url, timeout=timeout, stream=True)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching {url}: {e}")
+        return page
+
+    try:
+        page["status_code"] = response.status_code
+        page["content_type"] = response.headers.get('Content-Type')
+        page["redirects"] = redirect_chain(response)
+        if page["redirects"]:
+            page["url"] = page["redirects"][-1]["location"]
+
+        if response.status_code >= 400:
+            return page
+
+        if not is_html_content_type(page["content_type"]):
+            page["aborted"] = 'content_type'
+            print(f"Not reading the body of {url}: Content-Type is {page['content_type']}.")
+            return page
+
+        body = bytearray()
+        compressed = bool(response.headers.get('Content-Encoding'))
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            body.extend(chunk)
+
+            if len(body) > max_body_size:
+                del body[max_body_size:]
+                page["aborted"] = 'too_large'
+                print(f"Body of {url} is larger than {max_body_size} bytes, truncated.")
+                break
+
+            if compressed and len(body) >= COMPRESSION_CHECK_SIZE:
+                transferred = response.raw.tell() or 1
+                if len(body) / transferred > max_compression_ratio:
+                    page["aborted"] = 'decompression_bomb'
+                    print(f"Body of {url} decompresses more than {max_compression_ratio}x, dropped.")
+                    return page
+
+        page["body"] = bytes(body)
+        return page
+
+    except requests.exceptions.RequestException as e:
+        print(f"Error reading the body of {url}: {e}")
+        return page
+    finally:
+        response.close()
+
 def get_content_type(url):
     """
     Performs a HEAD request to retrieve the Content-Type of the given URL.
@@ -109,7 +291,7 @@ def get_content_type(url):
     str: The Content-Type of the URL, or None if the request fails.
     """
     try:
-        response = requests.head(url, allow_redirects=True)
+        response = http_client().head(url, allow_redirects=True)
         if response.status_code == 200:
             return response.headers.get('Content-Type')
         else:
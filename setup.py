@@ -19,13 +19,17 @@ setup(
         "License :: OSI Approved :: MIT License",  # Assuming your project uses the MIT License
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',  # Specify the Python version required
+    python_requires='>=3.7',  # Specify the Python version required
     install_requires=[
         "requests",  # Add any other dependencies your project requires
     ],
+    extras_require={
+        "analytics": ["numpy"],  # Vectorized link graph analytics
+        "archive": ["zstandard"],  # zstd compression of archived pages, gzip is used without it
+    },
     entry_points={
         'console_scripts': [
-            'bertha=bertha.main:main',  # Command-line script entry point, if applicable
+            'bertha=bertha.cli:main',  # Command-line script entry point
         ],
     },
 )
@@ -0,0 +1,161 @@
+# test/test_archive.py
+
+import os
+import sqlite3
+from unittest.mock import patch
+import pytest
+from bertha.archive import PageArchive, reextract_links, compress, decompress, zstandard
+from bertha.crawl_pages import crawl_pages
+from bertha.database_setup import initialize_database, referring_pages_sql
+from bertha.database_operations import insert_if_not_exists, update_crawl_info
+
+CODECS = ['gzip'] + (['zstd'] if zstandard is not None else [])
+
+HOME = b'<html><body><a href="/about/">About</a><a href="https://other.com/">Out</a></body></html>'
+ABOUT = b'<html><body><a href="/">Home</a><a href="/team/">Team</a></body></html>'
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / 'test_db.db')
+    initialize_database(db_name)
+    return db_name
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_compress_round_trips(codec):
+    body = HOME * 100
+    data = compress(body, codec)
+    assert len(data) < len(body)
+    assert decompress(data, codec) == body
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_store_and_read(db_name, tmp_path, codec):
+    with PageArchive(str(tmp_path / 'archive'), db_name, codec=codec) as archive:
+        digest = archive.store('https://example.com/', HOME, 'text/html; charset=utf-8')
+        assert archive.get(digest) == HOME
+        assert archive.read('https://example.com/') == (HOME, 'text/html; charset=utf-8')
+        assert archive.read('https://example.com/missing/') is None
+        assert archive.get('0' * 64) is None
+
+def test_identical_bodies_are_stored_once(db_name, tmp_path):
+    with PageArchive(str(tmp_path / 'archive'), db_name) as archive:
+        first = archive.store('https://example.com/', HOME)
+        second = archive.store('https://example.com/index.html', HOME)
+        archive.store('https://example.com/about/', ABOUT)
+        archive.store('https://example.com/about/', ABOUT)
+        stats = archive.stats()
+
+    assert first == second
+    assert stats["pages"] == 3
+    assert stats["blobs"] == 2
+    assert stats["raw_bytes"] == len(HOME) + len(ABOUT)
+
+def test_iter_pages_follows_segment_order_in_any_batch_size(db_name, tmp_path):
+    with PageArchive(str(tmp_path / 'archive'), db_name) as archive:
+        archive.store('https://example.com/z/', ABOUT)
+        archive.store('https://example.com/', HOME)
+        archive.store('https://example.com/index.html', HOME)
+        archive.store('https://example.com/a/', ABOUT)
+        expected = [('https://example.com/a/', ABOUT), ('https://example.com/z/', ABOUT),
+                    ('https://example.com/', HOME), ('https://example.com/index.html', HOME)]
+        for batch_size in (1, 2, 1000):
+            assert [page[:2] for page in archive.iter_pages(batch_size=batch_size)] == expected
+
+        with sqlite3.connect(db_name) as conn:
+            plan = ' '.join(row[-1] for row in conn.execute(
+                'EXPLAIN QUERY PLAN SELECT 1 FROM tb_archive_blobs b CROSS JOIN tb_archive_pages p '
+                'ON p.digest = b.digest WHERE (b.segment, b.offset) >= (1, 0) ORDER BY b.segment, b.offset, p.url'
+            ))
+    assert 'idx_archive_blobs_position' in plan and 'idx_archive_pages_digest' in plan
+
+def test_latest_body_of_a_url_is_read(db_name, tmp_path):
+    with PageArchive(str(tmp_path / 'archive'), db_name) as archive:
+        archive.store('https://example.com/', HOME)
+        assert archive.read('https://example.com/')[0] == HOME
+        archive.store('https://example.com/', ABOUT)
+        assert archive.read('https://example.com/')[0] == ABOUT
+
+def test_segments_roll_over_and_survive_reopening(db_name, tmp_path):
+    directory = str(tmp_path / 'archive')
+    bodies = {f'https://example.com/page-{i}/': os.urandom(600) for i in range(10)}
+    with PageArchive(directory, db_name, codec='gzip', segment_size=2048) as archive:
+        for url, body in bodies.items():
+            archive.store(url, body)
+    assert len(os.listdir(directory)) > 1
+
+    with PageArchive(directory, db_name, codec='gzip', segment_size=2048) as archive:
+        archive.store('https://example.com/late/', HOME)
+        for url, body in bodies.items():
+            assert archive.read(url)[0] == body
+        assert len(list(archive.iter_pages(batch_size=3))) == 11
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_reextract_links_without_network(db_name, tmp_path, workers):
+    with PageArchive(str(tmp_path / 'archive'), db_name) as archive:
+        archive.store('https://example.com/', HOME, 'text/html')
+        archive.store('https://example.com/about/', ABOUT, 'text/html')
+        archive.store('https://example.org/', ABOUT, 'text/html')
+
+        with patch('bertha.utils.requests.get') as mock_get:
+            links = dict(reextract_links(archive, 'https://example.com/', workers=workers, chunk_size=1))
+        mock_get.assert_not_called()
+
+    assert links == {
+        'https://example.com/': ['https://example.com/about/'],
+        'https://example.com/about/': ['https://example.com/', 'https://example.com/team/'],
+    }
+    # The links are stored as a crawl stores them
+    with sqlite3.connect(db_name) as conn:
+        referrers = dict(conn.execute(f'SELECT url, {referring_pages_sql()} FROM tb_pages'))
+    assert referrers == {
+        'https://example.com/about/': 'https://example.com/',
+        'https://example.com/': 'https://example.com/about/',
+        'https://example.com/team/': 'https://example.com/about/',
+    }
+
+def test_reextract_links_can_skip_storing(db_name, tmp_path):
+    with PageArchive(str(tmp_path / 'archive'), db_name) as archive:
+        archive.store('https://example.com/', HOME + b'<a href="/file.pdf">PDF</a>', 'text/html')
+        assert list(reextract_links(archive, store=False)) == [
+            ('https://example.com/', ['https://example.com/about/', 'https://example.com/file.pdf'])
+        ]
+        with sqlite3.connect(db_name) as conn:
+            assert conn.execute('SELECT COUNT(*) FROM tb_pages').fetchone()[0] == 0
+
+        list(reextract_links(archive))
+    # Links to files are left out without a request
+    with sqlite3.connect(db_name) as conn:
+        assert [row[0] for row in conn.execute('SELECT url FROM tb_pages')] == ['https://example.com/about/']
+
+def test_database_retries_do_not_archive_again(db_name, tmp_path):
+    with patch('bertha.database_operations.is_actual_page', return_value=True):
+        insert_if_not_exists('https://example.com/', db_name=db_name)
+    page = {"status_code": 200, "content_type": 'text/html', "body": HOME, "aborted": None,
+            "redirects": [], "url": 'https://example.com/'}
+    attempts = []
+
+    def locked_once(*args, **kwargs):
+        attempts.append(args)
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError('database is locked')
+        return update_crawl_info(*args, **kwargs)
+
+    with PageArchive(str(tmp_path / 'archive'), db_name) as archive:
+        with patch('bertha.crawl_pages.fetch_page', return_value=page), \
+                patch('bertha.crawl_pages.update_crawl_info', side_effect=locked_once), \
+                patch.object(archive, 'store', wraps=archive.store) as mock_store, \
+                patch('bertha.database_operations.is_actual_page', return_value=True):
+            crawl_pages(['https://example.com/'], db_name=db_name, archive=archive)
+    assert len(attempts) == 2
+    mock_store.assert_called_once_with('https://example.com/', HOME, 'text/html')
+
+def test_crawl_pages_archives_bodies(db_name, tmp_path):
+    with patch('bertha.database_operations.is_actual_page', return_value=True):
+        insert_if_not_exists('https://example.com/', db_name=db_name)
+    page = {"status_code": 200, "content_type": 'text/html', "body": HOME, "aborted": None,
+            "redirects": [], "url": 'https://example.com/'}
+
+    with PageArchive(str(tmp_path / 'archive'), db_name) as archive:
+        with patch('bertha.crawl_pages.fetch_page', return_value=page), \
+                patch('bertha.database_operations.is_actual_page', return_value=True):
+            crawl_pages(['https://example.com/'], db_name=db_name, archive=archive)
+        assert archive.read('https://example.com/') == (HOME, 'text/html')
@@ -0,0 +1,199 @@
+# test/test_bounded_crawl.py
+
+import sqlite3
+import threading
+from unittest.mock import patch
+import pytest
+from bertha.bounded_crawl import SpillQueue, plan_pipeline, crawl_website_bounded, peak_rss
+from bertha.crawl_session import get_crawl_session
+from bertha.scheduler import next_crawl_batch
+from bertha.cli import main as cli_main
+from bertha.database_setup import initialize_database, referring_pages_sql
+from bertha.database_operations import (
+    insert_if_not_exists, update_crawl_info, get_urls_to_crawl, iter_urls_to_crawl,
+    fetch_all_website_data, iter_website_data
+)
+
+SITE = {
+    'https://example.com/': ['/a/', '/b/', 'https://other.com/'],
+    'https://example.com/a/': ['/', '/a/1/', '/a/2/'],
+    'https://example.com/b/': ['/a/', '/b/1/'],
+    'https://example.com/a/1/': [],
+    'https://example.com/a/2/': ['/gone/'],
+    'https://example.com/b/1/': ['/'],
+    'https://example.com/listed/': [],
+}
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / 'test_db.db')
+    initialize_database(db_name)
+    return db_name
+
+def fake_fetch(url, max_body_size=None):
+    links = SITE.get(url)
+    if links is None:
+        return {"status_code": 404, "content_type": 'text/html', "body": None, "aborted": None,
+                "redirects": [], "url": url}
+    body = ''.join(f'<a href="{link}">link</a>' for link in links)
+    return {"status_code": 200, "content_type": 'text/html', "body": f'<html><body>{body}</body></html>'.encode(),
+            "aborted": None, "redirects": [], "url": url}
+
+def test_spill_queue_keeps_order_across_disk(tmp_path):
+    with SpillQueue(2, str(tmp_path)) as spill:
+        for i in range(5):
+            spill.put({"n": i})
+        assert len(spill) == 5
+        assert spill.spilled == 3
+        assert [spill.get()["n"] for _ in range(3)] == [0, 1, 2]
+
+        # Items added while older ones are on disk go to disk too
+        spill.put({"n": 5})
+        assert [spill.get()["n"] for _ in range(3)] == [3, 4, 5]
+
+        spill.put(("back", "in", "memory"))
+        assert spill.spilled == 4
+        spill.close()
+        assert spill.get() == ("back", "in", "memory")
+        assert spill.get() is None
+        with pytest.raises(ValueError):
+            spill.put({"n": 6})
+
+def test_spill_queue_get_waits_for_producer():
+    spill = SpillQueue(1)
+    received = []
+    consumer = threading.Thread(target=lambda: received.extend(iter(spill.get, None)))
+    consumer.start()
+    for i in range(50):
+        spill.put(i)
+    spill.close()
+    consumer.join(timeout=5)
+    assert received == list(range(50))
+    spill.discard()
+
+def test_plan_pipeline_fits_budget():
+    mib = 1024 * 1024
+    plan = plan_pipeline(1024, max_body_size=2 * mib, fetch_workers=8, baseline=64 * mib)
+    assert plan["fetch_workers"] == 8
+    assert plan["parse_queue_size"] == 112
+    assert plan["write_queue_size"] == 1920
+    assert (plan["fetch_workers"] + plan["parse_queue_size"]) * 4 * mib <= 0.5 * (1024 - 64) * mib
+
+    tiny = plan_pipeline(64, max_body_size=2 * mib, fetch_workers=8, baseline=64 * mib)
+    assert tiny["fetch_workers"] == 1
+    assert tiny["parse_queue_size"] == 1
+    assert tiny["write_queue_size"] == 16
+
+def test_streaming_queries_match_lists(db_name):
+    with patch('bertha.database_operations.is_actual_page', return_value=True):
+        for url in list(SITE)[:5]:
+            insert_if_not_exists(url, db_name=db_name)
+    update_crawl_info('https://example.com/a/', 200, True, db_name)
+
+    streamed = list(iter_urls_to_crawl('https://example.com', gap=30, db_name=db_name, batch_size=2))
+    assert streamed == sorted(streamed)
+    assert set(streamed) == set(get_urls_to_crawl('https://example.com', gap=30, db_name=db_name))
+    assert 'https://example.com/a/' not in streamed
+    assert list(iter_website_data('https://example.com', db_name, batch_size=2)) == \
+        sorted(fetch_all_website_data('https://example.com', db_name), key=lambda row: row["url"])
+
+@pytest.mark.parametrize('write_queue_size', [1, 100])
+def test_bounded_crawl_crawls_the_whole_site(db_name, tmp_path, write_queue_size):
+    plan = plan_pipeline(64, fetch_workers=2, baseline=0)
+    plan.update(write_queue_size=write_queue_size, parse_queue_size=1)
+    with patch('bertha.bounded_crawl.fetch_page', side_effect=fake_fetch), \
+            patch('bertha.bounded_crawl.plan_pipeline', return_value=plan), \
+            patch('bertha.bounded_crawl.iter_sitemap_urls',
+                  return_value=iter([('https://example.com/listed/', 'https://example.com/sitemap.xml')])), \
+            patch('bertha.database_operations.is_actual_page', return_value=True), \
+            patch('bertha.database_operations.get_robots', return_value=None):
+        stats = crawl_website_bounded('https://example.com/', db_name=db_name, spill_dir=str(tmp_path), batch_size=2)
+
+    with sqlite3.connect(db_name) as conn:
+        rows = dict(conn.execute('SELECT url, status_code FROM tb_pages'))
+        referrers = conn.execute(
+            f"SELECT inlinks, {referring_pages_sql()} FROM tb_pages WHERE url = 'https://example.com/a/'"
+        ).fetchone()
+
+    assert rows == {**{url: 200 for url in SITE}, 'https://example.com/gone/': 404}
+    assert referrers == (2, 'https://example.com/,https://example.com/b/')
+    assert stats["pages"] == len(SITE) + 1
+    assert stats["failed"] == 0
+    assert stats["batches"] >= 2
+    if peak_rss() is not None:
+        assert stats["peak_rss_mb"] > 0
+
+def _crawl(db_name, tmp_path, fetch=fake_fetch, **options):
+    plan = plan_pipeline(64, fetch_workers=1, baseline=0)
+    plan.update(parse_queue_size=1)
+    with patch('bertha.bounded_crawl.fetch_page', side_effect=fetch), \
+            patch('bertha.bounded_crawl.plan_pipeline', return_value=plan), \
+            patch('bertha.bounded_crawl.iter_sitemap_urls', return_value=iter([])), \
+            patch('bertha.database_operations.is_actual_page', return_value=True) as mock_is_page, \
+            patch('bertha.database_operations.get_robots', return_value=None):
+        stats = crawl_website_bounded('https://example.com/', db_name=db_name, spill_dir=str(tmp_path), **options)
+    return stats, mock_is_page
+
+def test_bounded_crawl_follows_crawl_priority(db_name, tmp_path):
+    batches = []
+    fetched = []
+
+    def recorded_batch(*args, **kwargs):
+        batches.append(next_crawl_batch(*args, **kwargs))
+        return batches[-1]
+
+    def fetch(url, max_body_size=None):
+        fetched.append(url)
+        return fake_fetch(url)
+
+    with patch('bertha.bounded_crawl.next_crawl_batch', side_effect=recorded_batch):
+        stats, mock_is_page = _crawl(db_name, tmp_path, fetch, batch_size=3)
+
+    assert fetched == [url for batch in batches for url in batch]
+    assert batches[1] == ['https://example.com/a/', 'https://example.com/b/']
+    assert stats["batches"] == len(batches) - 1
+    # Each new link is checked with a HEAD request once, however many pages link to it
+    checked = [call.args[0] for call in mock_is_page.call_args_list]
+    assert len(checked) == len(set(checked))
+
+def test_interrupted_bounded_crawl_resumes(db_name, tmp_path):
+    fetched = []
+
+    def failing_fetch(url, max_body_size=None):
+        # Fails in the third batch, after its first page
+        if len(fetched) == 4:
+            raise RuntimeError('interrupted')
+        fetched.append(url)
+        return fake_fetch(url)
+
+    with pytest.raises(RuntimeError):
+        _crawl(db_name, tmp_path, failing_fetch, batch_size=10)
+    with sqlite3.connect(db_name) as conn:
+        session_id = conn.execute('SELECT MAX(id) FROM tb_crawl_sessions').fetchone()[0]
+    session = get_crawl_session(session_id, db_name)
+    assert session['state'] == 'failed'
+    assert session['batch_position'] <= 1
+    assert session['urls_crawled'] == 3 + session['batch_position']
+    pending = session['current_batch'][session['batch_position']:]
+
+    resumed = []
+
+    def fetch(url, max_body_size=None):
+        resumed.append(url)
+        return fake_fetch(url)
+
+    stats, _ = _crawl(db_name, tmp_path, fetch, batch_size=10)
+    assert stats["session_id"] == session_id
+    assert resumed[:len(pending)] == pending
+    session = get_crawl_session(session_id, db_name)
+    assert (session['state'], session['phase']) == ('completed', 'done')
+    with sqlite3.connect(db_name) as conn:
+        rows = dict(conn.execute('SELECT url, status_code FROM tb_pages'))
+    assert rows == {**{url: 200 for url in SITE if url != 'https://example.com/listed/'},
+                    'https://example.com/gone/': 404}
+
+def test_cli_memory_budget_runs_bounded_crawl():
+    with patch('bertha.bounded_crawl.crawl_website_bounded', return_value={"pages": 3}) as mock_crawl:
+        assert cli_main(['crawl', 'https://example.com', '--memory-budget', '256', '--db', 'sites.db']) == 0
+    mock_crawl.assert_called_once_with('https://example.com', 30, 'sites.db', memory_budget_mb=256, fetch_workers=4,
+                                       retries=5, timeout=30, resume=True, archive=None)
@@ -0,0 +1,70 @@
+# test/test_change_feed.py
+
+import pytest
+from unittest.mock import patch
+from bertha.database_setup import initialize_database
+from bertha.database_operations import insert_if_not_exists, update_crawl_info, update_indexibility
+from bertha.change_feed import changes_since, latest_change_cursor, prune_changes
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / 'test_changes.db')
+    initialize_database(db_name)
+    with patch('bertha.database_operations.is_actual_page', return_value=True):
+        insert_if_not_exists('https://example.com/a/', db_name=db_name)
+        insert_if_not_exists('https://example.com/a/', db_name=db_name)
+        insert_if_not_exists('https://other.com/b/', db_name=db_name)
+    return db_name
+
+def _summary(changes):
+    return [(change['url'], change['change_type'], change['old_value'], change['new_value']) for change in changes]
+
+def test_discoveries_are_recorded_once(db_name):
+    changes = list(changes_since(0, db_name=db_name))
+    assert [(change['url'], change['change_type']) for change in changes] == [
+        ('https://example.com/a/', 'discovered'),
+        ('https://other.com/b/', 'discovered'),
+    ]
+
+def test_status_transitions_and_removals(db_name):
+    cursor = latest_change_cursor(db_name)
+    update_crawl_info('https://example.com/a/', 200, True, db_name=db_name)
+    update_crawl_info('https://example.com/a/', 200, True, db_name=db_name)
+    update_crawl_info('https://example.com/a/', 404, False, db_name=db_name)
+    update_crawl_info('https://example.com/a/', 410, False, db_name=db_name)
+
+    assert _summary(changes_since(cursor, db_name=db_name)) == [
+        ('https://example.com/a/', 'status', None, '200'),
+        ('https://example.com/a/', 'status', '200', '404'),
+        ('https://example.com/a/', 'removed', '200', '404'),
+        ('https://example.com/a/', 'status', '404', '410'),
+    ]
+
+def test_indexibility_changes(db_name):
+    cursor = latest_change_cursor(db_name)
+    rules = {'/a/': {'index': False, 'follow': True}}
+    update_indexibility('https://example.com/a/', rules, db_name=db_name)
+    update_indexibility('https://example.com/a/', rules, db_name=db_name)
+    update_indexibility('https://example.com/a/', {}, db_name=db_name)
+
+    assert _summary(changes_since(cursor, db_name=db_name)) == [
+        ('https://example.com/a/', 'indexibility', ',', '0,1'),
+        ('https://example.com/a/', 'indexibility', '0,1', '1,1'),
+    ]
+
+def test_cursor_filters_and_batches(db_name):
+    for _ in range(3):
+        update_crawl_info('https://example.com/a/', 200, True, db_name=db_name)
+        update_crawl_info('https://example.com/a/', 500, False, db_name=db_name)
+
+    changes = list(changes_since(0, base_url='https://example.com', change_types=['status'], batch_size=2, db_name=db_name))
+    assert len(changes) == 6
+    assert [change['change_id'] for change in changes] == sorted(change['change_id'] for change in changes)
+
+    resumed = list(changes_since(changes[2]['change_id'], base_url='https://example.com', change_types=['status'], db_name=db_name))
+    assert resumed == changes[3:]
+
+def test_prune_changes(db_name):
+    cursor = latest_change_cursor(db_name)
+    assert prune_changes(cursor, db_name) == 2
+    assert list(changes_since(0, db_name=db_name)) == []
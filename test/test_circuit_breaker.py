@@ -0,0 +1,115 @@
+# test/test_circuit_breaker.py
+
+import sqlite3
+import pytest
+from unittest.mock import patch
+from bertha.circuit_breaker import CircuitBreaker, HostCircuitBreakers, CLOSED, OPEN, HALF_OPEN
+from bertha.crawl_pages import crawl_pages, crawl_all_pages
+from bertha.crawl_session import start_crawl_session, get_crawl_session
+from bertha.database_setup import initialize_database
+from bertha.database_operations import insert_if_not_exists, update_crawl_info, get_urls_to_crawl
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / 'test_breaker.db')
+    initialize_database(db_name)
+    with patch('bertha.database_operations.is_actual_page', return_value=True):
+        for path in ('a', 'b', 'c'):
+            insert_if_not_exists(f'https://example.com/{path}/', db_name=db_name)
+    return db_name
+
+def test_breaker_opens_on_error_rate(clock):
+    breaker = CircuitBreaker(failure_threshold=0.5, window_size=4, min_requests=4, cooldown=60, clock=clock)
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    assert breaker.retry_after() == 60
+
+def test_half_open_probe(clock):
+    breaker = CircuitBreaker(min_requests=1, cooldown=60, clock=clock)
+    breaker.record_failure()
+    clock.now = 61
+
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    clock.now = 122
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+def test_breakers_are_per_host(clock):
+    breakers = HostCircuitBreakers(min_requests=2, clock=clock)
+    breakers.record_result('https://down.example.com/a', None)
+    breakers.record_result('https://down.example.com/b', 503)
+    breakers.record_result('https://up.example.com/a', 404)
+
+    assert breakers.open_hosts() == ['down.example.com']
+    assert not breakers.allow_request('https://down.example.com/c')
+    assert breakers.allow_request('https://up.example.com/b')
+
+def test_open_host_urls_are_parked(db_name, clock):
+    breakers = HostCircuitBreakers(min_requests=1, cooldown=600, clock=clock)
+    urls = ['https://example.com/a/', 'https://example.com/b/', 'https://example.com/c/']
+
+    page = {"status_code": None, "content_type": None, "body": None, "aborted": None, "redirects": [], "url": None}
+    with patch('bertha.crawl_pages.fetch_page', return_value=page) as mock_check:
+        crawl_pages(urls, db_name=db_name, breakers=breakers)
+
+    assert mock_check.call_count == 1
+    assert get_urls_to_crawl('https://example.com', gap=30, db_name=db_name) == []
+
+def test_parked_urls_are_not_counted_as_crawled(db_name, clock):
+    breakers = HostCircuitBreakers(min_requests=1, cooldown=600, clock=clock)
+    session_id = start_crawl_session('https://example.com', db_name)
+
+    page = {"status_code": None, "content_type": None, "body": None, "aborted": None, "redirects": [], "url": None}
+    with patch('bertha.crawl_pages.fetch_page', return_value=page) as mock_fetch:
+        assert crawl_pages(['https://example.com/a/', 'https://example.com/b/'], db_name=db_name,
+                           breakers=breakers) == 1
+        crawl_all_pages('https://example.com', 30, 3, 0, db_name, session_id=session_id, breakers=breakers)
+
+    # Only the first URL was fetched; the others were parked by the open breaker
+    assert mock_fetch.call_count == 1
+    session = get_crawl_session(session_id, db_name)
+    assert (session['urls_crawled'], session['urls_failed']) == (0, 0)
+
+def test_gone_urls_back_off_exponentially(db_name):
+    url = 'https://example.com/a/'
+    update_crawl_info(url, 404, False, db_name=db_name)
+    with sqlite3.connect(db_name) as conn:
+        assert conn.execute('SELECT dt_retry_after FROM tb_pages WHERE url = ?', (url,)).fetchone()[0] is None
+
+    update_crawl_info(url, 410, False, db_name=db_name)
+    update_crawl_info(url, 404, False, db_name=db_name)
+    with sqlite3.connect(db_name) as conn:
+        gone_count, dt_last_crawl, dt_retry_after = conn.execute(
+            'SELECT gone_count, dt_last_crawl, dt_retry_after FROM tb_pages WHERE url = ?', (url,)
+        ).fetchone()
+    assert gone_count == 3
+    assert dt_retry_after[:8] > dt_last_crawl[:8]
+    assert url not in get_urls_to_crawl('https://example.com', gap=0, db_name=db_name)
+
+    update_crawl_info(url, 200, True, db_name=db_name)
+    with sqlite3.connect(db_name) as conn:
+        assert conn.execute('SELECT gone_count, dt_retry_after FROM tb_pages WHERE url = ?', (url,)).fetchone() == (0, None)
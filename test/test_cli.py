@@ -0,0 +1,41 @@
+# test/test_cli.py
+
+import subprocess
+import sys
+import pytest
+from unittest.mock import patch
+from bertha.cli import main
+from bertha.exceptions import SitemapRetrievalError
+
+def test_import_does_not_load_heavy_modules():
+    code = (
+        "import sys, bertha; "
+        "assert 'bertha.main' not in sys.modules; "
+        "assert 'requests' not in sys.modules; "
+        "assert 'sqlalchemy' not in sys.modules; "
+        "assert callable(bertha.crawl_pages); "
+        "import bertha.crawl_pages as module; "
+        "assert callable(bertha.crawl_pages) and bertha.crawl_pages.__module__ == 'bertha.crawl_pages'"
+    )
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+def test_help_exits_cleanly():
+    result = subprocess.run([sys.executable, '-m', 'bertha', '--help'], capture_output=True, text=True)
+    assert result.returncode == 0
+    assert 'recrawl-url' in result.stdout
+
+def test_crawl_command_passes_options():
+    with patch('bertha.main.crawl_website', return_value=[{'url': 'https://example.com/'}]) as mock_crawl:
+        assert main(['crawl', 'https://example.com', '--gap', '7', '--db', 'sites.db', '--no-resume']) == 0
+    mock_crawl.assert_called_once_with('https://example.com', 7, 'sites.db', retries=5, timeout=30, resume=False,
+                                       archive=None)
+
+def test_crawl_failure_exits_with_status_1(capsys):
+    with patch('bertha.main.crawl_website', side_effect=SitemapRetrievalError('no sitemaps')):
+        assert main(['crawl', 'https://example.com']) == 1
+    assert 'no sitemaps' in capsys.readouterr().err
+
+def test_unknown_command_is_a_usage_error():
+    with pytest.raises(SystemExit) as exc_info:
+        main(['explode', 'https://example.com'])
+    assert exc_info.value.code == 2
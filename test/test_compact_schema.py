@@ -0,0 +1,123 @@
+# test/test_compact_schema.py
+
+import sqlite3
+import pytest
+from bertha.database_setup import initialize_database
+from bertha.compact_schema import (
+    split_url, to_epoch, migrate_to_compact, find_url_id, benchmark_schemas, initialize_compact_database
+)
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    db_name = str(tmp_path / 'legacy.db')
+    initialize_database(db_name)
+    referrers = ','.join(f'https://example.com/blog/post-{i}/' for i in range(20))
+    with sqlite3.connect(db_name) as conn:
+        conn.execute('''
+            INSERT INTO tb_pages (url, dt_discovered, sitemaps, referring_pages, successful_page_fetch, status_code,
+                                  dt_last_crawl, robots_index, robots_follow)
+            VALUES ('https://example.com/', '20260101120000', 'https://example.com/sitemap.xml', NULL, 1, 200,
+                    '20260102120000', 1, 1)
+        ''')
+        conn.executemany('''
+            INSERT INTO tb_pages (url, dt_discovered, sitemaps, referring_pages, successful_page_fetch, status_code,
+                                  dt_last_crawl, robots_index, robots_follow, inlinks)
+            VALUES (?, '20260101120000', 'https://example.com/sitemap.xml', ?, ?, ?, '20260102120000', 1, NULL, 20)
+        ''', [
+            (f'https://example.com/blog/post-{i}/', referrers, i % 2 == 0, 200 if i % 2 == 0 else 404)
+            for i in range(20)
+        ])
+    return db_name
+
+def test_split_url_round_trips():
+    for url in (
+        'https://example.com',
+        'https://example.com/',
+        'https://example.com/about',
+        'https://example.com/blog/post/?page=2',
+        'https://example.com/search?q=a/b',
+        'http://example.com:8080/a/b/c#top',
+    ):
+        assert ''.join(split_url(url)) == url
+    assert split_url('https://example.com/blog/post/?page=2') == ('https://example.com', '/blog/', 'post/?page=2')
+
+def test_to_epoch():
+    assert to_epoch(None) is None
+    assert to_epoch('not a date') is None
+    assert to_epoch('20260102120000') - to_epoch('20260101120000') == 86400
+
+def test_migration_preserves_pages(legacy_db, tmp_path):
+    compact_db = str(tmp_path / 'compact.db')
+    counts = migrate_to_compact(legacy_db, compact_db, batch_size=7)
+    assert counts == {"urls": 21, "links": 400, "sitemaps": 21}
+
+    with sqlite3.connect(compact_db) as conn:
+        pages = {row[0]: row[1:] for row in conn.execute(
+            'SELECT url, status_code, successful_page_fetch, robots_index, robots_follow, inlinks FROM v_pages'
+        )}
+        assert conn.execute('SELECT COUNT(*) FROM tb_hosts').fetchone()[0] == 1
+
+    assert len(pages) == 21
+    assert pages['https://example.com/'] == (200, 1, 1, 1, 0)
+    assert pages['https://example.com/blog/post-1/'] == (404, 0, 1, None, 20)
+    assert find_url_id('https://example.com/blog/post-3/', compact_db) is not None
+    assert find_url_id('https://example.com/missing/', compact_db) is None
+
+def test_migration_keeps_every_column(legacy_db, tmp_path):
+    with sqlite3.connect(legacy_db) as conn:
+        conn.execute('''
+            INSERT INTO tb_pages (url, dt_discovered, referring_pages, status_code, depth, inlinks, crawl_count,
+                                  crawl_priority, redirect_target, redirect_chain, dt_redirect_verified)
+            VALUES ('https://example.com/old/', '20260101120000', 'https://elsewhere.com/links/', 301, 1, 1, 2,
+                    0.5, 'https://example.com/new/', '[{"status_code": 301}]', '20260103120000')
+        ''')
+        legacy_columns = {row[1] for row in conn.execute('PRAGMA table_info(tb_pages)')} - {'id'}
+
+    compact_db = str(tmp_path / 'compact.db')
+    migrate_to_compact(legacy_db, compact_db)
+
+    with sqlite3.connect(compact_db) as conn:
+        conn.row_factory = sqlite3.Row
+        assert legacy_columns <= {row[1] for row in conn.execute('PRAGMA table_info(v_pages)')}
+        page = dict(conn.execute("SELECT * FROM v_pages WHERE url = 'https://example.com/old/'").fetchone())
+        urls = {row[0] for row in conn.execute('SELECT url FROM v_pages')}
+
+    assert page['redirect_target'] == 'https://example.com/new/'
+    assert page['redirect_chain'] == '[{"status_code": 301}]'
+    assert page['dt_redirect_verified'] == to_epoch('20260103120000')
+    assert (page['inlinks'], page['crawl_count'], page['crawl_priority']) == (1, 2, 0.5)
+    assert page['referring_pages'] == 'https://elsewhere.com/links/'
+    # Referrers and redirect targets that are not pages are kept out of the pages
+    assert len(urls) == 22
+    assert 'https://elsewhere.com/links/' not in urls and 'https://example.com/new/' not in urls
+    assert find_url_id('https://elsewhere.com/links/', compact_db) is None
+
+def test_version_1_archive_is_upgraded(tmp_path):
+    compact_db = str(tmp_path / 'compact.db')
+    with sqlite3.connect(compact_db) as conn:
+        conn.executescript('''
+            PRAGMA user_version = 1;
+            CREATE TABLE tb_urls (
+                url_id INTEGER PRIMARY KEY, host_id INTEGER NOT NULL, prefix_id INTEGER NOT NULL, path TEXT NOT NULL,
+                dt_discovered INTEGER, dt_last_crawl INTEGER, status_code INTEGER, successful_page_fetch INTEGER,
+                robots_index INTEGER, robots_follow INTEGER, depth INTEGER, crawl_count INTEGER, change_count INTEGER,
+                gone_count INTEGER, dt_retry_after INTEGER, UNIQUE (host_id, prefix_id, path)
+            );
+            INSERT INTO tb_urls (host_id, prefix_id, path, dt_discovered) VALUES (1, 1, 'page/', 1767268800);
+            INSERT INTO tb_urls (host_id, prefix_id, path) VALUES (1, 1, 'referrer/');
+        ''')
+
+    initialize_compact_database(compact_db)
+    with sqlite3.connect(compact_db) as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == 2
+        assert dict(conn.execute('SELECT path, is_page FROM tb_urls')) == {'page/': 1, 'referrer/': 0}
+
+def test_benchmark_reports_both_layouts(legacy_db, tmp_path):
+    compact_db = str(tmp_path / 'compact.db')
+    migrate_to_compact(legacy_db, compact_db)
+
+    results = benchmark_schemas(legacy_db, compact_db, 'https://example.com', repeat=1)
+    assert set(results) == {"legacy", "compact"}
+    for layout in results.values():
+        assert layout["size_bytes"] > 0
+        assert set(layout["queries"]) == {"url_lookup", "indexible_pages", "status_counts", "inlinks"}
@@ -1,6 +1,16 @@
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from unittest.mock import patch
 import pytest
-from bertha.crawl_pages import crawl_pages, process_sitemaps, crawl_all_pages
-from bertha.database_operations import insert_if_not_exists, fetch_all_website_data
+from bertha.crawl_pages import crawl_pages, process_sitemaps, crawl_all_pages, verify_redirects
+from bertha.change_feed import changes_since
+from bertha.database_setup import initialize_database, referring_pages_sql
+from bertha.database_operations import insert_if_not_exists, fetch_all_website_data, fetch_url_data, get_urls_to_crawl
+from bertha.database_operations import update_referring_pages
+from bertha.link_graph import LinkGraph
+from bertha.retry_policy import RetryPolicy
+from bertha.utils import MAX_BODY_SIZE
 
 @pytest.fixture(scope="module")
 def base_url():
@@ -17,3 +27,166 @@ def test_crawl_all_pages(base_url):
     data = fetch_all_website_data(base_url)
     assert data is not None
     assert len(data) > 0
+
+REDIRECTS = [
+    {"url": 'https://example.com/old/', "status_code": 301, "location": 'https://example.com/moved'},
+    {"url": 'https://example.com/moved', "status_code": 301, "location": 'https://example.com/new/'},
+]
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / 'test_db.db')
+    initialize_database(db_name)
+    with patch('bertha.database_operations.is_actual_page', return_value=True):
+        insert_if_not_exists('https://example.com/old/', db_name=db_name, depth=1)
+    return db_name
+
+def _redirected_page(redirects=REDIRECTS, url='https://example.com/new/'):
+    return {"status_code": 200, "content_type": 'text/html', "aborted": None, "redirects": redirects, "url": url,
+            "body": b'<a href="/linked/">linked</a>'}
+
+def test_crawl_pages_stores_redirect_chain(db_name):
+    with patch('bertha.crawl_pages.fetch_page', return_value=_redirected_page()) as mock_fetch, \
+            patch('bertha.database_operations.is_actual_page', return_value=True):
+        crawl_pages(['https://example.com/old/'], db_name=db_name)
+    assert mock_fetch.call_count == 1
+
+    source = fetch_url_data('https://example.com/old/', db_name)
+    assert source["status_code"] == 301
+    assert not source["successful_page_fetch"]
+    with sqlite3.connect(db_name) as conn:
+        redirect_target, redirect_chain = conn.execute(
+            "SELECT redirect_target, redirect_chain FROM tb_pages WHERE url = 'https://example.com/old/'"
+        ).fetchone()
+        target_depth = conn.execute("SELECT depth FROM tb_pages WHERE url = 'https://example.com/new/'").fetchone()[0]
+        link_referrers = conn.execute(
+            f"SELECT {referring_pages_sql()} FROM tb_pages WHERE url = 'https://example.com/linked/'"
+        ).fetchone()[0]
+    assert redirect_target == 'https://example.com/new/'
+    assert json.loads(redirect_chain) == REDIRECTS
+
+    # The final response is recorded as the crawl of the target, whose links are followed
+    target = fetch_url_data('https://example.com/new/', db_name)
+    assert target["status_code"] == 200
+    assert target["successful_page_fetch"]
+    assert target_depth == 1
+    assert link_referrers == 'https://example.com/new/'
+
+    changes = list(changes_since(0, change_types=['redirect'], db_name=db_name))
+    assert [(change["url"], change["new_value"]) for change in changes] == [
+        ('https://example.com/old/', 'https://example.com/new/')
+    ]
+
+def test_link_graph_depths_match_crawled_redirects(db_name):
+    with patch('bertha.database_operations.is_actual_page', return_value=True):
+        insert_if_not_exists('https://example.com/', db_name=db_name, depth=0)
+    update_referring_pages('https://example.com/old/', 'https://example.com/', db_name=db_name)
+    with patch('bertha.crawl_pages.fetch_page', return_value=_redirected_page()), \
+            patch('bertha.database_operations.is_actual_page', return_value=True):
+        crawl_pages(['https://example.com/old/'], db_name=db_name)
+
+    graph = LinkGraph.from_database('https://example.com', db_name)
+    depths = {url: int(depth) for url, depth in zip(graph.urls, graph.click_depths('https://example.com/'))}
+    with sqlite3.connect(db_name) as conn:
+        stored_depths = dict(conn.execute('SELECT url, depth FROM tb_pages'))
+    assert depths == stored_depths == {
+        'https://example.com/': 0, 'https://example.com/old/': 1,
+        'https://example.com/new/': 1, 'https://example.com/linked/': 2,
+    }
+
+def test_known_redirects_wait_for_verification(db_name):
+    with patch('bertha.crawl_pages.fetch_page', return_value=_redirected_page()), \
+            patch('bertha.database_operations.is_actual_page', return_value=True):
+        crawl_pages(['https://example.com/old/'], db_name=db_name)
+
+    # Crawled 40 days ago: due by the gap, but the redirect is trusted for REDIRECT_VERIFY_DAYS
+    forty_days_ago = (datetime.now() - timedelta(days=40)).strftime('%Y%m%d%H%M%S')
+    with sqlite3.connect(db_name) as conn:
+        conn.execute('UPDATE tb_pages SET dt_last_crawl = ?, dt_redirect_verified = ?', (forty_days_ago, forty_days_ago))
+    assert sorted(get_urls_to_crawl('https://example.com', gap=30, db_name=db_name)) == [
+        'https://example.com/linked/', 'https://example.com/new/'
+    ]
+    assert 'https://example.com/old/' in get_urls_to_crawl(
+        'https://example.com', gap=30, db_name=db_name, redirect_verify_days=30
+    )
+
+    # The redirect was removed: verifying the source clears it
+    page = {"status_code": 200, "content_type": 'text/html', "aborted": None, "redirects": [],
+            "url": 'https://example.com/old/', "body": b''}
+    with patch('bertha.crawl_pages.fetch_page', return_value=page) as mock_fetch:
+        assert verify_redirects('https://example.com', db_name, max_age_days=0) == 1
+    mock_fetch.assert_called_once_with('https://example.com/old/', max_body_size=MAX_BODY_SIZE)
+
+    with sqlite3.connect(db_name) as conn:
+        row = conn.execute(
+            "SELECT status_code, redirect_target, redirect_chain FROM tb_pages WHERE url = 'https://example.com/old/'"
+        ).fetchone()
+    assert row == (200, None, None)
+    assert verify_redirects('https://example.com', db_name, max_age_days=0) == 0
+
+def test_trailing_slash_redirect_is_not_tracked(db_name):
+    slash_only = [{"url": 'https://example.com/old/', "status_code": 301, "location": 'https://example.com/old'}]
+    with patch('bertha.crawl_pages.fetch_page', return_value=_redirected_page(slash_only, 'https://example.com/old')):
+        crawl_pages(['https://example.com/old/'], db_name=db_name)
+
+    with sqlite3.connect(db_name) as conn:
+        row = conn.execute(
+            "SELECT status_code, redirect_target FROM tb_pages WHERE url = 'https://example.com/old/'"
+        ).fetchone()
+    assert row == (200, None)
+
+def _locked_for(calls, func):
+    attempts = []
+
+    def locked(*args, **kwargs):
+        attempts.append(args)
+        if len(attempts) <= calls:
+            raise sqlite3.OperationalError('database is locked')
+        return func(*args, **kwargs)
+
+    return locked, attempts
+
+def test_database_retries_do_not_fetch_again(db_name):
+    from bertha.crawl_pages import update_crawl_info
+    page = {"status_code": 200, "content_type": 'text/html', "aborted": None, "redirects": [],
+            "url": 'https://example.com/old/', "body": b''}
+    # The lock outlasts the retries of the write, then goes away for the failure to be recorded
+    locked, attempts = _locked_for(3, update_crawl_info)
+    with patch('bertha.crawl_pages.fetch_page', return_value=page) as mock_fetch, \
+            patch('bertha.crawl_pages.update_crawl_info', side_effect=locked):
+        crawl_all_pages('https://example.com', gap=30, retries=3, timeout=0, db_name=db_name)
+
+    mock_fetch.assert_called_once()
+    # Three attempts by the write's own policy, none by the crawl loop, then the failure
+    assert len(attempts) == 4
+    assert attempts[-1][1:3] == (None, False)
+
+def test_referring_pages_use_the_given_policy(db_name):
+    import sqlite3 as real_sqlite3
+    locked, attempts = _locked_for(1, real_sqlite3.connect)
+    policy = RetryPolicy('referrers', attempts=2, base_delay=0)
+    with patch('bertha.database_operations.sqlite3.connect', side_effect=locked):
+        update_referring_pages('https://example.com/old/', 'https://example.com/', db_name, retry_policy=policy)
+    assert len(attempts) == 2
+
+    single_attempt = RetryPolicy('referrers', attempts=1)
+    locked, attempts = _locked_for(1, real_sqlite3.connect)
+    with patch('bertha.database_operations.sqlite3.connect', side_effect=locked), \
+            pytest.raises(sqlite3.OperationalError):
+        update_referring_pages('https://example.com/old/', 'https://example.org/', db_name, retry_policy=single_attempt)
+    assert len(attempts) == 1
+    assert fetch_url_data('https://example.com/old/', db_name)["referring_pages"] == 'https://example.com/'
+
+def test_links_without_trailing_slash_get_their_referrer(db_name):
+    page = {"status_code": 200, "content_type": 'text/html', "aborted": None, "redirects": [],
+            "url": 'https://example.com/old/', "body": b'<a href="/a">a</a><a href="/b/">b</a>'}
+    with patch('bertha.crawl_pages.fetch_page', return_value=page), \
+            patch('bertha.database_operations.is_actual_page', return_value=True):
+        crawl_pages(['https://example.com/old/'], db_name=db_name)
+
+    with sqlite3.connect(db_name) as conn:
+        rows = dict(conn.execute(
+            "SELECT url, inlinks FROM tb_pages WHERE url IN ('https://example.com/a/', 'https://example.com/b/')"
+        ))
+    assert rows == {'https://example.com/a/': 1, 'https://example.com/b/': 1}
+    assert fetch_url_data('https://example.com/a/', db_name)["referring_pages"] == 'https://example.com/old/'
@@ -0,0 +1,84 @@
+# test/test_crawl_session.py
+
+import pytest
+from unittest.mock import patch
+from bertha.database_setup import initialize_database
+from bertha.crawl_pages import process_sitemaps, crawl_all_pages
+from bertha.crawl_session import (
+    start_crawl_session,
+    get_crawl_session,
+    find_resumable_session,
+    finish_crawl_session,
+    start_session_batch,
+    checkpoint_batch_position
+)
+from bertha.exceptions import SitemapRetrievalError, CrawlSessionError
+
+SITEMAP_URLS = [
+    ('https://example.com/a/', 'https://example.com/sitemap.xml'),
+    ('https://example.com/b/', 'https://example.com/sitemap.xml'),
+    ('https://example.com/c/', 'https://example.com/sitemap.xml'),
+]
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / 'test_sessions.db')
+    initialize_database(db_name)
+    return db_name
+
+def test_session_lifecycle(db_name):
+    session_id = start_crawl_session('https://example.com', db_name)
+    assert find_resumable_session('https://example.com', db_name)['id'] == session_id
+
+    finish_crawl_session(session_id, db_name=db_name)
+    assert get_crawl_session(session_id, db_name)['phase'] == 'done'
+    assert find_resumable_session('https://example.com', db_name) is None
+
+def test_missing_session_raises(db_name):
+    with pytest.raises(CrawlSessionError):
+        get_crawl_session(42, db_name)
+
+def test_sitemap_ingestion_resumes_without_refetching(db_name):
+    session_id = start_crawl_session('https://example.com', db_name)
+
+    processed = []
+    def fail_on_second(url, db_name):
+        if url == SITEMAP_URLS[1][0] and not processed.count(url):
+            processed.append(url)
+            raise KeyboardInterrupt
+        processed.append(url)
+
+    with patch('bertha.crawl_pages.pages_from_sitemaps', return_value=SITEMAP_URLS) as mock_sitemaps, \
+         patch('bertha.crawl_pages.insert_if_not_exists', side_effect=fail_on_second), \
+         patch('bertha.crawl_pages.update_sitemaps_for_url'):
+        with pytest.raises(KeyboardInterrupt):
+            process_sitemaps('https://example.com', retries=1, timeout=0, db_name=db_name, session_id=session_id)
+        assert get_crawl_session(session_id, db_name)['sitemap_position'] == 1
+
+        process_sitemaps('https://example.com', retries=1, timeout=0, db_name=db_name, session_id=session_id)
+        assert mock_sitemaps.call_count == 1
+
+    session = get_crawl_session(session_id, db_name)
+    assert session['sitemap_total'] == 3
+    assert session['sitemap_position'] == 3
+    assert processed == [SITEMAP_URLS[0][0], SITEMAP_URLS[1][0], SITEMAP_URLS[1][0], SITEMAP_URLS[2][0]]
+
+def test_sitemap_failure_raises_instead_of_exiting(db_name):
+    with patch('bertha.crawl_pages.pages_from_sitemaps', side_effect=ConnectionError):
+        with pytest.raises(SitemapRetrievalError):
+            process_sitemaps('https://example.com', retries=2, timeout=0, db_name=db_name)
+
+def test_crawl_resumes_in_flight_batch(db_name):
+    session_id = start_crawl_session('https://example.com', db_name)
+    batch = ['https://example.com/a/', 'https://example.com/b/', 'https://example.com/c/']
+    start_session_batch(session_id, batch, db_name)
+    checkpoint_batch_position(session_id, 1, crawled=1, db_name=db_name)
+
+    with patch('bertha.crawl_pages.crawl_pages') as mock_crawl, \
+         patch('bertha.crawl_pages.next_crawl_batch', return_value=[]):
+        crawl_all_pages('https://example.com', gap=30, retries=1, timeout=0, db_name=db_name, session_id=session_id)
+
+    assert [call.args[0] for call in mock_crawl.call_args_list] == [[batch[1]], [batch[2]]]
+    session = get_crawl_session(session_id, db_name)
+    assert session['urls_crawled'] == 3
+    assert session['current_batch'] == []
@@ -1,6 +1,6 @@
 import pytest
 import sqlite3
-from bertha.database_setup import initialize_database
+from bertha.database_setup import initialize_database, referring_pages_sql
 
 @pytest.fixture(scope="module")
 def db_name():
@@ -36,6 +36,33 @@ def test_initialize_database(db_name):
     cursor.close()
     conn.close()
 
+def test_referring_pages_are_migrated_to_links(tmp_path):
+    db_name = str(tmp_path / 'legacy.db')
+    initialize_database(db_name)
+    with sqlite3.connect(db_name) as conn:
+        conn.executemany('INSERT INTO tb_pages (url, referring_pages) VALUES (?, ?)', [
+            ('https://example.com/', None),
+            ('https://example.com/a/', 'https://example.com/,https://example.com/b/'),
+            ('https://example.com/b/', 'https://example.com/'),
+        ])
+
+    # Running it again leaves the migrated links as they are
+    initialize_database(db_name)
+    initialize_database(db_name)
+
+    with sqlite3.connect(db_name) as conn:
+        referrers = dict(conn.execute(f'SELECT url, {referring_pages_sql()} FROM tb_pages'))
+        legacy = conn.execute('SELECT COUNT(*) FROM tb_pages WHERE referring_pages IS NOT NULL').fetchone()[0]
+        sources = conn.execute('SELECT COUNT(*) FROM tb_link_sources').fetchone()[0]
+
+    assert referrers == {
+        'https://example.com/': None,
+        'https://example.com/a/': 'https://example.com/,https://example.com/b/',
+        'https://example.com/b/': 'https://example.com/',
+    }
+    assert legacy == 0
+    assert sources == 2
+
 def test_cleanup(db_name):
     """Clean up the test database file after tests."""
     import os
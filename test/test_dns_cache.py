@@ -0,0 +1,219 @@
+# test/test_dns_cache.py
+
+import socket
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import pytest
+import requests
+from bertha.dns_cache import DnsCache, dns_cache_adapter, active_dns_cache, prefetch_hosts
+from bertha.utils import use_shared_http_session, close_shared_http_session, shared_http_session, http_client
+
+V4 = (socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', ('127.0.0.1', 0))
+V6 = (socket.AF_INET6, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', ('::1', 0, 0, 0))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubResolver:
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+
+    def __call__(self, host, port, family=0, type=0, proto=0, flags=0):
+        self.calls.append(host)
+        answer = self.answers.get(host)
+        if answer is None:
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        return answer
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def resolver():
+    return StubResolver({'example.com': [V4, V6], 'ipv4.example.com': [V4]})
+
+
+@pytest.fixture
+def cache(resolver, clock):
+    return DnsCache(ttl=300, negative_ttl=30, max_stale=3600, resolver=resolver, clock=clock)
+
+
+def test_answers_are_cached_until_ttl(cache, resolver, clock):
+    assert cache.getaddrinfo('example.com', 443, 0, socket.SOCK_STREAM)[0][4] == ('127.0.0.1', 443)
+    assert cache.getaddrinfo('Example.com', '80')[0][4] == ('127.0.0.1', 80)
+    assert resolver.calls == ['example.com']
+
+    clock.now += 301
+    cache.getaddrinfo('example.com', 443)
+    assert resolver.calls == ['example.com', 'example.com']
+
+
+def test_family_filter(cache):
+    assert [result[4] for result in cache.getaddrinfo('example.com', 443, socket.AF_INET6)] == [('::1', 443, 0, 0)]
+    with pytest.raises(socket.gaierror):
+        cache.getaddrinfo('ipv4.example.com', 443, socket.AF_INET6)
+
+
+def test_other_lookups_bypass_the_cache(cache, resolver):
+    resolver.answers['127.0.0.1'] = [V4]
+    cache.getaddrinfo('127.0.0.1', 443)
+    cache.getaddrinfo('example.com', 53, 0, socket.SOCK_DGRAM)
+    cache.getaddrinfo('example.com', 443, 0, 0, 0, socket.AI_CANONNAME)
+    assert resolver.calls == ['127.0.0.1', 'example.com', 'example.com']
+    assert cache.metrics()["lookups"] == 0
+
+
+def test_failed_lookups_are_cached(cache, resolver, clock):
+    for _ in range(3):
+        with pytest.raises(socket.gaierror):
+            cache.getaddrinfo('missing.example.com', 443)
+    assert resolver.calls == ['missing.example.com']
+
+    clock.now += 31
+    with pytest.raises(socket.gaierror):
+        cache.getaddrinfo('missing.example.com', 443)
+    assert len(resolver.calls) == 2
+
+
+def test_expired_answer_used_when_resolver_fails(cache, resolver, clock):
+    cache.getaddrinfo('example.com', 443)
+    del resolver.answers['example.com']
+
+    clock.now += 301
+    assert cache.getaddrinfo('example.com', 443)[0][4] == ('127.0.0.1', 443)
+    # The expired answer is used again without a lookup until negative_ttl passed
+    cache.getaddrinfo('example.com', 443)
+    assert resolver.calls == ['example.com', 'example.com']
+    assert cache.metrics()["stale"] == 1
+
+    clock.now += 3600
+    with pytest.raises(socket.gaierror):
+        cache.getaddrinfo('example.com', 443)
+
+
+def test_concurrent_lookups_resolve_once(clock):
+    calls = []
+
+    def slow_resolver(host, port, family=0, type=0, proto=0, flags=0):
+        calls.append(host)
+        time.sleep(0.05)
+        return [V4]
+
+    cache = DnsCache(resolver=slow_resolver, clock=clock)
+    threads = [threading.Thread(target=cache.lookup, args=('example.com',)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ['example.com']
+
+
+def test_prefetch_and_metrics(cache, resolver):
+    resolved = cache.prefetch([
+        'https://example.com/', 'https://example.com/about/', 'http://ipv4.example.com:8080/',
+        'https://missing.example.com/', 'http://127.0.0.1/',
+    ])
+    assert resolved == 3
+    assert sorted(resolver.calls) == ['example.com', 'ipv4.example.com', 'missing.example.com']
+    assert cache.prefetch(['https://example.com/contact/']) == 0
+
+    cache.getaddrinfo('example.com', 443)
+    metrics = cache.metrics()
+    assert metrics["lookups"] == 4
+    assert metrics["hits"] == 1
+    assert metrics["misses"] == 3
+    assert metrics["failures"] == 1
+    assert metrics["hosts"] == 3
+    assert metrics["hit_rate"] == 0.25
+
+
+@pytest.fixture
+def server():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b'ok')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_prefetch_hosts_uses_the_shared_session_cache(cache):
+    assert prefetch_hosts(['https://example.com/']) == 0
+    with shared_http_session(dns_cache=cache):
+        assert active_dns_cache() is cache
+        assert prefetch_hosts(['https://ipv4.example.com/']) == 1
+    assert active_dns_cache() is None
+
+
+def test_adapter_does_not_patch_the_process(cache, server):
+    original = socket.getaddrinfo
+    port = server.server_address[1]
+    session = requests.Session()
+    session.mount('http://', dns_cache_adapter(cache))
+    cache.resolver.answers['crawled.test'] = [V4]
+    with session:
+        assert session.get(f'http://crawled.test:{port}/', timeout=5).text == 'ok'
+    assert socket.getaddrinfo is original
+    with pytest.raises(requests.exceptions.ConnectionError):
+        requests.get(f'http://crawled.test:{port}/', timeout=5)
+
+
+def test_adapter_tries_every_address(clock, server):
+    # Nothing listens on 127.0.0.2 at the server port on most hosts; the connection falls back to 127.0.0.1
+    unreachable = (socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', ('127.0.0.2', 0))
+    resolver = StubResolver({'crawled.test': [unreachable, V4]})
+    session = requests.Session()
+    session.mount('http://', dns_cache_adapter(DnsCache(resolver=resolver, clock=clock)))
+    with session:
+        response = session.get(f'http://crawled.test:{server.server_address[1]}/', timeout=5)
+    assert response.text == 'ok'
+
+
+def test_unresolved_host_is_a_connection_error(cache):
+    session = requests.Session()
+    session.mount('http://', dns_cache_adapter(cache))
+    with session, pytest.raises(requests.exceptions.ConnectionError):
+        session.get('http://missing.example.com/', timeout=5)
+
+
+def test_shared_session_resolves_through_cache(clock, server):
+    resolver = StubResolver({'crawled.test': [V4]})
+    port = server.server_address[1]
+    try:
+        use_shared_http_session(dns_cache=DnsCache(resolver=resolver, clock=clock))
+        for path in ('/', '/a/', '/b/'):
+            # A new connection for each request, so each one resolves the host
+            response = http_client().get(f'http://crawled.test:{port}{path}', headers={'Connection': 'close'})
+            assert response.text == 'ok'
+        assert resolver.calls == ['crawled.test']
+    finally:
+        close_shared_http_session()
+    assert active_dns_cache() is None
+
+
+def test_shared_session_is_kept_by_nested_blocks(cache):
+    with shared_http_session(dns_cache=cache) as session:
+        with shared_http_session() as nested:
+            assert nested is session
+        assert http_client() is session
+    assert http_client() is requests
@@ -0,0 +1,27 @@
+# test/test_link_extraction.py
+
+from bertha.link_extraction import extract_internal_links, decode_body
+
+def test_extracts_internal_links_only():
+    html = b'''
+        <a href="/about">About</a>
+        <a href="contact#form">Contact</a>
+        <a href="https://example.com/about">About again</a>
+        <a href="https://other.com/">Elsewhere</a>
+        <a href="mailto:hi@example.com">Mail</a>
+        <area href="/map">
+    '''
+    links = extract_internal_links(html, 'https://example.com/company/')
+    assert links == [
+        'https://example.com/about',
+        'https://example.com/company/contact',
+        'https://example.com/map',
+    ]
+
+def test_base_href_is_respected():
+    html = '<base href="https://example.com/docs/"><a href="intro">Intro</a>'
+    assert extract_internal_links(html, 'https://example.com/') == ['https://example.com/docs/intro']
+
+def test_decode_body_uses_charset():
+    assert decode_body('café'.encode('latin-1'), 'text/html; charset=ISO-8859-1') == 'café'
+    assert decode_body('café'.encode('utf-8'), 'text/html') == 'café'
@@ -0,0 +1,162 @@
+# test/test_link_graph.py
+
+import sqlite3
+import pytest
+from bertha.database_setup import initialize_database
+from bertha.compact_schema import migrate_to_compact
+from bertha.link_graph import LinkGraph, UNREACHABLE, analyze_link_graph, np
+
+BACKENDS = [False] + ([True] if np is not None else [])
+
+# home -> about, blog; blog -> post-1, post-2; post-1 -> post-2, home; post-2 has no outlinks.
+# orphan is in the sitemap but not linked, island links to nothing reachable.
+PAGES = [
+    ('https://example.com/', 'https://example.com/blog/post-1/', 'https://example.com/sitemap.xml'),
+    ('https://example.com/about/', 'https://example.com/', None),
+    ('https://example.com/blog/', 'https://example.com/,https://example.com/', 'https://example.com/sitemap.xml'),
+    ('https://example.com/blog/post-1/', 'https://example.com/blog/', 'https://example.com/sitemap.xml'),
+    ('https://example.com/blog/post-2/', 'https://example.com/blog/,https://example.com/blog/post-1/', None),
+    ('https://example.com/orphan/', None, 'https://example.com/sitemap.xml'),
+    ('https://example.com/island/', 'https://example.com/island/', None),
+]
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / 'test_db.db')
+    initialize_database(db_name)
+    with sqlite3.connect(db_name) as conn:
+        conn.executemany(
+            "INSERT INTO tb_pages (url, dt_discovered, referring_pages, sitemaps) VALUES (?, '20260101120000', ?, ?)",
+            PAGES
+        )
+    return db_name
+
+def by_url(graph, values):
+    return {url: values[node] for node, url in enumerate(graph.urls)}
+
+@pytest.mark.parametrize('use_numpy', BACKENDS)
+def test_counts_ignore_duplicate_and_self_links(db_name, use_numpy):
+    graph = LinkGraph.from_database('https://example.com', db_name, use_numpy=use_numpy)
+
+    assert graph.num_nodes == 7
+    assert graph.num_edges == 6
+    inlinks = by_url(graph, graph.inlink_counts())
+    outlinks = by_url(graph, graph.outlink_counts())
+    assert inlinks['https://example.com/blog/'] == 1
+    assert inlinks['https://example.com/blog/post-2/'] == 2
+    assert inlinks['https://example.com/island/'] == 0
+    assert outlinks['https://example.com/'] == 2
+    assert outlinks['https://example.com/blog/post-2/'] == 0
+    assert sorted(graph.urls[target] for target in graph.outlinks(graph.node_id('https://example.com/blog/'))) == [
+        'https://example.com/blog/post-1/', 'https://example.com/blog/post-2/'
+    ]
+
+@pytest.mark.parametrize('use_numpy', BACKENDS)
+def test_click_depths_from_base_url(db_name, use_numpy):
+    graph = LinkGraph.from_database('https://example.com', db_name, use_numpy=use_numpy)
+
+    depths = by_url(graph, graph.click_depths('https://example.com'))
+    assert depths == {
+        'https://example.com/': 0,
+        'https://example.com/about/': 1,
+        'https://example.com/blog/': 1,
+        'https://example.com/blog/post-1/': 2,
+        'https://example.com/blog/post-2/': 2,
+        'https://example.com/orphan/': UNREACHABLE,
+        'https://example.com/island/': UNREACHABLE,
+    }
+    with pytest.raises(KeyError):
+        graph.click_depths('https://example.com/missing/')
+
+@pytest.mark.parametrize('use_numpy', BACKENDS)
+def test_orphan_pages(db_name, use_numpy):
+    graph = LinkGraph.from_database('https://example.com', db_name, use_numpy=use_numpy)
+    assert graph.orphan_pages() == ['https://example.com/orphan/']
+
+@pytest.mark.parametrize('use_numpy', BACKENDS)
+def test_pagerank(db_name, use_numpy):
+    graph = LinkGraph.from_database('https://example.com', db_name, use_numpy=use_numpy)
+
+    ranks = by_url(graph, graph.pagerank(tolerance=1e-10))
+    assert sum(ranks.values()) == pytest.approx(1.0)
+    assert ranks['https://example.com/blog/post-2/'] > ranks['https://example.com/about/']
+    assert ranks['https://example.com/about/'] > ranks['https://example.com/orphan/']
+    assert ranks['https://example.com/orphan/'] == pytest.approx(ranks['https://example.com/island/'])
+
+@pytest.mark.skipif(np is None, reason='NumPy is not installed')
+def test_backends_agree(db_name):
+    fallback = LinkGraph.from_database('https://example.com', db_name, use_numpy=False)
+    vectorized = LinkGraph.from_database('https://example.com', db_name, use_numpy=True)
+
+    assert list(fallback.inlink_counts()) == list(vectorized.inlink_counts())
+    assert list(fallback.click_depths('https://example.com/')) == list(vectorized.click_depths('https://example.com/'))
+    assert list(fallback.pagerank()) == pytest.approx(list(vectorized.pagerank()))
+
+@pytest.fixture
+def redirects_db(tmp_path):
+    db_name = str(tmp_path / 'redirects.db')
+    initialize_database(db_name)
+    with sqlite3.connect(db_name) as conn:
+        conn.executemany(
+            "INSERT INTO tb_pages (url, referring_pages, redirect_target, depth) VALUES (?, ?, ?, ?)",
+            [
+                ('https://example.com/', None, None, 0),
+                ('https://example.com/old/', 'https://example.com/', 'https://example.com/new/', 1),
+                ('https://example.com/new/', None, None, 1),
+                ('https://example.com/d/', 'https://example.com/new/', None, 2),
+                ('https://example.com/slash', None, 'https://example.com/slash', 1),
+            ]
+        )
+    return db_name
+
+@pytest.mark.parametrize('use_numpy', BACKENDS)
+@pytest.mark.parametrize('compact', [False, True])
+def test_redirects_are_followed_without_a_click(redirects_db, tmp_path, use_numpy, compact):
+    with sqlite3.connect(redirects_db) as conn:
+        stored_depths = dict(conn.execute('SELECT url, depth FROM tb_pages'))
+
+    if compact:
+        compact_db = str(tmp_path / 'compact.db')
+        migrate_to_compact(redirects_db, compact_db)
+        graph = LinkGraph.from_compact_database('https://example.com', compact_db, use_numpy=use_numpy)
+    else:
+        graph = LinkGraph.from_database('https://example.com', redirects_db, use_numpy=use_numpy)
+    depths = by_url(graph, graph.click_depths('https://example.com/'))
+    inlinks = by_url(graph, graph.inlink_counts())
+
+    assert {url: depths[url] for url in stored_depths if url != 'https://example.com/slash'} == {
+        url: depth for url, depth in stored_depths.items() if url != 'https://example.com/slash'
+    }
+    assert depths['https://example.com/slash'] == UNREACHABLE
+    assert inlinks['https://example.com/new/'] == 1
+    ranks = by_url(graph, graph.pagerank())
+    assert ranks['https://example.com/new/'] > ranks['https://example.com/slash']
+
+def test_node_id_lookup():
+    urls = [f'https://example.com/page-{i}/' for i in range(1000)]
+    graph = LinkGraph(urls, [], [], use_numpy=False)
+    assert graph.node_id('https://example.com/page-999') == 999
+    assert graph.node_id('https://example.com/page-0/') == 0
+    with pytest.raises(KeyError):
+        graph.node_id('https://example.com/page-1000/')
+
+def test_from_compact_database(db_name, tmp_path):
+    compact_db = str(tmp_path / 'compact.db')
+    migrate_to_compact(db_name, compact_db)
+
+    legacy = LinkGraph.from_database('https://example.com', db_name)
+    compact = LinkGraph.from_compact_database('https://example.com', compact_db)
+
+    assert sorted(compact.urls) == sorted(legacy.urls)
+    assert compact.num_edges == legacy.num_edges
+    assert by_url(compact, compact.inlink_counts()) == by_url(legacy, legacy.inlink_counts())
+    assert compact.orphan_pages() == legacy.orphan_pages()
+
+def test_analyze_link_graph(db_name):
+    pages = {page['url']: page for page in analyze_link_graph('https://example.com/', db_name)}
+
+    assert pages['https://example.com/blog/post-1/']['depth'] == 2
+    assert pages['https://example.com/orphan/']['depth'] is None
+    assert pages['https://example.com/orphan/']['orphan'] is True
+    assert pages['https://example.com/']['orphan'] is False
+    assert pages['https://example.com/blog/']['outlinks'] == 2
@@ -10,21 +10,34 @@ def setup_database():
 
 def test_recrawl_url():
     base_url = 'https://example.com'
-    specific_url = f"{base_url}/specific-page"
-    insert_if_not_exists(specific_url, db_name='test_db.db')  # Ensure URL is in the database
+    specific_url = f"{base_url}/specific-page/"
+    with patch('bertha.database_operations.is_actual_page', return_value=True):
+        insert_if_not_exists(specific_url, db_name='test_db.db')  # Ensure URL is in the database
 
-    # Mock check_http_status to return a 500 status code
-    with patch('bertha.utils.check_http_status') as mock_check_http_status:
-        mock_check_http_status.return_value = 500
-        recrawl_url(specific_url, db_name='test_db.db')
-
-        # Ensure the mock was called as expected
-        mock_check_http_status.assert_called_with(specific_url)
-
-    # Fetch the data from the database
-    data = fetch_url_data(specific_url, db_name='test_db.db')
-    print(f"DEBUG: Data fetched for {specific_url}: {data}")  # Debugging line
+    # The URL answers with a 500 status code, to the only request made
+    page = {"status_code": 500, "content_type": 'text/html', "body": None, "aborted": None,
+            "redirects": [], "url": specific_url}
+    with patch('bertha.crawl_pages.fetch_page', return_value=page) as mock_fetch, \
+            patch('bertha.utils.check_http_status') as mock_check_http_status:
+        assert recrawl_url(specific_url, db_name='test_db.db') is None
+    mock_fetch.assert_called_once()
+    mock_check_http_status.assert_not_called()
 
     # Assert that the status code is correctly recorded as 500
+    data = fetch_url_data(specific_url, db_name='test_db.db')
     assert data is not None  # Ensure data is returned
     assert data['status_code'] == 500  # Check that the status code is as expected
+
+def test_crawl_website_resolves_through_the_shared_session():
+    from bertha.utils import http_client, shared_dns_cache
+    seen = []
+
+    def run_crawl_session(*args, **kwargs):
+        seen.append((http_client(), shared_dns_cache()))
+
+    with patch('bertha.main.run_crawl_session', side_effect=run_crawl_session):
+        crawl_website('https://example.com', db_name='test_db.db')
+
+    session, dns_cache = seen[0]
+    assert session.get_adapter('https://example.com/').dns_cache is dns_cache
+    assert shared_dns_cache() is None
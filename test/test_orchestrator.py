@@ -0,0 +1,80 @@
+# test/test_orchestrator.py
+
+import json
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from bertha.host_limiter import HostLimiter
+from bertha.orchestrator import crawl_sites, load_sites
+
+@pytest.fixture
+def db_name(tmp_path):
+    return str(tmp_path / 'test_sites.db')
+
+def test_load_sites_from_json(tmp_path):
+    path = tmp_path / 'sites.json'
+    path.write_text(json.dumps({"gap": 7, "sites": ["https://a.example.com", {"url": "https://b.example.com", "gap": 1}]}))
+    assert load_sites(str(path)) == [
+        {"url": "https://a.example.com", "gap": 7},
+        {"url": "https://b.example.com", "gap": 1},
+    ]
+
+def test_load_sites_from_text(tmp_path):
+    path = tmp_path / 'sites.txt'
+    path.write_text("# clients\nhttps://a.example.com\n\nhttps://b.example.com  # shop\n")
+    assert load_sites(str(path)) == [{"url": "https://a.example.com"}, {"url": "https://b.example.com"}]
+
+def test_sites_run_concurrently_and_fail_independently(db_name):
+    def fake_session(base_url, gap, *args, **kwargs):
+        time.sleep(0.3)
+        if 'broken' in base_url:
+            raise RuntimeError('sitemap exploded')
+        return 1
+
+    sites = ['https://a.example.com', 'https://broken.example.com', {'url': 'https://c.example.com', 'gap': 3}]
+    start = time.monotonic()
+    with patch('bertha.orchestrator.run_crawl_session', side_effect=fake_session) as mock_session:
+        results = crawl_sites(sites, db_name=db_name, max_workers=3)
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 0.8
+    assert [result["status"] for result in results] == ["completed", "failed", "completed"]
+    assert 'sitemap exploded' in results[1]["error"]
+    assert all(result["pages"] == 0 for result in results)
+    gaps = {call.args[0]: call.args[1] for call in mock_session.call_args_list}
+    assert gaps == {'https://a.example.com': 30, 'https://broken.example.com': 30, 'https://c.example.com': 3}
+
+def test_site_without_a_main_page_fails(db_name):
+    with patch('bertha.database_operations.is_actual_page', return_value=False):
+        results = crawl_sites(['http://nonexistent.invalid'], db_name=db_name, retries=1)
+
+    assert results[0]["status"] == "failed"
+    assert results[0]["error"].startswith('MainUrlInsertionError')
+    assert results[0]["pages"] == 0
+
+def test_host_limiter_caps_concurrency_per_host():
+    limiter = HostLimiter(max_per_host=1)
+    in_flight = {"a.example.com": 0, "b.example.com": 0}
+    peak = {"a.example.com": 0, "b.example.com": 0}
+    lock = threading.Lock()
+
+    def request(url, host):
+        with limiter.slot(url):
+            with lock:
+                in_flight[host] += 1
+                peak[host] = max(peak[host], in_flight[host])
+            time.sleep(0.02)
+            with lock:
+                in_flight[host] -= 1
+
+    threads = [
+        threading.Thread(target=request, args=(f'https://{host}/{i}', host))
+        for i in range(5) for host in in_flight
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak == {"a.example.com": 1, "b.example.com": 1}
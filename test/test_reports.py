@@ -0,0 +1,135 @@
+# test/test_reports.py
+
+import sqlite3
+from datetime import datetime, timedelta
+import pytest
+from unittest.mock import patch
+from bertha import reports
+from bertha.database_setup import initialize_database
+from bertha.main import indexible_pages
+from bertha.reports import (
+    prefix_range, iter_indexible_pages, iter_redirect_pages, iter_client_error_pages,
+    iter_server_error_pages, iter_stale_pages, site_counts, clear_report_cache, report_host
+)
+
+RECENT = datetime.now().strftime('%Y%m%d%H%M%S')
+OLD = (datetime.now() - timedelta(days=60)).strftime('%Y%m%d%H%M%S')
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / 'test_db.db')
+    initialize_database(db_name)
+    pages = [
+        ('https://example.com/', 1, 200, 1, RECENT),
+        ('https://example.com/blog/', 1, 200, 1, OLD),
+        ('https://example.com/blog/post/', 1, 200, 0, RECENT),
+        ('https://example.com/moved/', 0, 301, None, RECENT),
+        ('https://example.com/missing/', 0, 404, None, RECENT),
+        ('https://example.com/gone/', 0, 410, None, OLD),
+        ('https://example.com/broken/', 0, 503, None, RECENT),
+        ('https://example.com/new/', None, None, None, None),
+        ('https://example.org/', 1, 200, 1, RECENT),
+        ('https://EXAMPLE.com/other-case/', 1, 200, 1, RECENT),
+    ]
+    with sqlite3.connect(db_name) as conn:
+        conn.executemany('''
+            INSERT INTO tb_pages (url, successful_page_fetch, status_code, robots_index, dt_last_crawl)
+            VALUES (?, ?, ?, ?, ?)
+        ''', pages)
+    clear_report_cache()
+    return db_name
+
+def test_prefix_range():
+    assert prefix_range('https://example.com/') == ('https://example.com/', 'https://example.com0')
+    assert prefix_range('') == ('', None)
+
+def test_iter_indexible_pages(db_name):
+    assert list(iter_indexible_pages('https://example.com/', db_name, batch_size=1)) == [
+        'https://example.com/', 'https://example.com/blog/'
+    ]
+    assert list(iter_indexible_pages('https://example.com/blog/', db_name)) == ['https://example.com/blog/']
+    assert indexible_pages('https://example.com', db_name) == ['https://example.com/', 'https://example.com/blog/']
+
+def test_iter_indexible_pages_uses_index(db_name):
+    with sqlite3.connect(db_name) as conn:
+        plan = conn.execute('''
+            EXPLAIN QUERY PLAN SELECT url FROM tb_pages
+            WHERE successful_page_fetch = 1 AND robots_index = 1 AND url >= ? AND url < ? AND url > ?
+            ORDER BY url LIMIT ?
+        ''', ('https://example.com/', 'https://example.com0', '', 10)).fetchall()
+    assert 'idx_pages_indexible' in plan[0][3]
+
+def test_status_reports(db_name):
+    assert list(iter_redirect_pages('https://example.com/', db_name)) == [
+        {"url": "https://example.com/moved/", "status_code": 301}
+    ]
+    assert [page["url"] for page in iter_client_error_pages('https://example.com/', db_name, batch_size=1)] == [
+        'https://example.com/missing/', 'https://example.com/gone/'
+    ]
+    assert [page["url"] for page in iter_server_error_pages('https://example.com/', db_name)] == [
+        'https://example.com/broken/'
+    ]
+
+def test_iter_stale_pages(db_name):
+    stale = list(iter_stale_pages('https://example.com/', 30, db_name, batch_size=2))
+    assert [page["url"] for page in stale] == [
+        'https://example.com/blog/', 'https://example.com/gone/', 'https://example.com/new/'
+    ]
+    assert stale[2]["dt_last_crawl"] is None
+
+def test_site_counts(db_name):
+    assert site_counts('https://example.com/', db_name) == {
+        'pages': 8, 'crawled': 7, 'successful': 3, 'indexible': 2,
+        'redirects': 1, 'client_errors': 2, 'server_errors': 1,
+    }
+    assert site_counts('https://example.org/', db_name)['pages'] == 1
+
+def host_version(conn, host):
+    return conn.execute('SELECT version FROM tb_report_versions WHERE host = ?', (host,)).fetchone()[0]
+
+def test_report_host():
+    assert report_host('https://example.com/blog/') == 'https://example.com'
+    assert report_host('https://example.com/') == 'https://example.com'
+    assert report_host('https://example.com') == ''
+    assert report_host('https://exam') == ''
+
+def test_site_counts_cached_until_write(db_name):
+    site_counts('https://example.com/', db_name)
+
+    with sqlite3.connect(db_name) as conn:
+        # A write that does not change the counts keeps the cache
+        conn.execute("UPDATE tb_pages SET crawl_priority = 1.0")
+        conn.commit()
+        version = host_version(conn, 'https://example.com')
+    assert site_counts('https://example.com/', db_name)['indexible'] == 2
+
+    with sqlite3.connect(db_name) as conn:
+        conn.execute("UPDATE tb_pages SET robots_index = 1 WHERE url = 'https://example.com/blog/post/'")
+        conn.commit()
+        assert host_version(conn, 'https://example.com') == version + 1
+    assert site_counts('https://example.com/', db_name)['indexible'] == 3
+
+    with sqlite3.connect(db_name) as conn:
+        conn.execute("INSERT INTO tb_pages (url) VALUES ('https://example.com/another/')")
+        conn.commit()
+    assert site_counts('https://example.com/', db_name)['pages'] == 9
+
+def test_writes_to_other_hosts_keep_the_cache(db_name):
+    site_counts('https://example.com/', db_name)
+    site_counts('https://example.', db_name)
+
+    with sqlite3.connect(db_name) as conn:
+        com_version, total_version = host_version(conn, 'https://example.com'), host_version(conn, '')
+        conn.execute("UPDATE tb_pages SET status_code = 500 WHERE url = 'https://example.org/'")
+        conn.execute("INSERT INTO tb_pages (url) VALUES ('https://example.org/another/')")
+        conn.commit()
+        assert host_version(conn, 'https://example.com') == com_version
+        assert host_version(conn, 'https://example.org') > 0
+        assert host_version(conn, '') == total_version + 2
+
+    with patch('bertha.reports._count_cache', wraps=reports._count_cache) as cache:
+        assert site_counts('https://example.com/', db_name)['pages'] == 8
+        # Served from the cache, not recounted
+        cache.__setitem__.assert_not_called()
+    # A prefix spanning several hosts sees every write
+    assert site_counts('https://example.', db_name)['server_errors'] == 2
@@ -0,0 +1,151 @@
+# test/test_retry_policy.py
+
+import socket
+import sqlite3
+from unittest.mock import patch
+import pytest
+import requests
+from bertha.retry_policy import RetryPolicy, is_transient, retry_counters, reset_retry_counters
+from bertha.database_setup import initialize_database
+from bertha.database_operations import insert_if_not_exists, initialize_database_with_retries
+from bertha.exceptions import DatabaseInitializationError
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def failing(errors, result='done'):
+    errors = list(errors)
+
+    def func():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return func
+
+
+@pytest.fixture
+def fake_time():
+    reset_retry_counters()
+    return FakeTime()
+
+
+def make_policy(fake_time, **settings):
+    return RetryPolicy('test', sleep=fake_time.sleep, clock=fake_time.clock, jitter=0, **settings)
+
+
+def test_is_transient():
+    assert is_transient(sqlite3.OperationalError('database is locked'))
+    assert is_transient(ConnectionError())
+    assert is_transient(TimeoutError())
+    assert not is_transient(sqlite3.OperationalError('no such table: tb_pages'))
+    assert not is_transient(ValueError())
+    assert is_transient(socket.gaierror(socket.EAI_AGAIN, 'Temporary failure in name resolution'))
+    assert is_transient(requests.exceptions.ConnectTimeout())
+    assert is_transient(requests.exceptions.ChunkedEncodingError())
+    assert not is_transient(requests.exceptions.InvalidURL())
+    assert not is_transient(PermissionError(13, 'Permission denied'))
+    assert not is_transient(FileNotFoundError(2, 'No such file or directory'))
+    assert not is_transient(IsADirectoryError(21, 'Is a directory'))
+
+
+def test_exponential_backoff_until_success(fake_time):
+    policy = make_policy(fake_time, attempts=5, base_delay=1, max_delay=3)
+    assert policy.call('Test', failing([ConnectionError()] * 3)) == 'done'
+    assert fake_time.sleeps == [1, 2, 3]
+    assert retry_counters()['test'] == {
+        "calls": 1, "retries": 3, "recovered": 1, "exhausted": 0, "failed": 0, "sleep_seconds": 6,
+    }
+
+
+def test_jitter_stays_under_the_backoff():
+    policy = RetryPolicy('test', base_delay=1, max_delay=30, jitter=1)
+    delays = [policy.delay(3) for _ in range(100)]
+    assert all(0 <= delay <= 8 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_gives_up_after_attempts(fake_time):
+    policy = make_policy(fake_time, attempts=3, base_delay=1)
+    with pytest.raises(ConnectionError):
+        policy.call('Test', failing([ConnectionError()] * 5))
+    assert len(fake_time.sleeps) == 2
+    assert retry_counters()['test']["exhausted"] == 1
+
+
+def test_permanent_errors_are_not_retried(fake_time):
+    policy = make_policy(fake_time)
+    with pytest.raises(sqlite3.OperationalError):
+        policy.call('Test', failing([sqlite3.OperationalError('no such table: tb_pages')]))
+    assert fake_time.sleeps == []
+    assert retry_counters()['test']["failed"] == 1
+
+
+def test_deadline_stops_retries(fake_time):
+    policy = make_policy(fake_time, attempts=10, base_delay=1, max_delay=10, deadline=5)
+    with pytest.raises(ConnectionError):
+        policy.call('Test', failing([ConnectionError()] * 10))
+    # Waits of 1 and 2 seconds; the next wait of 4 would end past the deadline
+    assert fake_time.sleeps == [1, 2]
+
+
+def test_nested_policies_do_not_multiply(fake_time):
+    inner_calls = []
+    inner = make_policy(fake_time, attempts=3, base_delay=1)
+    outer = make_policy(fake_time, attempts=3, base_delay=1)
+
+    def inner_operation():
+        inner_calls.append(1)
+        raise sqlite3.OperationalError('database is locked')
+
+    with pytest.raises(sqlite3.OperationalError):
+        outer.call('Outer', inner.call, 'Inner', inner_operation)
+    assert len(inner_calls) == 3
+
+
+def test_inner_policy_keeps_to_outer_deadline(fake_time):
+    inner = make_policy(fake_time, attempts=10, base_delay=1, max_delay=1)
+    outer = make_policy(fake_time, attempts=2, base_delay=1, deadline=3)
+    with pytest.raises(ConnectionError):
+        outer.call('Outer', inner.call, 'Inner', failing([ConnectionError()] * 10))
+    assert fake_time.sleeps == [1, 1, 1]
+
+
+def test_insert_retries_when_database_is_locked(tmp_path, fake_time):
+    db_name = str(tmp_path / 'test_db.db')
+    initialize_database(db_name)
+    connect = sqlite3.connect
+    attempts = []
+
+    def locked_once(*args, **kwargs):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError('database is locked')
+        return connect(*args, **kwargs)
+
+    with patch('bertha.database_operations.sqlite3.connect', side_effect=locked_once), \
+            patch('bertha.retry_policy.time.sleep'), \
+            patch('bertha.database_operations.is_actual_page', return_value=True):
+        insert_if_not_exists('https://example.com/', db_name=db_name)
+
+    with sqlite3.connect(db_name) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM tb_pages').fetchone()[0] == 1
+    assert retry_counters()['database']["recovered"] == 1
+
+
+def test_initialization_error_is_not_retried(tmp_path, fake_time):
+    with patch('bertha.database_operations.initialize_database',
+               side_effect=sqlite3.OperationalError('unable to open database file')) as mock_initialize:
+        with pytest.raises(DatabaseInitializationError):
+            initialize_database_with_retries(5, 30, str(tmp_path / 'test_db.db'))
+    assert mock_initialize.call_count == 1
@@ -0,0 +1,111 @@
+# test/test_scheduler.py
+
+import sqlite3
+import threading
+import pytest
+from unittest.mock import patch
+from bertha.database_setup import initialize_database, referring_pages_sql
+from bertha.database_operations import (
+    insert_if_not_exists, update_referring_pages, update_crawl_info, write_lock
+)
+from bertha.scheduler import score_url, refresh_crawl_priorities, next_crawl_batch
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / 'test_scheduler.db')
+    initialize_database(db_name)
+    with patch('bertha.database_operations.is_actual_page', return_value=True):
+        insert_if_not_exists('https://example.com/', db_name=db_name, depth=0)
+        insert_if_not_exists('https://example.com/deep/', db_name=db_name, depth=4)
+        insert_if_not_exists('https://example.com/popular/', db_name=db_name, depth=4)
+        insert_if_not_exists('https://example.com/orphan/', db_name=db_name)
+    return db_name
+
+def test_score_prefers_shallow_linked_and_stale_pages():
+    assert score_url(0, 0, False, None, 0, 0) > score_url(5, 0, False, None, 0, 0)
+    assert score_url(2, 50, False, None, 0, 0) > score_url(2, 0, False, None, 0, 0)
+    assert score_url(2, 0, True, None, 0, 0) > score_url(2, 0, False, None, 0, 0)
+    assert score_url(2, 0, False, 90, 0, 1) > score_url(2, 0, False, 1, 0, 1)
+    assert score_url(2, 0, False, 10, 4, 4) > score_url(2, 0, False, 10, 0, 4)
+
+def test_next_batch_is_ordered_by_priority(db_name):
+    for referrer in ('https://example.com/a/', 'https://example.com/b/', 'https://example.com/c/'):
+        update_referring_pages('https://example.com/popular/', referrer, db_name=db_name)
+
+    batch = next_crawl_batch('https://example.com', gap=30, batch_size=3, db_name=db_name)
+    assert batch == ['https://example.com/', 'https://example.com/popular/', 'https://example.com/orphan/']
+
+def test_duplicate_referrers_are_counted_once(db_name):
+    update_referring_pages('https://example.com/deep/', 'https://example.com/', db_name=db_name)
+    update_referring_pages('https://example.com/deep/', 'https://example.com/', db_name=db_name)
+
+    with sqlite3.connect(db_name) as conn:
+        inlinks, referring_pages = conn.execute(
+            f'SELECT inlinks, {referring_pages_sql()} FROM tb_pages WHERE url = ?', ('https://example.com/deep/',)
+        ).fetchone()
+    assert inlinks == 1
+    assert referring_pages == 'https://example.com/'
+
+def test_shorter_path_lowers_depth(db_name):
+    with patch('bertha.database_operations.is_actual_page', return_value=True):
+        insert_if_not_exists('https://example.com/deep/', db_name=db_name, depth=1)
+        insert_if_not_exists('https://example.com/deep/', db_name=db_name, depth=3)
+
+    with sqlite3.connect(db_name) as conn:
+        depth = conn.execute('SELECT depth FROM tb_pages WHERE url = ?', ('https://example.com/deep/',)).fetchone()[0]
+    assert depth == 1
+
+def test_status_changes_are_counted(db_name):
+    update_crawl_info('https://example.com/deep/', 200, True, db_name=db_name)
+    update_crawl_info('https://example.com/deep/', 200, True, db_name=db_name)
+    update_crawl_info('https://example.com/deep/', 404, False, db_name=db_name)
+
+    with sqlite3.connect(db_name) as conn:
+        crawl_count, change_count, priority = conn.execute(
+            'SELECT crawl_count, change_count, crawl_priority FROM tb_pages WHERE url = ?',
+            ('https://example.com/deep/',)
+        ).fetchone()
+    assert (crawl_count, change_count, priority) == (3, 1, None)
+
+def test_refresh_scores_every_url(db_name):
+    assert refresh_crawl_priorities('https://example.com', db_name) == 4
+    assert refresh_crawl_priorities('https://example.com', db_name, only_missing=True) == 0
+
+def test_refresh_runs_in_batches_under_the_write_lock(db_name):
+    result = []
+    with write_lock(db_name):
+        refresh = threading.Thread(
+            target=lambda: result.append(refresh_crawl_priorities('https://example.com', db_name, batch_size=3))
+        )
+        refresh.start()
+        refresh.join(timeout=0.2)
+        # Waits for the lock instead of racing other writers for the database
+        assert refresh.is_alive()
+    refresh.join(timeout=5)
+    assert result == [4]
+
+def test_batch_query_uses_priority_index(db_name):
+    with sqlite3.connect(db_name) as conn:
+        plan = conn.execute('''
+            EXPLAIN QUERY PLAN
+            SELECT url FROM tb_pages
+            WHERE (dt_last_crawl IS NULL OR dt_last_crawl < ?)
+            AND (dt_retry_after IS NULL OR dt_retry_after <= ?) AND url LIKE ?
+            ORDER BY crawl_priority DESC LIMIT 10
+        ''', ('20260101000000', '20260101000000', '%example.com%')).fetchall()
+    assert any('idx_pages_crawl_priority' in row[-1] for row in plan)
+
+def test_missing_priorities_are_found_through_the_index(db_name):
+    with sqlite3.connect(db_name) as conn:
+        plan = conn.execute('''
+            EXPLAIN QUERY PLAN
+            SELECT id FROM tb_pages WHERE crawl_priority IS NULL LIMIT 100
+        ''').fetchall()
+    assert any(row[-1].startswith('SEARCH') and 'idx_pages_crawl_priority' in row[-1] for row in plan)
+
+    with patch('bertha.database_operations.is_actual_page', return_value=True):
+        insert_if_not_exists('https://example.org/', db_name=db_name, depth=0)
+    assert refresh_crawl_priorities('https://example.com', db_name, only_missing=True, batch_size=2) == 5
+    assert refresh_crawl_priorities('https://example.com', db_name, only_missing=True) == 0
+    with sqlite3.connect(db_name) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM tb_pages WHERE crawl_priority IS NULL').fetchone()[0] == 0
@@ -0,0 +1,81 @@
+# test/test_sitemap_stream.py
+
+import gzip
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import pytest
+from bertha.sitemap_stream import iter_sitemap_urls, sitemap_locations
+
+NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def urlset(urls):
+    entries = ''.join(f'<url><loc>{url}</loc><lastmod>2024-01-01</lastmod></url>' for url in urls)
+    return f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="{NAMESPACE}">{entries}</urlset>'.encode()
+
+
+def sitemap_index(urls):
+    entries = ''.join(f'<sitemap><loc>{url}</loc></sitemap>' for url in urls)
+    return f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="{NAMESPACE}">{entries}</sitemapindex>'.encode()
+
+
+@pytest.fixture
+def site():
+    files = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = files.get(self.path)
+            if body is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        yield base_url, files
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_falls_back_to_sitemap_xml(site):
+    base_url, files = site
+    files['/sitemap.xml'] = urlset([f'{base_url}/', f'{base_url}/about/'])
+
+    assert sitemap_locations(base_url) == [f'{base_url}/sitemap.xml']
+    assert list(iter_sitemap_urls(base_url)) == [
+        (f'{base_url}/', f'{base_url}/sitemap.xml'),
+        (f'{base_url}/about/', f'{base_url}/sitemap.xml'),
+    ]
+
+
+def test_follows_robots_and_indexes(site):
+    base_url, files = site
+    files['/robots.txt'] = f'User-agent: *\nDisallow: /private/\nSitemap: {base_url}/index.xml\n'.encode()
+    files['/index.xml'] = sitemap_index([f'{base_url}/pages.xml.gz', f'{base_url}/posts.xml', f'{base_url}/pages.xml.gz'])
+    pages = [f'{base_url}/page-{i}/' for i in range(500)]
+    files['/pages.xml.gz'] = gzip.compress(urlset(pages))
+    files['/posts.xml'] = urlset([f'{base_url}/post/'])
+
+    urls = list(iter_sitemap_urls(base_url))
+    assert urls == [(url, f'{base_url}/pages.xml.gz') for url in pages] + [(f'{base_url}/post/', f'{base_url}/posts.xml')]
+
+
+def test_broken_sitemaps_are_skipped(site):
+    base_url, files = site
+    files['/robots.txt'] = f'Sitemap: {base_url}/broken.xml\nSitemap: {base_url}/missing.xml\nSitemap: {base_url}/ok.xml\n'.encode()
+    files['/broken.xml'] = urlset([f'{base_url}/kept/'])[:-20]
+    files['/ok.xml'] = urlset([f'{base_url}/ok/'])
+
+    assert [url for url, _ in iter_sitemap_urls(base_url)] == [f'{base_url}/kept/', f'{base_url}/ok/']
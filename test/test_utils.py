@@ -1,6 +1,6 @@
 import pytest
-from unittest.mock import patch
-from bertha.utils import check_http_status, get_robots
+from unittest.mock import patch, MagicMock
+from bertha.utils import check_http_status, get_robots, fetch_page
 
 @pytest.fixture(scope="module")
 def base_url():
@@ -27,3 +27,69 @@ def test_get_robots(mock_get, base_url):
     robots = get_robots(base_url)
     assert robots is not None
     assert robots['/private/']['index'] == False
+
+def _streamed_response(status_code=200, headers=None, chunks=(), transferred=None, history=()):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.history = list(history)
+    response.iter_content.return_value = iter(chunks)
+    response.raw.tell.return_value = transferred
+    return response
+
+@patch('bertha.utils.requests.get')
+def test_fetch_page_reads_html_body(mock_get):
+    mock_get.return_value = _streamed_response(headers={'Content-Type': 'text/html; charset=utf-8'}, chunks=[b'<html>', b'</html>'])
+
+    page = fetch_page('https://example.com/')
+    assert page['status_code'] == 200
+    assert page['body'] == b'<html></html>'
+    assert page['aborted'] is None
+    assert mock_get.call_args.kwargs['stream'] is True
+    mock_get.return_value.close.assert_called_once()
+
+@patch('bertha.utils.requests.get')
+def test_fetch_page_skips_non_html_body(mock_get):
+    mock_get.return_value = _streamed_response(headers={'Content-Type': 'video/mp4'}, chunks=[b'x' * 1024])
+
+    page = fetch_page('https://example.com/movie')
+    assert page['status_code'] == 200
+    assert page['body'] is None
+    assert page['aborted'] == 'content_type'
+    mock_get.return_value.iter_content.assert_not_called()
+
+@patch('bertha.utils.requests.get')
+def test_fetch_page_truncates_large_body(mock_get):
+    mock_get.return_value = _streamed_response(headers={'Content-Type': 'text/html'}, chunks=[b'a' * 600, b'b' * 600, b'c' * 600])
+
+    page = fetch_page('https://example.com/', max_body_size=1000)
+    assert len(page['body']) == 1000
+    assert page['aborted'] == 'too_large'
+
+@patch('bertha.utils.requests.get')
+def test_fetch_page_drops_decompression_bomb(mock_get):
+    chunk = b'\0' * 65536
+    mock_get.return_value = _streamed_response(
+        headers={'Content-Type': 'text/html', 'Content-Encoding': 'gzip'},
+        chunks=[chunk] * 8,
+        transferred=1024
+    )
+
+    page = fetch_page('https://example.com/', max_body_size=10 * 1024 * 1024)
+    assert page['body'] is None
+    assert page['aborted'] == 'decompression_bomb'
+
+@patch('bertha.utils.requests.get')
+def test_fetch_page_records_redirect_chain(mock_get):
+    first_hop = MagicMock(url='http://example.com/old', status_code=301, headers={'Location': 'https://example.com/old'})
+    second_hop = MagicMock(url='https://example.com/old', status_code=302, headers={'Location': '/new/'})
+    mock_get.return_value = _streamed_response(headers={'Content-Type': 'text/html'}, chunks=[b'<html></html>'],
+                                               history=[first_hop, second_hop])
+
+    page = fetch_page('http://example.com/old')
+    assert page["status_code"] == 200
+    assert page["url"] == 'https://example.com/new/'
+    assert page["redirects"] == [
+        {"url": 'http://example.com/old', "status_code": 301, "location": 'https://example.com/old'},
+        {"url": 'https://example.com/old', "status_code": 302, "location": 'https://example.com/new/'},
+    ]